@@ -0,0 +1,15 @@
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from config import settings
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints need the ADMIN_TOKEN in X-Admin-Token, and are disabled without one"""
+    if settings.admin_token is None:
+        # pas de jeton configuré: ne rien exposer plutôt qu'ouvrir l'administration
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
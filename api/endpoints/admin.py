@@ -0,0 +1,42 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from api.dependencies import require_admin_token
+from services.cleanup_service import cleanup_service
+from services.index_advisor import index_advisor
+
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+@router.get("/cleanup/stats")
+async def cleanup_stats():
+    """Storage janitor counters (evictions, bytes freed, current usage)"""
+    return cleanup_service.stats()
+
+@router.post("/cleanup/run")
+async def run_cleanup():
+    """Run one cleanup pass now instead of waiting for the next interval"""
+    return await cleanup_service.run_once()
+
+@router.get("/indexes")
+async def list_index_suggestions(content_hash: Optional[str] = None):
+    """Indexes suggested from repeated full scans, with their status"""
+    return index_advisor.list(content_hash)
+
+@router.post("/indexes/{suggestion_id}/apply")
+async def apply_index(suggestion_id: str):
+    """Build a suggested index now (on a copy of the database) and switch sessions to it"""
+    try:
+        return await index_advisor.apply(suggestion_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.post("/indexes/{suggestion_id}/undo")
+async def undo_index(suggestion_id: str):
+    """Drop an applied index and switch sessions to the database without it"""
+    try:
+        return await index_advisor.undo(suggestion_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
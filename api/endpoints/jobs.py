@@ -0,0 +1,72 @@
+from fastapi import APIRouter, Depends, HTTPException
+from services.file_service import FileService
+from services.job_queue import FAILED, SUCCEEDED, QueueFullError, job_queue
+from services.session_service import SessionService
+from models.schemas import JobRequest
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.post("/{session_id}", status_code=202)
+async def submit_job(
+    session_id: str,
+    request: JobRequest,
+    file_service: FileService = Depends(),
+    session_service: SessionService = Depends()
+):
+    """
+    Queue a question and return its job at once; poll GET /jobs/{job_id} for
+    the result. Use it for questions that may outlast the HTTP timeout.
+    """
+    if not settings.jobs_enabled:
+        raise HTTPException(status_code=404, detail="Background jobs are disabled (JOBS_ENABLED=false)")
+    try:
+        # la session et sa base doivent exister au moment de la soumission
+        session_service.get_api_keys(session_id)
+        db_file = file_service.get_database_file(session_id, request.database)
+        if request.attach:
+            file_service.attached_databases(session_id, request.attach, db_file)
+        job = await job_queue.submit(
+            session_id, request.question, request.answer_mode, request.priority,
+            database=request.database, attach=request.attach
+        )
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        logger.error(f"Value error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    logger.info(f"Queued job {job['job_id']} for session: {session_id}")
+    return job
+
+
+@router.get("/session/{session_id}")
+async def list_jobs(session_id: str):
+    """Most recent jobs of a session, newest first"""
+    return {"session_id": session_id, "jobs": await job_queue.list_jobs(session_id)}
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Status of a job, with its result once succeeded (or its last error)"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.delete("/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one (its status turns "cancelled" once stopped)"""
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job["status"] in (SUCCEEDED, FAILED):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already {job['status']}")
+    return job
@@ -0,0 +1,89 @@
+from typing import Iterable
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
+from api.dependencies import require_admin_token
+from models.database import database_registry
+from services.fast_path import fast_path
+from services.file_service import manifest_index
+from services.job_queue import job_queue
+from services.llm_service import llm_clients
+from services.query_service import question_flights
+from services.result_cache import result_cache
+from services.schema_linker import schema_linker
+from services.schema_service import schema_cache
+from services.session_store import session_store
+from services.sql_cache import sql_cache
+from utils.metrics import CONTENT_TYPE, Family, metrics
+
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+
+@metrics.collector
+def service_metrics() -> Iterable[Family]:
+    """Cache ratios, in-flight pipelines, fast path, schema pruning and job queue counts, read from stats() at scrape time"""
+    caches = {
+        "sql": sql_cache.stats(),
+        "result": result_cache.stats(),
+        "schema": schema_cache.stats(),
+        "database": database_registry.stats(),
+        "llm_client": llm_clients.stats(),
+        "session": session_store.stats(),
+        "manifest": manifest_index.stats(),
+    }
+    hits, misses, ratios, sizes = [], [], [], []
+    for name, stats in caches.items():
+        labels = {"cache": name}
+        # le cache SQL distingue les correspondances exactes et similaires
+        hit_count = stats.get("hits", stats.get("exact_hits", 0) + stats.get("similar_hits", 0))
+        lookups = hit_count + stats["misses"]
+        hits.append((labels, hit_count))
+        misses.append((labels, stats["misses"]))
+        ratios.append((labels, hit_count / lookups if lookups else 0.0))
+        sizes.append((labels, stats.get("size", stats.get("cached", 0))))
+    yield "sql_qa_cache_hits_total", "counter", "Cache lookups that found an entry", hits
+    yield "sql_qa_cache_misses_total", "counter", "Cache lookups that found nothing", misses
+    yield "sql_qa_cache_hit_ratio", "gauge", "Hits over lookups since start", ratios
+    yield "sql_qa_cache_entries", "gauge", "Entries currently cached", sizes
+
+    databases = caches["database"]
+    yield "sql_qa_database_memory_bytes", "gauge", "Bytes of the in-memory hot copies of small databases", [
+        ({}, databases["memory_bytes"])
+    ]
+    yield "sql_qa_database_hot_copies", "gauge", "Databases served from an in-memory hot copy", [
+        ({}, databases["hot_copies"])
+    ]
+
+    flights = question_flights.stats()
+    yield "sql_qa_pipelines_in_flight", "gauge", "Distinct question pipelines running", [({}, flights["in_flight"])]
+    yield "sql_qa_questions_coalesced_total", "counter", "Questions that joined an identical in-flight run", [
+        ({}, flights["shared"])
+    ]
+
+    fast = fast_path.stats()
+    yield "sql_qa_fast_path_questions_total", "counter", "Questions checked against the fast path templates", [
+        ({"outcome": "matched"}, fast["matched"]),
+        ({"outcome": "missed"}, fast["missed"]),
+        ({"outcome": "fallback"}, fast["fallbacks"]),
+    ]
+    yield "sql_qa_fast_path_hit_ratio", "gauge", "Questions answered by the fast path over questions checked", [
+        ({}, fast["hit_rate"])
+    ]
+
+    linker = schema_linker.stats()
+    yield "sql_qa_schema_prompts_total", "counter", "SQL prompts by whether the schema was pruned", [
+        ({"pruned": "true"}, linker["pruned"]),
+        ({"pruned": "false"}, linker["full"]),
+    ]
+
+    jobs = job_queue.store.counts()
+    yield "sql_qa_jobs", "gauge", "Background question jobs by status (all workers)", [
+        ({"status": status}, count) for status, count in jobs.items()
+    ]
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Stage latency histograms, token counts, cache ratios and in-flight gauges (Prometheus text format)"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (METRICS_ENABLED=false)")
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
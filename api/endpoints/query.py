@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, Literal, Tuple
 from services.query_service import QueryService
 from services.file_service import FileService
 from services.session_service import SessionService
-from models.schemas import QueryRequest
+from services.result_export import EXPORT_FORMATS, create_writer
+from models.schemas import BatchQueryRequest, DatabaseSelection, ExportRequest, QueryRequest, APIKeys, DatabaseFile
+from utils.security import SQLSandboxError
+from config import settings
 import logging
+import json
 
 # ✅ Configuration du logging pour voir les erreurs
 logging.basicConfig(level=logging.DEBUG)
@@ -27,8 +33,8 @@ async def ask_question(
         api_keys = session_service.get_api_keys(session_id)
         logger.info("API keys retrieved successfully")
         
-        # Récupérer le fichier de base de données
-        db_file = file_service.get_database_file(session_id)
+        # Récupérer le fichier de base de données (et les bases à attacher)
+        db_file, attached = _resolve_databases(session_id, request, file_service)
         logger.info(f"Database file found: {db_file.file_path}")
 
         # Traiter la question
@@ -36,7 +42,9 @@ async def ask_question(
             question=request.question,
             session_id=session_id,
             db_path=db_file.file_path,
-            api_keys=api_keys
+            api_keys=api_keys,
+            answer_mode=request.answer_mode,
+            attached=attached
         )
         
         logger.info("Question processed successfully")
@@ -46,6 +54,8 @@ async def ask_question(
             "result": result
         }
         
+    except HTTPException:
+        raise
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
         raise HTTPException(status_code=404, detail=str(e))
@@ -55,3 +65,205 @@ async def ask_question(
     except Exception as e:
         logger.exception(f"Unexpected error: {e}")  # ✅ Affiche la stack trace complète
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.post("/ask-question/{session_id}/stream")
+async def ask_question_stream(
+    session_id: str,
+    request: QueryRequest,
+    format: Literal["ndjson", "sse"] = Query("ndjson"),
+    file_service: FileService = Depends(),
+    query_service: QueryService = Depends(),
+    session_service: SessionService = Depends()
+):
+    """
+    Streaming variant of ask-question: the generated SQL, then result rows,
+    then answer tokens are sent as soon as they are available
+    """
+    try:
+        logger.info(f"Streaming question for session: {session_id}")
+        # résoudre la session avant d'envoyer les en-têtes, pour garder les 404/400
+        api_keys = session_service.get_api_keys(session_id)
+        db_file, attached = _resolve_databases(session_id, request, file_service)
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        logger.error(f"Value error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    events = query_service.stream_question(
+        question=request.question,
+        session_id=session_id,
+        db_path=db_file.file_path,
+        api_keys=api_keys,
+        answer_mode=request.answer_mode,
+        attached=attached
+    )
+    if format == "sse":
+        return StreamingResponse(_sse(events), media_type="text/event-stream")
+    return StreamingResponse(_ndjson(events), media_type="application/x-ndjson")
+
+
+@router.post("/ask-questions/{session_id}")
+async def ask_questions(
+    session_id: str,
+    request: BatchQueryRequest,
+    file_service: FileService = Depends(),
+    query_service: QueryService = Depends(),
+    session_service: SessionService = Depends()
+):
+    """
+    Answer a batch of questions against one session, results in request order.
+    Each item has either a result or an error, one failure does not fail the batch.
+    """
+    api_keys, db_file, attached, concurrency = _resolve_batch(session_id, request, file_service, session_service)
+    logger.info(f"Processing {len(request.questions)} questions for session: {session_id}")
+
+    results = [None] * len(request.questions)
+    summary = {}
+    async for event in query_service.stream_batch(
+        questions=request.questions,
+        session_id=session_id,
+        db_path=db_file.file_path,
+        api_keys=api_keys,
+        concurrency=concurrency,
+        answer_mode=request.answer_mode,
+        attached=attached
+    ):
+        if event["event"] == "done":
+            summary = event
+        elif "index" not in event:
+            # la base n'a pas pu être ouverte: aucune question n'a tourné
+            raise HTTPException(status_code=500, detail=event["detail"])
+        else:
+            results[event["index"]] = event
+    return {
+        "session_id": session_id,
+        "count": len(results),
+        "unique_questions": summary.get("unique_questions"),
+        "unique_queries": summary.get("unique_queries"),
+        "results": results
+    }
+
+
+@router.post("/ask-questions/{session_id}/stream")
+async def ask_questions_stream(
+    session_id: str,
+    request: BatchQueryRequest,
+    format: Literal["ndjson", "sse"] = Query("ndjson"),
+    file_service: FileService = Depends(),
+    query_service: QueryService = Depends(),
+    session_service: SessionService = Depends()
+):
+    """Streaming variant of ask-questions: one event per question as soon as it completes"""
+    api_keys, db_file, attached, concurrency = _resolve_batch(session_id, request, file_service, session_service)
+    logger.info(f"Streaming {len(request.questions)} questions for session: {session_id}")
+
+    events = query_service.stream_batch(
+        questions=request.questions,
+        session_id=session_id,
+        db_path=db_file.file_path,
+        api_keys=api_keys,
+        concurrency=concurrency,
+        answer_mode=request.answer_mode,
+        attached=attached
+    )
+    if format == "sse":
+        return StreamingResponse(_sse(events), media_type="text/event-stream")
+    return StreamingResponse(_ndjson(events), media_type="application/x-ndjson")
+
+
+@router.post("/export/{session_id}")
+async def export_result(
+    session_id: str,
+    request: ExportRequest,
+    format: Literal["csv", "ndjson", "arrow", "parquet"] = Query("csv"),
+    file_service: FileService = Depends(),
+    query_service: QueryService = Depends(),
+    session_service: SessionService = Depends()
+):
+    """
+    Full result of a query as a file download, encoded batch by batch as the
+    rows are fetched. The query is the given SQL, or the SQL cached for a
+    question already answered in this session.
+    """
+    try:
+        logger.info(f"Exporting {format} for session: {session_id}")
+        # la session doit exister, ses clés ne servent pas: pas d'appel LLM
+        session_service.get_api_keys(session_id)
+        db_file, attached = _resolve_databases(session_id, request, file_service)
+        writer = create_writer(format)
+        sql_query, entry, schema = await query_service.prepare_export(
+            session_id=session_id,
+            db_path=db_file.file_path,
+            sql_query=request.sql_query,
+            question=request.question,
+            attached=attached
+        )
+    except SQLSandboxError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.to_dict())
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        logger.error(f"Value error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        query_service.export_rows(sql_query, entry, schema, session_id, writer),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="export_{session_id}.{extension}"'}
+    )
+
+
+def _resolve_batch(
+    session_id: str,
+    request: BatchQueryRequest,
+    file_service: FileService,
+    session_service: SessionService
+) -> Tuple[APIKeys, DatabaseFile, Dict[str, str], int]:
+    """Check the batch size and resolve the session before any work starts"""
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given")
+    if len(request.questions) > settings.batch_max_questions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch accepts at most {settings.batch_max_questions} questions"
+        )
+    concurrency = min(
+        max(request.concurrency or settings.batch_concurrency, 1),
+        settings.batch_max_concurrency
+    )
+    try:
+        api_keys = session_service.get_api_keys(session_id)
+        db_file, attached = _resolve_databases(session_id, request, file_service)
+    except FileNotFoundError as e:
+        logger.error(f"File not found: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        logger.error(f"Value error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    return api_keys, db_file, attached, concurrency
+
+
+def _resolve_databases(
+    session_id: str,
+    request: DatabaseSelection,
+    file_service: FileService
+) -> Tuple[DatabaseFile, Dict[str, str]]:
+    """Main database of the request and alias -> file of the ones to ATTACH"""
+    db_file = file_service.get_database_file(session_id, request.database)
+    attached = file_service.attached_databases(session_id, request.attach, db_file) if request.attach else {}
+    return db_file, attached
+
+
+async def _ndjson(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    async for event in events:
+        yield json.dumps(event, default=str) + "\n"
+
+
+async def _sse(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    async for event in events:
+        yield f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
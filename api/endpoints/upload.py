@@ -1,21 +1,42 @@
-from fastapi import APIRouter, UploadFile, File, Depends, Form, HTTPException
-from services.file_service import FileService
+from fastapi import APIRouter, Depends, HTTPException, Request
+from services.file_service import FileService, database_alias
 from services.session_service import SessionService
+from services.upload_stream import receive_upload
 from models.schemas import UploadResponse, DatabaseFile, UploadRequest, APIKeys
 import uuid, json
 
 router = APIRouter()
 
-@router.post("/upload-database", response_model=UploadResponse)
+
+def _multipart_body(*fields: str) -> dict:
+    """OpenAPI request body of an upload parsed from the raw stream (FastAPI cannot infer it)"""
+    properties = {"file": {"type": "string", "format": "binary"}}
+    properties.update({name: {"type": "string"} for name in fields})
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object", "properties": properties, "required": ["file", *fields]
+    }}}}}
+
+
+@router.post("/upload-database", response_model=UploadResponse, openapi_extra=_multipart_body("api_keys"))
 async def upload_database(
-        api_keys_json: str = Form(..., alias="api_keys"),
-        file: UploadFile = File(...),
+        request: Request,
         file_service: FileService = Depends(),
         session_service: SessionService = Depends()  # ✅ Utilisez l'instance
 ):
+    """
+    Create a session from its API keys (form field "api_keys", JSON) and its
+    database (form field "file"). The body is read as it arrives: a file that
+    is not SQLite or is too large stops the upload at the offending chunk.
+    """
     try:
+        file = await receive_upload(request, file_service.blob_dir)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        if "api_keys" not in file.fields:
+            raise HTTPException(status_code=400, detail="Missing api_keys form field")
         # creating a session with api keys 
-        api_keys_data = json.loads(api_keys_json)
+        api_keys_data = json.loads(file.fields["api_keys"])
         api_keys = APIKeys(**api_keys_data)  # ✅ Créez l'objet APIKeys correctement
         
         session_id = session_service.create_session(api_keys)  # ✅ Utilisez l'instance
@@ -29,13 +50,68 @@ async def upload_database(
         
         return UploadResponse(
             session_id=session_id,
-            filename=file.filename,
-            message=f"Database '{file.filename}' uploaded successfully",
+            filename=file.file_name,
+            message=f"Database '{file.file_name}' uploaded successfully",
             file_info = db_file
         )
+    except HTTPException:
+        raise
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON format for api_keys")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        file.discard()
+
+
+@router.post("/upload-database/{session_id}", response_model=UploadResponse, openapi_extra=_multipart_body())
+async def add_database(
+        session_id: str,
+        request: Request,
+        file_service: FileService = Depends(),
+        session_service: SessionService = Depends()
+):
+    """
+    Add another database to an existing session (same file name: replaced).
+    Questions pick it with "database", or ATTACH it with "attach".
+    """
+    try:
+        # la session est vérifiée avant de lire le corps
+        session_service.get_api_keys(session_id)
+        file = await receive_upload(request, file_service.blob_dir)
+        db_file = await file_service.save_uploaded_database(file, session_id)
+        return UploadResponse(
+            session_id=session_id,
+            filename=file.file_name,
+            message=f"Database '{file.file_name}' added to session {session_id}",
+            file_info=db_file
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/databases/{session_id}")
+async def list_databases(
+        session_id: str,
+        file_service: FileService = Depends(),
+        session_service: SessionService = Depends()
+):
+    """Databases of a session with the alias they get when attached, the first one is the default"""
+    try:
+        session_service.get_api_keys(session_id)
+        databases = file_service.list_databases(session_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "session_id": session_id,
+        "databases": [
+            {**db_file.model_dump(exclude={"file_path"}), "alias": database_alias(db_file.file_name)}
+            for db_file in databases
+        ]
+    }
@@ -0,0 +1,164 @@
+from typing import Optional
+
+from pydantic_settings import BaseSettings
+
+
+class Settings(BaseSettings):
+    """Application settings, overridable through environment variables"""
+    storage_dir: str = "storage/databases"
+    blob_dir: str = "storage/blobs"
+
+    # Uploads are streamed to disk chunk by chunk
+    upload_max_bytes: int = 500 * 1024 * 1024
+    upload_chunk_size: int = 1024 * 1024
+
+    # Sessions ("sqlite" is shared across workers, "memory" is per process)
+    session_backend: str = "sqlite"
+    session_db_path: str = "storage/sessions.db"
+    session_ttl_seconds: float = 24 * 3600
+    session_cache_size: int = 1024
+    session_cache_ttl_seconds: float = 30
+    session_touch_interval_seconds: float = 60
+
+    # Background storage janitor
+    cleanup_enabled: bool = True
+    cleanup_interval_seconds: float = 300
+    cleanup_idle_ttl_seconds: float = 24 * 3600
+    cleanup_disk_quota_bytes: int = 10 * 1024 * 1024 * 1024
+    cleanup_grace_seconds: float = 300
+    cleanup_batch_size: int = 50
+
+    # Admin endpoints require this token in the X-Admin-Token header (disabled when unset)
+    admin_token: Optional[str] = None
+
+    # Metrics: stage histograms and counters served on /metrics (Prometheus text format)
+    metrics_enabled: bool = True
+    # log every timed stage as a JSON line through structlog
+    metrics_log_json: bool = False
+
+    # SQLDatabase / engine registry
+    db_registry_max_size: int = 64
+    # databases up to this size are loaded in memory (SQLite backup API), shared by every request
+    db_memory_enabled: bool = True
+    db_memory_max_bytes: int = 64 * 1024 * 1024
+    db_memory_total_bytes: int = 512 * 1024 * 1024
+    # PRAGMA mmap_size of the databases read from disk (0 disables)
+    db_mmap_size: int = 256 * 1024 * 1024
+
+    # Databases per session; parsed session manifests are cached (re-read after the TTL)
+    session_max_databases: int = 16
+    manifest_cache_size: int = 1024
+    manifest_cache_ttl_seconds: float = 30
+
+    # Schema / table_info cache
+    schema_cache_max_size: int = 256
+
+    # Concurrency limits of the async pipeline
+    sql_executor_max_workers: int = 8
+    llm_max_concurrency: int = 32
+
+    # Chat model clients
+    llm_model: str = "gemini-2.5-pro"
+    llm_provider: str = "google_genai"
+    llm_client_cache_size: int = 128
+    llm_client_ttl_seconds: float = 3600
+    langsmith_tracing: bool = True
+    # cheaper model for the answer summary (None: same model as SQL generation)
+    llm_answer_model: Optional[str] = "gemini-2.5-flash"
+    llm_answer_max_tokens: int = 512
+
+    # LLM_PROVIDER=fake: local deterministic model (tests, benchmarks)
+    fake_llm_latency_seconds: float = 0.0
+    # JSON file {question: sql} of canned queries
+    fake_llm_responses_path: Optional[str] = None
+    fake_llm_default_sql: Optional[str] = None
+    fake_llm_answer: str = "This is a canned answer."
+
+    # Question -> SQL cache (similarity lookup is disabled when threshold is 0)
+    sql_cache_path: str = "storage/cache/sql_cache.json"
+    sql_cache_max_size: int = 5000
+    sql_cache_ttl_seconds: float = 7 * 24 * 3600
+    sql_cache_similarity_threshold: float = 0.0
+    sql_cache_flush_seconds: float = 30
+
+    # Executed SQL result cache
+    result_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # Rows per batch when streaming results
+    stream_batch_size: int = 500
+
+    # Result exports (CSV/NDJSON/Arrow/Parquet): rows per batch and sandbox limits
+    # (the SQL may come from the client: keep them within what one request may cost)
+    export_batch_size: int = 10_000
+    export_timeout_seconds: float = 60.0
+    export_max_rows: int = 1_000_000
+    export_max_bytes: int = 512 * 1024 * 1024  # 512 MiB
+
+    # Rows kept in a query result and size of the summary sent to the answer prompt
+    result_max_rows: int = 1000
+    result_summary_head_rows: int = 20
+    result_summary_tail_rows: int = 5
+    result_summary_max_chars: int = 4000
+
+    # SQL sandbox: limits applied to every generated query
+    sql_timeout_seconds: float = 10.0
+    sql_max_rows: int = 100_000
+    sql_max_result_bytes: int = 64 * 1024 * 1024  # 64 MiB
+    sql_max_concurrent_per_session: int = 4
+    # nombre d'instructions SQLite entre deux vérifications du délai
+    sql_progress_interval: int = 1000
+
+    # Pre-flight validation of generated SQL with EXPLAIN QUERY PLAN
+    sql_preflight_enabled: bool = True
+    sql_preflight_repair: bool = True
+    # a full scan of a table this large without LIMIT asks the LLM for a rewrite
+    sql_preflight_large_table_rows: int = 100_000
+    # estimated rows visited above which a query is rejected
+    sql_preflight_max_cost: float = 5e8
+    sql_preflight_cache_size: int = 1024
+
+    # Schema linking: only the tables relevant to the question go in the SQL prompt
+    schema_linking_enabled: bool = True
+    schema_prompt_max_tokens: int = 6000
+
+    # Fast path: simple counts/aggregates/top N answered from templates, without the LLM
+    fast_path_enabled: bool = True
+    # share of the question's words explained by the template, table and column names
+    fast_path_min_confidence: float = 0.8
+
+    # Answer strategy: empty, scalar and single-row results are answered without the LLM
+    answer_local_enabled: bool = True
+    answer_local_max_columns: int = 8
+    answer_local_max_chars: int = 200
+
+    # Batch questions: fan-out of the question pipelines of one batch
+    batch_max_questions: int = 100
+    batch_concurrency: int = 8
+    batch_max_concurrency: int = 32
+
+    # Background question jobs (submit / poll / cancel), queued in SQLite
+    jobs_enabled: bool = True
+    job_db_path: str = "storage/jobs.db"
+    job_workers: int = 4
+    job_max_running_per_session: int = 2
+    job_max_queued_per_session: int = 100
+    # LLM failures are retried with exponential backoff
+    job_max_attempts: int = 3
+    job_retry_backoff_seconds: float = 2.0
+    job_retry_backoff_max_seconds: float = 60.0
+    # a running job whose lease is not renewed (worker killed) is queued again
+    job_lease_seconds: float = 60.0
+    job_poll_interval_seconds: float = 0.5
+    job_result_ttl_seconds: float = 24 * 3600
+    job_purge_interval_seconds: float = 300
+
+    # Index advisor: indexes built from repeated full scans of generated queries
+    index_advisor_enabled: bool = True
+    index_advisor_auto_apply: bool = True
+    index_advisor_path: str = "storage/index_advisor.json"
+    index_advisor_min_scans: int = 3
+    index_advisor_min_table_rows: int = 10_000
+    index_advisor_max_columns: int = 6
+
+
+settings = Settings()
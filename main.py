@@ -12,10 +12,16 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-from api.endpoints import upload, query
+from api.endpoints import upload, query, admin, monitoring, jobs
 from services.file_service import FileService
 from services.query_service import QueryService
 from services.session_service import SessionService
+from models.database import database_registry
+from services.sql_cache import sql_cache
+from services.cleanup_service import cleanup_service
+from services.job_queue import job_queue
+from utils.metrics import MetricsMiddleware, metrics
+from config import settings
 
 app = FastAPI(
     title="Natural Language Control over SQLite Database",
@@ -33,6 +39,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# durée et nombre de requêtes HTTP en cours, par route
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
 def get_file_service() -> FileService:
     return FileService()
 
@@ -60,6 +69,39 @@ app.include_router(
     responses={404: {"description": "Not found"}},
 )
 
+app.include_router(
+    jobs.router,
+    prefix="/api/v1/jobs",
+    tags=["Jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+app.include_router(
+    admin.router,
+    prefix="/api/v1/admin",
+    tags=["Admin"],
+    responses={404: {"description": "Not found"}},
+)
+
+app.include_router(
+    monitoring.router,
+    tags=["Monitoring"],
+)
+
+@app.on_event("startup")
+async def start_background_services():
+    if settings.cleanup_enabled:
+        cleanup_service.start()
+    if settings.jobs_enabled:
+        job_queue.start()
+
+@app.on_event("shutdown")
+async def close_database_engines():
+    await cleanup_service.stop()
+    await job_queue.stop()
+    database_registry.clear()
+    sql_cache.flush()
+
 @app.get("/health")
 async def health_check():
     return {
@@ -78,7 +120,10 @@ async def root():
         "health" : "/health",
         "endpoints" : {
             "upload" : "/api/v1/upload/",
-            "query" : "/api/v1/query/"
+            "query" : "/api/v1/query/",
+            "jobs" : "/api/v1/jobs/",
+            "admin" : "/api/v1/admin/",
+            "metrics" : "/metrics"
         }
     }
 
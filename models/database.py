@@ -0,0 +1,300 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from urllib.parse import quote, unquote
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from langchain_community.utilities import SQLDatabase
+
+from config import settings
+from utils.security import harden_engine
+
+
+@dataclass
+class DatabaseEntry:
+    """A cached SQLDatabase together with the engine it was built on"""
+    file_path: str
+    engine: Engine
+    db: SQLDatabase
+    mtime: float
+    size: int
+    sessions: Set[str] = field(default_factory=set)
+    # alias -> file path of the databases ATTACHed to every connection
+    attached: Dict[str, str] = field(default_factory=dict)
+    # files served from an in-memory hot copy (main and attached)
+    in_memory: List[str] = field(default_factory=list)
+
+
+class _HotCopy:
+    def __init__(self, size: int):
+        self.size = size
+        self.users = 1
+        self.keeper: Optional[sqlite3.Connection] = None
+        self.loaded = threading.Event()
+
+
+class HotCopies:
+    """
+    In-memory copies of small read-only databases, loaded once with the SQLite
+    backup API into the memdb VFS and shared by every connection of the
+    process. A copy lives while a registry entry uses it, all copies together
+    within DB_MEMORY_TOTAL_BYTES; larger databases are read from disk.
+    """
+
+    def __init__(self):
+        # version du fichier (chemin, mtime, taille) -> copie
+        self._copies: Dict[str, _HotCopy] = {}
+        self._lock = threading.Lock()
+        self.memory_bytes = 0
+
+    def acquire(self, file_path: str, stat: os.stat_result) -> Optional[str]:
+        """Key of the hot copy of this file version, loading it if it fits; None to read the file"""
+        size = stat.st_size
+        if not settings.db_memory_enabled or size > settings.db_memory_max_bytes:
+            return None
+        key = f"{file_path}@{stat.st_mtime_ns}:{size}"
+        with self._lock:
+            copy = self._copies.get(key)
+            if copy is not None:
+                copy.users += 1
+                loading = False
+            elif self.memory_bytes + size > settings.db_memory_total_bytes:
+                return None
+            else:
+                # réserver la place avant de copier hors du verrou
+                self.memory_bytes += size
+                self._copies[key] = copy = _HotCopy(size)
+                loading = True
+
+        if not loading:
+            copy.loaded.wait()
+            return key if copy.keeper is not None else None
+        try:
+            source = sqlite3.connect(f"file:{quote(file_path)}?mode=ro", uri=True)
+            try:
+                keeper = sqlite3.connect(memory_uri(key, read_only=False), uri=True, check_same_thread=False)
+                source.backup(keeper)
+            finally:
+                source.close()
+            copy.keeper = keeper
+            return key
+        except BaseException:
+            with self._lock:
+                self._copies.pop(key, None)
+                self.memory_bytes -= size
+            raise
+        finally:
+            copy.loaded.set()
+
+    def release(self, key: str):
+        with self._lock:
+            copy = self._copies.get(key)
+            if copy is None:
+                return
+            copy.users -= 1
+            if copy.users > 0:
+                return
+            del self._copies[key]
+            self.memory_bytes -= copy.size
+        # la copie disparaît avec sa dernière connexion
+        if copy.keeper is not None:
+            copy.keeper.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hot_copies": len(self._copies), "memory_bytes": self.memory_bytes}
+
+
+def memory_uri(key: str, read_only: bool = True) -> str:
+    """
+    memdb VFS name of a hot copy: the leading slash shares it between connections.
+    Only the connection loading the copy opens it writable.
+    """
+    uri = f"file:/sqlqa-{hashlib.sha1(key.encode()).hexdigest()}?vfs=memdb"
+    return uri + "&mode=ro" if read_only else uri
+
+
+class DatabaseRegistry:
+    """
+    Bounded LRU registry of SQLDatabase instances keyed by database file.
+    Sessions pointing to the same content-addressed blob share one entry.
+    An entry is rebuilt when the file's mtime or size changes, and evicted
+    entries have their engine (and its connection pool) disposed. Small
+    databases are served from in-memory hot copies, larger ones are
+    memory-mapped; other databases can be ATTACHed under an alias.
+    """
+
+    def __init__(self, max_size: int = settings.db_registry_max_size):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, DatabaseEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hot_copies = HotCopies()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id: str, file_path: str, attached: Optional[Dict[str, str]] = None) -> DatabaseEntry:
+        """Return the cached entry for this database (with `attached` alias -> file), building it if needed"""
+        file_path = str(file_path)
+        attached = {alias: str(path) for alias, path in (attached or {}).items()}
+        key = entry_key(file_path, attached)
+        stat = os.stat(file_path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.mtime == stat.st_mtime and entry.size == stat.st_size:
+                    self._entries.move_to_end(key)
+                    entry.sessions.add(session_id)
+                    self.hits += 1
+                    return entry
+                # le fichier a changé depuis la dernière réflexion du schéma
+                del self._entries[key]
+                self._dispose(entry)
+            self.misses += 1
+
+        # la réflexion du schéma se fait hors du verrou
+        entry = self._build(file_path, stat, attached)
+        entry.sessions.add(session_id)
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and existing.mtime == entry.mtime and existing.size == entry.size:
+                # un autre thread a construit la même entrée entre-temps
+                self._dispose(entry)
+                self._entries.move_to_end(key)
+                existing.sessions.add(session_id)
+                return existing
+            if existing is not None:
+                self._dispose(existing)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.evictions += 1
+                self._dispose(evicted)
+        return entry
+
+    def invalidate(self, session_id: str, file_path: Optional[str] = None) -> int:
+        """
+        Detach a session from its entries (optionally those using a single file);
+        entries no other session uses are dropped. Returns the number of disposed engines.
+        """
+        with self._lock:
+            entries = []
+            for key, entry in list(self._entries.items()):
+                if file_path is not None and not _uses(entry, str(file_path)):
+                    continue
+                entry.sessions.discard(session_id)
+                if not entry.sessions:
+                    entries.append(self._entries.pop(key))
+        for entry in entries:
+            self._dispose(entry)
+        return len(entries)
+
+    def invalidate_path(self, file_path: str) -> bool:
+        """Drop the entries using a file (main or attached) whatever the sessions using them"""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if _uses(entry, str(file_path))]
+            entries = [self._entries.pop(key) for key in keys]
+        for entry in entries:
+            self._dispose(entry)
+        return bool(entries)
+
+    def clear(self):
+        """Dispose every cached engine"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._dispose(entry)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+        return {**stats, **self.hot_copies.stats()}
+
+    def _build(self, file_path: str, stat: os.stat_result, attached: Dict[str, str]) -> DatabaseEntry:
+        in_memory = []
+
+        def source(path: str, path_stat: os.stat_result) -> Tuple[str, bool]:
+            copy = self.hot_copies.acquire(path, path_stat)
+            if copy is None:
+                return f"file:{quote(path)}?mode=ro", False
+            in_memory.append(copy)
+            return memory_uri(copy), True
+
+        try:
+            main = source(file_path, stat)
+            others = {alias: source(path, os.stat(path)) for alias, path in attached.items()}
+
+            def connect() -> sqlite3.Connection:
+                conn = sqlite3.connect(main[0], uri=True, check_same_thread=False)
+                databases = [("main", main[1])]
+                for alias, (uri, memory) in others.items():
+                    conn.execute(f"ATTACH DATABASE ? AS {quote_identifier(alias)}", (uri,))
+                    databases.append((alias, memory))
+                if settings.db_mmap_size > 0:
+                    # les fichiers sur disque sont lus par mmap plutôt que par read()
+                    for name, memory in databases:
+                        if not memory:
+                            conn.execute(f"PRAGMA {quote_identifier(name)}.mmap_size = {int(settings.db_mmap_size)}")
+                return conn
+
+            # les blobs (et leurs copies en mémoire) sont partagés entre sessions: toujours en lecture seule
+            # (l'URL reste celle du fichier, database_path() en dépend)
+            engine = harden_engine(create_engine(
+                f"sqlite:///file:{quote(file_path)}?mode=ro&uri=true", creator=connect
+            ))
+            return DatabaseEntry(
+                file_path=file_path,
+                engine=engine,
+                db=SQLDatabase(engine),
+                mtime=stat.st_mtime,
+                size=stat.st_size,
+                attached=attached,
+                in_memory=in_memory,
+            )
+        except BaseException:
+            for copy in in_memory:
+                self.hot_copies.release(copy)
+            raise
+
+    def _dispose(self, entry: DatabaseEntry):
+        entry.engine.dispose()
+        for copy in entry.in_memory:
+            self.hot_copies.release(copy)
+
+
+def entry_key(file_path: str, attached: Dict[str, str]) -> str:
+    if not attached:
+        return file_path
+    return file_path + "?attach=" + "&".join(f"{alias}={path}" for alias, path in sorted(attached.items()))
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _uses(entry: DatabaseEntry, file_path: str) -> bool:
+    return entry.file_path == file_path or file_path in entry.attached.values()
+
+
+def database_path(db: SQLDatabase) -> str:
+    """Filesystem path of a SQLDatabase built by the registry (or from a plain URI)"""
+    path = db._engine.url.database
+    return unquote(path[len("file:"):]) if path.startswith("file:") else path
+
+
+database_registry = DatabaseRegistry()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, model_validator
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 from typing_extensions import Annotated, TypedDict
 
@@ -21,6 +21,7 @@ class DatabaseFile(BaseModel):
     file_size: int
     upload_timestamp: datetime
     file_path: str
+    content_hash: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -37,10 +38,44 @@ class UploadResponse(BaseModel):
     file_info: DatabaseFile
 
 
-class QueryRequest(BaseModel):
+# "auto": small results answered locally, "llm": always summarized, "rows": SQL and rows only
+AnswerMode = Literal["auto", "llm", "rows"]
+
+class DatabaseSelection(BaseModel):
+    """
+    Session databases a request runs on: `database` (file name, default the
+    first uploaded) with the `attach` ones ATTACHed, their tables named alias.table
+    """
+    database: Optional[str] = None
+    attach: List[str] = []
+
+class QueryRequest(DatabaseSelection):
     """Natural language query request"""
     question: str
     api_keys: APIKeys
+    answer_mode: AnswerMode = "auto"
+
+class BatchQueryRequest(DatabaseSelection):
+    """Several natural language questions for the same session"""
+    questions: List[str]
+    api_keys: APIKeys
+    concurrency: Optional[int] = None
+    answer_mode: AnswerMode = "auto"
+
+class JobRequest(QueryRequest):
+    """Question answered by a background job; higher priorities run first"""
+    priority: int = 0
+
+class ExportRequest(DatabaseSelection):
+    """Query whose full result is exported: SQL, or a question already answered in the session"""
+    sql_query: Optional[str] = None
+    question: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_source(self):
+        if (self.sql_query is None) == (self.question is None):
+            raise ValueError("Give either sql_query or question")
+        return self
 
 class QueryOutput(TypedDict):
     """Generated SQL query output"""
@@ -51,11 +86,19 @@ class SQLQuery(BaseModel):
     query: QueryOutput
     session_id: str
 
+class ColumnInfo(BaseModel):
+    """Result column name and SQLite storage class"""
+    name: str
+    type: str
+
 class QueryResult(BaseModel):
     """Query execution result"""
+    columns: List[ColumnInfo] = []
     data: List[Dict[str, Any]]
     row_count: int
     execution_time_ms: float
+    truncated: bool = False
+    error: Optional[str] = None
 
 class GeneratedAnswer(BaseModel):
     """Final answer to user's question"""
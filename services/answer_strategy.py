@@ -0,0 +1,83 @@
+from typing import Any, Optional
+
+from langchain_community.utilities.sql_database import truncate_word
+
+from config import settings
+from services.result_summary import ResultCollector
+from utils.metrics import metrics
+
+
+# stratégies enregistrées dans chaque réponse
+TEMPLATE = "template"
+ROWS = "rows"
+EMPTY = "empty"
+SCALAR = "scalar"
+SINGLE_ROW = "single_row"
+SUMMARY = "summary"
+
+answer_strategies = metrics.counter(
+    "sql_qa_answer_strategy_total", "Answers by how they were produced", ("strategy",)
+)
+
+
+class AnswerStrategy:
+    """
+    Decides how the answer of a question is produced once its rows are known.
+    answer_mode "rows" returns the SQL and rows only; "llm" always summarizes
+    with the answer model; "auto" formats empty, scalar and single-row results
+    locally and only calls the answer model when the result needs summarizing.
+    Fast path matches keep their templated answer.
+    """
+
+    def choose(self, result: ResultCollector, answer_mode: str = "auto", template: bool = False) -> str:
+        """Strategy for this result; `template` when the fast path already has an answer for it"""
+        if answer_mode == "rows":
+            return ROWS
+        # une erreur SQL est expliquée par le LLM, comme avant
+        if answer_mode == "llm" or result.error is not None:
+            return SUMMARY
+        if template:
+            return TEMPLATE
+        if not settings.answer_local_enabled:
+            return SUMMARY
+        if result.row_count == 0:
+            return EMPTY
+        if result.row_count == 1 and len(result.columns) == 1:
+            return SCALAR
+        if result.row_count == 1 and len(result.columns) <= settings.answer_local_max_columns:
+            return SINGLE_ROW
+        return SUMMARY
+
+    @staticmethod
+    def record(strategy: str):
+        answer_strategies.inc(strategy=strategy)
+
+    def local_answer(self, result: ResultCollector, strategy: str) -> Optional[str]:
+        """Answer text built without the LLM (None for "rows")"""
+        if strategy == ROWS:
+            return None
+        if strategy == EMPTY:
+            return "The query returned no rows."
+        row = result.head[0]
+        if strategy == SCALAR:
+            return f"The result is {format_value(row[0])} ({result.columns[0]})."
+        values = ", ".join(f"{column}: {format_value(value)}" for column, value in zip(result.columns, row))
+        return f"The query returned one row: {values}."
+
+
+def format_value(value: Any) -> str:
+    """Human-readable rendering of a SQLite value in an answer"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return truncate_word(value, length=settings.answer_local_max_chars)
+
+
+answer_strategy = AnswerStrategy()
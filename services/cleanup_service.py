@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+from models.database import database_registry
+from services.schema_service import schema_cache, SCHEMA_SUFFIX
+from services.result_cache import result_cache
+from services.file_service import FileService, manifest_index
+from services.session_store import session_store
+from utils.helpers import run_blocking
+
+logger = logging.getLogger(__name__)
+
+SESSION_PREFIX = "session_"
+
+
+class CleanupService:
+    """
+    Background janitor for storage/databases. Session folders are evicted when
+    idle for longer than CLEANUP_IDLE_TTL_SECONDS, then least recently used
+    first while the total size exceeds CLEANUP_DISK_QUOTA_BYTES. All disk work
+    runs on the thread pool, one folder at a time, so requests are never blocked.
+    """
+
+    def __init__(self):
+        self.storage_dir = Path(settings.storage_dir)
+        self.blob_dir = Path(settings.blob_dir)
+        self._task: Optional[asyncio.Task] = None
+        self._running = asyncio.Lock()
+        self.stats_data: Dict[str, Any] = {
+            "runs": 0,
+            "last_run_at": None,
+            "last_run_ms": None,
+            "session_folders": 0,
+            "total_bytes": 0,
+            "evicted_idle": 0,
+            "evicted_quota": 0,
+            "blobs": 0,
+            "blobs_deleted": 0,
+            "bytes_freed": 0,
+            "errors": 0,
+        }
+
+    def start(self):
+        """Start the periodic cleanup loop on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats_data,
+            "running": self._task is not None and not self._task.done(),
+            "idle_ttl_seconds": settings.cleanup_idle_ttl_seconds,
+            "disk_quota_bytes": settings.cleanup_disk_quota_bytes,
+        }
+
+    async def run_once(self) -> Dict[str, Any]:
+        """One incremental pass: idle eviction, then quota eviction"""
+        async with self._running:
+            started = time.perf_counter()
+            try:
+                await self._run()
+            except Exception:
+                self.stats_data["errors"] += 1
+                logger.exception("Storage cleanup failed")
+            self.stats_data["runs"] += 1
+            self.stats_data["last_run_at"] = time.time()
+            self.stats_data["last_run_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            return self.stats()
+
+    async def _loop(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(settings.cleanup_interval_seconds)
+
+    async def _run(self):
+        now = time.time()
+        last_access = await run_blocking(session_store.last_accessed)
+        folders = await run_blocking(self._scan)
+        blobs = await run_blocking(self._scan_blobs)
+
+        # un blob partagé n'est libéré qu'avec la dernière session qui le référence
+        refcounts: Dict[str, int] = {}
+        for _, _, _, _, hashes in folders:
+            for content_hash in hashes:
+                refcounts[content_hash] = refcounts.get(content_hash, 0) + 1
+
+        # (last_access, session_id, folder, size, hashes)
+        sessions = []
+        for session_id, folder, mtime, size, hashes in folders:
+            sessions.append((max(last_access.get(session_id, 0.0), mtime), session_id, folder, size, hashes))
+            await asyncio.sleep(0)
+
+        total = sum(item[3] for item in sessions) + sum(size for size, _ in blobs.values())
+        budget = settings.cleanup_batch_size
+
+        def release(size: int, hashes: List[str]) -> int:
+            freed = size
+            for content_hash in hashes:
+                refcounts[content_hash] -= 1
+                if refcounts[content_hash] == 0 and content_hash in blobs:
+                    freed += blobs[content_hash][0]
+            return freed
+
+        kept = []
+        for accessed, session_id, folder, size, hashes in sessions:
+            if budget > 0 and now - accessed > settings.cleanup_idle_ttl_seconds:
+                await self.evict(session_id, folder)
+                freed = release(size, hashes)
+                self.stats_data["evicted_idle"] += 1
+                self.stats_data["bytes_freed"] += freed
+                total -= freed
+                budget -= 1
+            else:
+                kept.append((accessed, session_id, folder, size, hashes))
+
+        # quota disque: les sessions les moins récemment utilisées partent d'abord
+        kept.sort(key=lambda item: item[0])
+        remaining = len(kept)
+        for accessed, session_id, folder, size, hashes in kept:
+            if total <= settings.cleanup_disk_quota_bytes or budget <= 0:
+                break
+            # ne jamais toucher une session en cours d'upload ou d'utilisation
+            if now - accessed < settings.cleanup_grace_seconds:
+                continue
+            await self.evict(session_id, folder)
+            freed = release(size, hashes)
+            self.stats_data["evicted_quota"] += 1
+            self.stats_data["bytes_freed"] += freed
+            total -= freed
+            budget -= 1
+            remaining -= 1
+
+        # sessions expirées sans dossier
+        for session_id in await run_blocking(session_store.expired_sessions):
+            await run_blocking(session_store.delete, session_id)
+
+        # blobs qui ne sont plus référencés par aucune session
+        for content_hash, (size, mtime) in blobs.items():
+            if refcounts.get(content_hash, 0) > 0 or now - mtime < settings.cleanup_grace_seconds:
+                continue
+            await self.delete_blob(content_hash)
+            self.stats_data["blobs_deleted"] += 1
+            await asyncio.sleep(0)
+
+        self.stats_data["session_folders"] = remaining
+        self.stats_data["blobs"] = sum(1 for count in refcounts.values() if count > 0)
+        self.stats_data["total_bytes"] = total
+
+    async def evict(self, session_id: str, folder: Path):
+        """Close cached engines of a session, forget it and delete its folder"""
+        logger.info(f"Evicting session {session_id} ({folder})")
+        database_registry.invalidate(session_id)
+        for db_path in folder.glob("*.db"):
+            schema_cache.forget(str(db_path))
+        await run_blocking(session_store.delete, session_id)
+        await run_blocking(shutil.rmtree, folder, True)
+        manifest_index.forget(folder)
+
+    async def delete_blob(self, content_hash: str):
+        """Remove an unreferenced blob and everything cached for it"""
+        blob_path = self.blob_dir / f"{content_hash}.db"
+        logger.info(f"Deleting unreferenced blob {blob_path}")
+        database_registry.invalidate_path(str(blob_path))
+        schema_cache.forget(str(blob_path))
+        result_cache.invalidate(content_hash)
+        for path in (blob_path, Path(str(blob_path) + SCHEMA_SUFFIX)):
+            await run_blocking(path.unlink, True)
+
+    def _scan_blobs(self) -> Dict[str, Tuple[int, float]]:
+        """content hash -> (size, last use) of every stored blob, stale temp uploads are removed"""
+        blobs = {}
+        if not self.blob_dir.exists():
+            return blobs
+        now = time.time()
+        for path in self.blob_dir.iterdir():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.suffix == ".db":
+                blobs[path.stem] = (stat.st_size, max(stat.st_mtime, stat.st_atime))
+            elif path.suffix == ".upload" and now - stat.st_mtime > settings.cleanup_grace_seconds:
+                path.unlink(True)
+        return blobs
+
+    def _scan(self) -> List[Tuple[str, Path, float, int, List[str]]]:
+        """(session_id, folder, latest mtime, size in bytes, blob hashes) of every session folder"""
+        folders = []
+        if not self.storage_dir.exists():
+            return folders
+        for folder in self.storage_dir.iterdir():
+            if not folder.is_dir() or not folder.name.startswith(SESSION_PREFIX):
+                continue
+            mtime, size = folder.stat().st_mtime, 0
+            for path in folder.rglob("*"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                mtime = max(mtime, stat.st_mtime)
+                if path.is_file():
+                    size += stat.st_size
+            try:
+                hashes = [info["content_hash"] for info in FileService.read_manifest(folder).values()]
+            except (OSError, ValueError, KeyError):
+                hashes = []
+            folders.append((folder.name[len(SESSION_PREFIX):], folder, mtime, size, hashes))
+        return folders
+
+
+cleanup_service = CleanupService()
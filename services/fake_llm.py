@@ -0,0 +1,128 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from config import settings
+from utils.helpers import normalize_question
+
+
+TABLE_RE = re.compile(r'CREATE TABLE\s+["`\[]?(\w+)')
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Gemini chat model (LLM_PROVIDER=fake), so the
+    service can be tested and benchmarked without network calls. Every call
+    sleeps `latency_seconds`. SQL comes from `sql_responses` (normalized
+    question -> SQL), then `default_sql`, otherwise a count over the first
+    table of the prompt's schema; answers are `answer` streamed word by word.
+    """
+
+    latency_seconds: float = 0.0
+    sql_responses: Dict[str, str] = {}
+    default_sql: Optional[str] = None
+    answer: str = "This is a canned answer."
+
+    @classmethod
+    def from_settings(cls) -> "FakeChatModel":
+        sql_responses = {}
+        if settings.fake_llm_responses_path:
+            with open(settings.fake_llm_responses_path, encoding="utf-8") as f:
+                sql_responses = {normalize_question(q): sql for q, sql in json.load(f).items()}
+        return cls(
+            latency_seconds=settings.fake_llm_latency_seconds,
+            sql_responses=sql_responses,
+            default_sql=settings.fake_llm_default_sql,
+            answer=settings.fake_llm_answer,
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        return self._result(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds)
+        return self._result(messages)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_seconds)
+        for token in self._tokens():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency_seconds)
+        for token in self._tokens():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> RunnableLambda:
+        """Runnable returning {"query": ...} like the structured Gemini output"""
+
+        def generate(prompt: Any) -> Dict[str, str]:
+            time.sleep(self.latency_seconds)
+            return {"query": self.sql_for(prompt)}
+
+        async def agenerate(prompt: Any) -> Dict[str, str]:
+            await asyncio.sleep(self.latency_seconds)
+            return {"query": self.sql_for(prompt)}
+
+        return RunnableLambda(generate, afunc=agenerate)
+
+    def sql_for(self, prompt: Any) -> str:
+        messages = prompt.to_messages() if hasattr(prompt, "to_messages") else list(prompt)
+        # le premier message "user" est la question (le prompt de réparation en ajoute d'autres)
+        question = next((m.content for m in messages if m.type == "human"), "")
+        sql = self.sql_responses.get(normalize_question(question)) or self.default_sql
+        if sql:
+            return sql
+        tables = TABLE_RE.findall(" ".join(str(m.content) for m in messages if m.type == "system"))
+        return f'SELECT count(*) FROM "{tables[0]}"' if tables else "SELECT 1"
+
+    def _tokens(self) -> List[str]:
+        words = self.answer.split(" ")
+        return [word + " " for word in words[:-1]] + words[-1:]
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        # même forme que les modèles réels, ~4 caractères par token
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = len(self.answer) // 4
+        message = AIMessage(content=self.answer, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
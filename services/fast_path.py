@@ -0,0 +1,370 @@
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import settings
+from models.database import quote_identifier
+from services.answer_strategy import format_value
+from services.result_summary import ResultCollector
+from services.schema_linker import tokenize
+from services.schema_service import SchemaContext, quote_table
+from utils.helpers import normalize_question
+
+
+# "\tname TEXT," -> (name, TEXT); les contraintes de table ne sont pas des colonnes
+COLUMN_DEF_RE = re.compile(r'^[ \t]+["`\[]?(\w+)["`\]]?\s+(\w+)', re.MULTILINE)
+CONSTRAINT_WORDS = {"PRIMARY", "FOREIGN", "UNIQUE", "CHECK", "CONSTRAINT"}
+NUMERIC_TYPES = ("INT", "REAL", "FLOA", "DOUB", "NUM", "DEC")
+LABEL_NAMES = ("name", "title", "label")
+
+COUNT_RE = re.compile(r"^(?:how many|number of|count(?: of| the)?|combien(?: de| d)?)\b")
+AGGREGATE_RE = re.compile(
+    r"\b(average|avg|mean|moyenne|sum|total|somme|maximum|max|minimum|min|highest|lowest|largest|smallest)\b"
+)
+GROUP_RE = re.compile(r"\b(?:per|by|for each|for every|in each|each|par)\b")
+TOP_RE = re.compile(
+    r"\b(top|first|bottom|last|highest|best|largest|biggest|most|greatest|oldest|"
+    r"lowest|worst|smallest|least|youngest)\b"
+)
+WHICH_RE = re.compile(r"^(?:which|who)\b")
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "fifteen": 15, "twenty": 20, "fifty": 50, "hundred": 100,
+}
+AGGREGATES = {
+    "average": "AVG", "avg": "AVG", "mean": "AVG", "moyenne": "AVG",
+    "sum": "SUM", "total": "SUM", "somme": "SUM",
+    "maximum": "MAX", "max": "MAX", "highest": "MAX", "largest": "MAX",
+    "minimum": "MIN", "min": "MIN", "lowest": "MIN", "smallest": "MIN",
+}
+AGGREGATE_WORDS = {"AVG": "average", "SUM": "total", "MAX": "highest", "MIN": "lowest"}
+DESCENDING = {"top", "first", "highest", "best", "largest", "biggest", "most", "greatest", "oldest"}
+# superlatifs qui désignent une colonne précise
+IMPLIED_COLUMNS = {"oldest": "age", "youngest": "age"}
+# mots du gabarit lui-même: ils ne comptent pas dans la couverture de la question
+TEMPLATE_TOKENS = (
+    set(AGGREGATES) | DESCENDING | set(IMPLIED_COLUMNS) | set(NUMBER_WORDS) | {
+        "number", "count", "there", "all", "per", "each", "every", "total", "top", "bottom",
+        "last", "worst", "smallest", "least", "lowest", "youngest", "value", "has", "have",
+        "do", "does", "we", "nombre", "moyenne", "chaque", "ya", "il", "y",
+    }
+)
+# même limite par défaut que le prompt SQL (top_k)
+DEFAULT_LIMIT = 10
+
+
+@dataclass
+class ColumnProfile:
+    name: str
+    type: str
+    tokens: Tuple[str, ...]
+
+    @property
+    def numeric(self) -> bool:
+        return any(marker in self.type.upper() for marker in NUMERIC_TYPES)
+
+
+@dataclass
+class TableProfile:
+    name: str
+    tokens: Tuple[str, ...]
+    columns: List[ColumnProfile]
+    # nom cité pour le SQL ("alias"."table" pour une base attachée)
+    sql_name: str = ""
+
+    @property
+    def label_column(self) -> ColumnProfile:
+        """Column used to name rows in answers: name/title/label, else the first text column"""
+        for column in self.columns:
+            if column.name.lower() in LABEL_NAMES:
+                return column
+        text_columns = [c for c in self.columns if not c.numeric]
+        return (text_columns or self.columns)[0]
+
+
+@dataclass
+class FastPathMatch:
+    """SQL built from a question template, with the answer template to apply to its result"""
+    template: str
+    sql: str
+    confidence: float
+    table: str
+    columns: List[str] = field(default_factory=list)
+    aggregate: Optional[str] = None
+
+    def answer(self, result: ResultCollector) -> str:
+        if not result.head:
+            return "No rows match this question."
+        table = self.table.replace("_", " ")
+        columns = [column.replace("_", " ") for column in self.columns]
+        if self.template == "count":
+            if self.columns:
+                return f"There are {format_value(result.head[0][0])} distinct {columns[0]} values in {table}."
+            return f"There are {format_value(result.head[0][0])} {table}."
+        if self.template == "aggregate":
+            word = AGGREGATE_WORDS[self.aggregate]
+            return f"The {word} {columns[0]} of {table} is {format_value(result.head[0][0])}."
+        rows = "; ".join(f"{row[0]}: {format_value(row[1])}" for row in result.head)
+        if self.template == "grouped_aggregate":
+            word = AGGREGATE_WORDS[self.aggregate]
+            return f"{word.capitalize()} {columns[0]} by {columns[1]}: {rows}."
+        return f"{table.capitalize()} by {columns[0]}: {rows}."
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"template": self.template, "confidence": round(self.confidence, 3)}
+
+
+class FastPathMatcher:
+    """
+    Rule-based NL -> SQL for simple lookups (counts, aggregates, top N), built
+    from the cached schema. A match is only used when the question's words are
+    covered by the template, table and column names with at least
+    FAST_PATH_MIN_CONFIDENCE; anything else goes to the LLM.
+    """
+
+    def __init__(self, max_size: int = settings.schema_cache_max_size):
+        self.max_size = max_size
+        self._profiles: "OrderedDict[str, List[TableProfile]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_data = {"matched": 0, "missed": 0, "fallbacks": 0}
+
+    def match(self, question: str, schema: SchemaContext) -> Optional[FastPathMatch]:
+        """Best template match for the question, None below the confidence threshold"""
+        if not settings.fast_path_enabled:
+            return None
+        text = normalize_question(question)
+        tables = self.profile(schema)
+        candidates = [
+            candidate for candidate in (
+                self._match_count(text, tables),
+                self._match_aggregate(text, tables),
+                self._match_top(text, tables),
+            ) if candidate is not None
+        ]
+        best = max(candidates, key=lambda candidate: candidate.confidence, default=None)
+        matched = best is not None and best.confidence >= settings.fast_path_min_confidence
+        with self._lock:
+            self.stats_data["matched" if matched else "missed"] += 1
+        return best if matched else None
+
+    def fallback(self):
+        """A matched query could not be used (rejected by the pre-flight check or failed)"""
+        with self._lock:
+            self.stats_data["fallbacks"] += 1
+
+    def profile(self, schema: SchemaContext) -> List[TableProfile]:
+        """Tables and typed columns of a schema, parsed once per database version"""
+        with self._lock:
+            tables = self._profiles.get(schema.content_hash)
+            if tables is not None:
+                self._profiles.move_to_end(schema.content_hash)
+                return tables
+
+        tables = []
+        for name, info in schema.tables.items():
+            columns = [
+                ColumnProfile(name=column, type=column_type, tokens=tuple(tokenize(column)))
+                for column, column_type in COLUMN_DEF_RE.findall(info)
+                if column.upper() not in CONSTRAINT_WORDS
+            ]
+            if columns:
+                tables.append(TableProfile(
+                    name=name, tokens=tuple(tokenize(name)), columns=columns,
+                    sql_name=quote_table(name, schema.attached)
+                ))
+
+        with self._lock:
+            self._profiles[schema.content_hash] = tables
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+        return tables
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            questions = self.stats_data["matched"] + self.stats_data["missed"]
+            answered = self.stats_data["matched"] - self.stats_data["fallbacks"]
+            return {**self.stats_data, "hit_rate": answered / questions if questions else 0.0}
+
+    def _match_count(self, text: str, tables: List[TableProfile]) -> Optional[FastPathMatch]:
+        # "how many players", "number of clubs", "how many nationalities" (count distinct)
+        if not COUNT_RE.search(text):
+            return None
+        tokens = _content_tokens(text)
+        table = _find_table(tokens, tables)
+        column, column_score = _find_column(tokens, [table] if table else tables)
+        if column is not None and (table is None or not _covers(table.tokens, tokens)):
+            owner = table or column[0]
+            covered = set(column[1].tokens) | (set(owner.tokens) if table else set())
+            return FastPathMatch(
+                template="count",
+                sql=f"SELECT count(DISTINCT {quote_identifier(column[1].name)}) AS total FROM {owner.sql_name}",
+                confidence=_coverage(tokens, covered) * column_score,
+                table=owner.name,
+                columns=[column[1].name],
+            )
+        if table is None:
+            return None
+        return FastPathMatch(
+            template="count",
+            sql=f"SELECT count(*) AS total FROM {table.sql_name}",
+            confidence=_coverage(tokens, set(table.tokens)),
+            table=table.name,
+        )
+
+    def _match_aggregate(self, text: str, tables: List[TableProfile]) -> Optional[FastPathMatch]:
+        # "average overall rating", "total goals per club", "highest age of players"
+        found = AGGREGATE_RE.search(text)
+        if found is None or COUNT_RE.search(text) or _number(text) is not None:
+            return None
+        # "which player has the highest rating" est un top 1, pas un MAX
+        if found.group(1) in DESCENDING | {"lowest", "smallest"} and WHICH_RE.search(text):
+            return None
+        function = AGGREGATES[found.group(1)]
+        measure_text, _, group_text = _split_group(text)
+        tokens = _content_tokens(text)
+        table = _find_table(tokens, tables)
+        candidates = [table] if table else tables
+        measure, measure_score = _find_column(_content_tokens(measure_text), candidates, numeric=True)
+        if measure is None:
+            return None
+        owner = table or measure[0]
+        covered = set(measure[1].tokens) | (set(owner.tokens) if table else set())
+
+        if not group_text:
+            return FastPathMatch(
+                template="aggregate",
+                sql=f"SELECT {function}({quote_identifier(measure[1].name)}) AS value FROM {owner.sql_name}",
+                confidence=_coverage(tokens, covered) * measure_score,
+                table=owner.name,
+                columns=[measure[1].name],
+                aggregate=function,
+            )
+
+        group, group_score = _find_column(_content_tokens(group_text), [owner])
+        if group is None or group[1].name == measure[1].name:
+            return None
+        covered |= set(group[1].tokens)
+        return FastPathMatch(
+            template="grouped_aggregate",
+            sql=(
+                f"SELECT {quote_identifier(group[1].name)}, {function}({quote_identifier(measure[1].name)}) AS value "
+                f"FROM {owner.sql_name} GROUP BY {quote_identifier(group[1].name)} "
+                f"ORDER BY value DESC LIMIT {DEFAULT_LIMIT}"
+            ),
+            confidence=_coverage(tokens, covered) * measure_score * group_score,
+            table=owner.name,
+            columns=[measure[1].name, group[1].name],
+            aggregate=function,
+        )
+
+    def _match_top(self, text: str, tables: List[TableProfile]) -> Optional[FastPathMatch]:
+        # "top 10 players by overall rating", "five oldest players", "which club has the most titles"
+        found = TOP_RE.search(text)
+        if found is None or COUNT_RE.search(text):
+            return None
+        limit = _number(text)
+        if limit is None:
+            if not WHICH_RE.search(text):
+                return None
+            limit = 1
+        word = found.group(1)
+        tokens = _content_tokens(text)
+        table = _find_table(tokens, tables)
+        candidates = [table] if table else tables
+
+        _, _, by_text = _split_group(text)
+        implied = IMPLIED_COLUMNS.get(word)
+        if by_text:
+            column, score = _find_column(_content_tokens(by_text), candidates, numeric=True)
+        elif implied:
+            column, score = _find_column((implied,), candidates, numeric=True)
+        else:
+            column, score = _find_column(tokens, candidates, numeric=True)
+        if column is None:
+            return None
+        owner = table or column[0]
+        label = owner.label_column
+        covered = set(column[1].tokens) | (set(owner.tokens) if table else set())
+        direction = "DESC" if word in DESCENDING else "ASC"
+        label_sql = quote_identifier(label.name) if label.name != column[1].name else "rowid"
+        return FastPathMatch(
+            template="top",
+            sql=(
+                f"SELECT {label_sql}, {quote_identifier(column[1].name)} FROM {owner.sql_name} "
+                f"WHERE {quote_identifier(column[1].name)} IS NOT NULL "
+                f"ORDER BY {quote_identifier(column[1].name)} {direction} LIMIT {limit}"
+            ),
+            confidence=_coverage(tokens, covered) * score,
+            table=owner.name,
+            columns=[column[1].name],
+        )
+
+
+def _content_tokens(text: str) -> List[str]:
+    """Question tokens that must be explained by a table or column name"""
+    return [token for token in tokenize(text) if token not in TEMPLATE_TOKENS and not token.isdigit()]
+
+
+def _covers(name_tokens: Sequence[str], tokens: Sequence[str]) -> bool:
+    return bool(name_tokens) and set(name_tokens) <= set(tokens)
+
+
+def _coverage(tokens: Sequence[str], covered: set) -> float:
+    if not tokens:
+        return 0.0
+    return sum(1 for token in tokens if token in covered) / len(tokens)
+
+
+def _find_table(tokens: Sequence[str], tables: List[TableProfile]) -> Optional[TableProfile]:
+    """The table whose full name appears in the question (the longest name wins)"""
+    named = [table for table in tables if _covers(table.tokens, tokens)]
+    if not named:
+        return None
+    named.sort(key=lambda table: -len(table.tokens))
+    if len(named) > 1 and len(named[0].tokens) == len(named[1].tokens):
+        return None
+    return named[0]
+
+
+def _find_column(
+    tokens: Sequence[str], tables: List[TableProfile], numeric: bool = False
+) -> Tuple[Optional[Tuple[TableProfile, ColumnProfile]], float]:
+    """Best matching column (share of its name tokens in the question); None when ambiguous"""
+    token_set = set(tokens)
+    scored = []
+    for table in tables:
+        for column in table.columns:
+            if (numeric and not column.numeric) or not column.tokens:
+                continue
+            score = len(token_set & set(column.tokens)) / len(column.tokens)
+            if score >= 0.5:
+                scored.append((score, table, column))
+    if not scored:
+        return None, 0.0
+    scored.sort(key=lambda item: -item[0])
+    if len(scored) > 1 and scored[0][0] == scored[1][0]:
+        return None, 0.0
+    score, table, column = scored[0]
+    return (table, column), score
+
+
+def _split_group(text: str) -> Tuple[str, str, str]:
+    """'average age per club' -> ('average age', 'per', 'club')"""
+    found = GROUP_RE.search(text)
+    if found is None:
+        return text, "", ""
+    return text[:found.start()], found.group(0), text[found.end():]
+
+
+def _number(text: str) -> Optional[int]:
+    for word in text.split():
+        if word.isdigit():
+            return int(word)
+        if word in NUMBER_WORDS:
+            return NUMBER_WORDS[word]
+    return None
+
+
+fast_path = FastPathMatcher()
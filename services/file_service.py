@@ -1,53 +1,195 @@
 import os
+import re
 import shutil
 import sqlite3
+import json
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
-from fastapi import UploadFile
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 from models.schemas import DatabaseFile
+from models.database import database_registry
+from services.schema_service import schema_cache
+from services.schema_linker import schema_linker
+from services.upload_stream import ReceivedUpload
 from langchain_community.utilities import SQLDatabase
+from config import settings
+from utils.helpers import file_sha256, run_blocking, write_json_atomic
+from utils.metrics import metrics
+
+MANIFEST_NAME = "manifest.json"
+# SQLITE_MAX_ATTACHED vaut 10 par défaut
+MAX_ATTACHED = 10
+RESERVED_ALIASES = {"main", "temp"}
+# verrous d'écriture des manifestes, partagés par hachage du dossier
+MANIFEST_LOCK_STRIPES = 64
+
+uploaded_bytes = metrics.counter(
+    "sql_qa_upload_bytes_total", "Bytes received by uploads, by whether the blob already existed", ("deduplicated",)
+)
+
+class ManifestIndex:
+    """
+    Parsed session manifests kept in memory, so resolving a session's database
+    costs no folder stat or manifest read. Manifests written by this process
+    are updated in place; others are re-read after MANIFEST_CACHE_TTL_SECONDS.
+    Returned manifests are shared, callers must not modify them. Writes to a
+    session folder's manifest are serialized by write_lock().
+    """
+
+    def __init__(self, max_size: int = settings.manifest_cache_size):
+        self.max_size = max_size
+        self._manifests: "OrderedDict[str, Tuple[float, Dict[str, Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_locks = [threading.Lock() for _ in range(MANIFEST_LOCK_STRIPES)]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_folder: Path) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Manifest of a session folder, None when the folder does not exist"""
+        key = str(session_folder)
+        with self._lock:
+            cached = self._manifests.get(key)
+            if cached and time.time() - cached[0] < settings.manifest_cache_ttl_seconds:
+                self._manifests.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        if not session_folder.exists():
+            self.forget(session_folder)
+            return None
+        manifest = FileService.read_manifest(session_folder)
+        self.put(session_folder, manifest)
+        return manifest
+
+    def put(self, session_folder: Path, manifest: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            self._manifests[str(session_folder)] = (time.time(), manifest)
+            self._manifests.move_to_end(str(session_folder))
+            while len(self._manifests) > self.max_size:
+                self._manifests.popitem(last=False)
+
+    def forget(self, session_folder: Path):
+        with self._lock:
+            self._manifests.pop(str(session_folder), None)
+
+    def write_lock(self, session_folder: Path) -> threading.Lock:
+        """Lock held while a session folder's manifest is read, changed and replaced"""
+        return self._write_locks[hash(str(session_folder)) % len(self._write_locks)]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._manifests), "hits": self.hits, "misses": self.misses}
+
+
+manifest_index = ManifestIndex()
+
 
 class FileService:
     def __init__(self):
-        self.storage_dir = Path("storage/databases")
+        self.storage_dir = Path(settings.storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.blob_dir = Path(settings.blob_dir)
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
 
-    async def save_uploaded_database(self, file: UploadFile, session_id: str) -> DatabaseFile:
-        """save the uploaded database file file to a session specific folder"""
+    async def save_uploaded_database(self, upload: ReceivedUpload, session_id: str) -> DatabaseFile:
+        """
+        Store a received upload (already streamed to a temp file and hashed,
+        see services.upload_stream) once per content hash as a read-only blob
+        referenced by the session manifest. The temp file is moved into the
+        blob store or removed.
+        """
         # concatenation de chemins de fichiers 
         session_folder = self.storage_dir / f"session_{session_id}"
         session_folder.mkdir(exist_ok=True)
 
-        file_name = file.filename
-        file_path = session_folder / file_name
+        file_name = upload.file_name
+        content_hash = upload.content_hash
+        file_size = upload.file_size
+        try:
+            known = self.read_manifest(session_folder)
+            if file_name not in known and len(known) >= settings.session_max_databases:
+                raise ValueError(f"A session holds at most {settings.session_max_databases} databases")
+
+            blob_path = self.blob_path(content_hash)
+            if blob_path.exists():
+                # même contenu déjà stocké: la session référence le blob existant
+                # (rafraîchir l'atime le protège du janitor le temps d'écrire le manifeste,
+                # le mtime reste inchangé pour ne pas invalider les caches)
+                os.utime(blob_path, (datetime.now().timestamp(), blob_path.stat().st_mtime))
+                uploaded_bytes.inc(file_size, deduplicated="true")
+            else:
+                with metrics.span("upload_validation", session_id=session_id):
+                    valid = await run_blocking(self._is_valid_sqlite, upload.tmp_path)
+                if not valid:
+                    raise ValueError(f"'{file_name}' is not a valid SQLite database")
+                os.chmod(upload.tmp_path, 0o444)
+                os.replace(upload.tmp_path, blob_path)
+                uploaded_bytes.inc(file_size, deduplicated="false")
+        finally:
+            upload.discard()
 
-        content = await file.read()
-        file_size = len(content)
+        upload_timestamp = datetime.now()
+
+        def add(manifest: Dict[str, Dict[str, Any]]) -> bool:
+            # relu sous le verrou: un autre upload ou relink_blob a pu l'écrire entre-temps
+            if file_name not in manifest and len(manifest) >= settings.session_max_databases:
+                raise ValueError(f"A session holds at most {settings.session_max_databases} databases")
+            previous = manifest.get(file_name)
+            if previous and previous["content_hash"] != content_hash:
+                # la session ne pointe plus sur l'ancien blob
+                database_registry.invalidate(session_id, str(self.blob_path(previous["content_hash"])))
+            manifest[file_name] = {
+                "content_hash": content_hash,
+                "file_size": file_size,
+                "upload_timestamp": upload_timestamp.isoformat()
+            }
+            return True
+
+        await run_blocking(self.update_manifest, session_folder, add)
 
-        #ouvrir le fichier dans le mode d'ecriture binaire
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-        
-        if not self._is_valid_sqlite(file_path):
-            os.remove(file_path)
-            raise ValueError(f"'{file_name}' is not a valid SQLite database")
         db_file = DatabaseFile(
             file_name = file_name,
             session_id=session_id,
             file_size = file_size,
-            upload_timestamp = datetime.now(),
-            file_path = str(file_path)
+            upload_timestamp = upload_timestamp,
+            file_path = str(blob_path),
+            content_hash = content_hash
         )
+
+        # précalculer la description du schéma une seule fois par contenu
+        with metrics.span("engine", session_id=session_id):
+            db = await run_blocking(self.initialize_db, db_file)
+        with metrics.span("schema", session_id=session_id):
+            schema = await run_blocking(schema_cache.build, db_file.file_path, db, content_hash)
+        with metrics.span("schema_index", session_id=session_id):
+            await run_blocking(schema_linker.index, schema)
         return db_file
     
     def get_database_file(self, session_id: str, filename: str = None) -> DatabaseFile:
         """
         Get database file info for session
-        If filename not provided, look for any .db file in the session folder
+        If filename not provided, use the first database of the session manifest
+        (or any .db file for folders created before the blob store)
         """
+        if filename and (Path(filename).name != filename or filename in (".", "..")):
+            # nom fourni par le client: jamais un chemin (absolu ou avec "..")
+            raise ValueError(f"Invalid database file name: {filename!r}")
         session_folder = self.storage_dir / f"session_{session_id}"
-        if not session_folder.exists():
+        manifest = manifest_index.get(session_folder)
+        if manifest is None:
             raise FileNotFoundError(f"No session folder found for {session_id}")
+
+        if manifest:
+            actual_filename = filename or next(iter(manifest))
+            info = manifest.get(actual_filename)
+            if info is None:
+                raise FileNotFoundError(f"Database file not found: {actual_filename}")
+            # pas de stat ici: le registre des bases vérifie le fichier à l'ouverture
+            return self._manifest_file(session_id, actual_filename, info)
         
         if filename:
             file_path = session_folder / filename
@@ -72,17 +214,149 @@ class FileService:
             file_path=str(file_path)
         )
     
+    def list_databases(self, session_id: str) -> List[DatabaseFile]:
+        """Databases of a session, in upload order (the first one is the default)"""
+        manifest = manifest_index.get(self.storage_dir / f"session_{session_id}")
+        if manifest is None:
+            raise FileNotFoundError(f"No session folder found for {session_id}")
+        if not manifest:
+            return [self.get_database_file(session_id)]
+        return [self._manifest_file(session_id, name, info) for name, info in manifest.items()]
+
+    def attached_databases(self, session_id: str, filenames: Sequence[str], main: DatabaseFile) -> Dict[str, str]:
+        """alias -> file path of session databases to ATTACH next to `main` (alias: file name stem)"""
+        if len(filenames) > MAX_ATTACHED:
+            raise ValueError(f"At most {MAX_ATTACHED} databases can be attached")
+        attached = {}
+        for filename in dict.fromkeys(filenames):
+            if filename == main.file_name:
+                continue
+            db_file = self.get_database_file(session_id, filename)
+            alias = database_alias(filename)
+            if alias in attached or alias in RESERVED_ALIASES:
+                raise ValueError(f"'{filename}' cannot be attached as '{alias}', rename the file")
+            attached[alias] = db_file.file_path
+        return attached
+
+    def derive_blob(self, content_hash: str, statements: Sequence[str]) -> str:
+        """
+        Copy a blob with SQLite's backup API, run DDL statements on the copy and
+        store the result as a new blob. Returns the new content hash; the
+        source blob is left untouched.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".upload")
+        os.close(fd)
+        try:
+            source = sqlite3.connect(f"file:{self.blob_path(content_hash)}?mode=ro", uri=True)
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target)
+                for statement in statements:
+                    target.execute(statement)
+                target.commit()
+            finally:
+                source.close()
+                target.close()
+
+            new_hash = file_sha256(tmp_path)
+            new_path = self.blob_path(new_hash)
+            if new_path.exists():
+                os.remove(tmp_path)
+            else:
+                os.chmod(tmp_path, 0o444)
+                os.replace(tmp_path, new_path)
+            return new_hash
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def relink_blob(self, old_hash: str, new_hash: str) -> List[str]:
+        """
+        Point every session manifest entry using old_hash to new_hash. Each
+        manifest is updated under its write lock and replaced atomically;
+        returns the relinked session ids.
+        """
+        new_size = self.blob_path(new_hash).stat().st_size
+
+        def relink(manifest: Dict[str, Dict[str, Any]]) -> bool:
+            changed = False
+            for info in manifest.values():
+                if info.get("content_hash") == old_hash:
+                    info["content_hash"] = new_hash
+                    info["file_size"] = new_size
+                    changed = True
+            return changed
+
+        relinked = []
+        for session_folder in self.storage_dir.glob("session_*"):
+            try:
+                if self.update_manifest(session_folder, relink):
+                    relinked.append(session_folder.name[len("session_"):])
+            except (OSError, ValueError):
+                continue
+        return relinked
+
+    def update_manifest(
+        self, session_folder: Path, update: Callable[[Dict[str, Dict[str, Any]]], bool]
+    ) -> bool:
+        """
+        Re-read a session manifest under its write lock and apply `update` to
+        it; the manifest is written back when `update` returns True.
+        """
+        with manifest_index.write_lock(session_folder):
+            manifest = self.read_manifest(session_folder)
+            if not update(manifest):
+                return False
+            self._write_manifest(session_folder, manifest)
+            return True
+
+    def blob_path(self, content_hash: str) -> Path:
+        """Shared read-only copy of a database, one per content hash"""
+        return self.blob_dir / f"{content_hash}.db"
+
     @staticmethod
-    def initialize_db(database_file: DatabaseFile):
-        db = SQLDatabase.from_uri(f"sqlite:///{database_file.file_path}")
-        return db
+    def read_manifest(session_folder: Path) -> Dict[str, Dict[str, Any]]:
+        """file name -> {content_hash, file_size, upload_timestamp} of a session"""
+        try:
+            with open(session_folder / MANIFEST_NAME, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _write_manifest(session_folder: Path, manifest: Dict[str, Dict[str, Any]]):
+        write_json_atomic(session_folder / MANIFEST_NAME, manifest)
+        manifest_index.put(session_folder, manifest)
+
+    def _manifest_file(self, session_id: str, file_name: str, info: Dict[str, Any]) -> DatabaseFile:
+        return DatabaseFile(
+            file_name=file_name,
+            session_id=session_id,
+            file_size=info["file_size"],
+            upload_timestamp=datetime.fromisoformat(info["upload_timestamp"]),
+            file_path=str(self.blob_path(info["content_hash"])),
+            content_hash=info["content_hash"]
+        )
+
+    @staticmethod
+    def initialize_db(database_file: DatabaseFile) -> SQLDatabase:
+        """Return the pooled SQLDatabase for this file, reflected once per file version"""
+        entry = database_registry.get(database_file.session_id, database_file.file_path)
+        return entry.db
     
     def _is_valid_sqlite(self, file_path):
         """check if file is a valid SQLite database"""
         try:
-            conn = sqlite3.connect(file_path)
+            conn = sqlite3.connect(f"file:{file_path}?mode=ro", uri=True)
             conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
             conn.close()
             return True
         except Exception:
-            return False
\ No newline at end of file
+            return False
+
+
+def database_alias(file_name: str) -> str:
+    """Schema name of an attached database: "Sales 2024.db" gives sales_2024"""
+    alias = re.sub(r"\W+", "_", Path(file_name).stem).strip("_").lower() or "db"
+    return alias if not alias[0].isdigit() else f"db_{alias}"
@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import settings
+from models.database import DatabaseEntry, quote_identifier
+from services.file_service import FileService
+from services.schema_service import SchemaContext
+from services.sql_validator import QueryPlan, sql_validator, table_aliases
+from services.result_cache import canonicalize_sql
+from services.sql_cache import sql_cache
+from utils.helpers import run_blocking, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+COLUMN_RE = r"(?:(\w+)\.)?(\w+)"
+EQUALITY_RE = re.compile(COLUMN_RE + r"\s*(?:==?|\bin\b)")
+RANGE_RE = re.compile(COLUMN_RE + r"\s*(?:<=|>=|<(?!>)|>|\bbetween\b)")
+# fin d'une clause WHERE / ON / ORDER BY
+CLAUSE_END = r"(?=\bgroup by\b|\border by\b|\blimit\b|\bhaving\b|\bunion\b|\bwhere\b|\b(?:left |inner |cross )?join\b|\)|$)"
+WHERE_RE = re.compile(r"\b(?:where|on)\b(.*?)" + CLAUSE_END)
+ORDER_BY_RE = re.compile(r"\border by\b(.*?)(?=\blimit\b|\)|$)")
+SELECT_RE = re.compile(r"\bselect\b(.*?)\bfrom\b")
+IDENTIFIER_RE = re.compile(r"\W")
+
+
+@dataclass
+class IndexSuggestion:
+    """A covering index proposed for a table that generated queries keep scanning"""
+    id: str
+    content_hash: str
+    table: str
+    columns: List[str]
+    index_name: str
+    scans: int = 0
+    # pending -> building -> applied -> undone, or failed
+    status: str = "pending"
+    applied_hash: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+    def create_statement(self) -> str:
+        columns = ", ".join(quote_identifier(column) for column in self.columns)
+        return f"CREATE INDEX IF NOT EXISTS {quote_identifier(self.index_name)} ON {quote_identifier(self.table)} ({columns})"
+
+    def drop_statement(self) -> str:
+        return f"DROP INDEX IF EXISTS {quote_identifier(self.index_name)}"
+
+
+class IndexAdvisor:
+    """
+    Records the WHERE / JOIN / ORDER BY columns of generated queries whose plan
+    fully scans a large table. Once the same pattern was seen
+    INDEX_ADVISOR_MIN_SCANS times, a covering index is built in the background
+    on a copy of the blob, and session manifests are switched to the new blob
+    atomically. Suggestions are persisted and can be listed, applied or undone.
+    """
+
+    def __init__(self, path: str = settings.index_advisor_path):
+        self.path = Path(path)
+        self.file_service = FileService()
+        self._suggestions: Optional[Dict[str, IndexSuggestion]] = None
+        # blob remplacé -> blob qui l'a remplacé
+        self._redirects: Dict[str, str] = {}
+        # content hash -> (table -> columns, table -> leading column of existing indexes)
+        self._tables: Dict[str, Tuple[Dict[str, List[str]], Dict[str, Set[str]]]] = {}
+        self._lock = threading.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self._building: Optional[asyncio.Lock] = None
+
+    async def observe(self, entry: DatabaseEntry, schema: SchemaContext, sql_query: str, plan: QueryPlan):
+        """Count the full scans of an executed query and schedule the indexes that became worth it"""
+        if not settings.index_advisor_enabled or not plan.full_scans:
+            return
+        if entry.attached:
+            # les index sont construits sur une copie d'un seul blob
+            return
+        try:
+            ready = await run_blocking(self._observe, entry, schema, sql_query, plan)
+        except Exception:
+            logger.exception("Index advisor failed to observe a query")
+            return
+        if settings.index_advisor_auto_apply:
+            for suggestion in ready:
+                task = asyncio.create_task(self.apply(suggestion.id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    def list(self, content_hash: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            suggestions = list(self._load().values())
+        return [
+            asdict(suggestion) for suggestion in sorted(suggestions, key=lambda s: -s.updated_at)
+            if content_hash is None or content_hash in (suggestion.content_hash, suggestion.applied_hash)
+        ]
+
+    async def apply(self, suggestion_id: str) -> Dict[str, Any]:
+        """Build the index on a copy of the blob, then relink sessions to it"""
+        suggestion = self._transition(suggestion_id, ("pending", "failed"), "building")
+        try:
+            new_hash = await self._rebuild(suggestion.content_hash, suggestion.create_statement())
+            logger.info(f"Index {suggestion.index_name} built, database is now {new_hash[:12]}")
+            return self._update(suggestion_id, status="applied", applied_hash=new_hash, error=None)
+        except Exception as e:
+            logger.exception(f"Index {suggestion.index_name} failed")
+            return self._update(suggestion_id, status="failed", error=str(e))
+
+    async def undo(self, suggestion_id: str) -> Dict[str, Any]:
+        """Drop an applied index from the blob the sessions currently use"""
+        suggestion = self._transition(suggestion_id, ("applied",), "building")
+        try:
+            new_hash = await self._rebuild(suggestion.applied_hash, suggestion.drop_statement())
+            return self._update(suggestion_id, status="undone", applied_hash=new_hash, error=None)
+        except Exception as e:
+            logger.exception(f"Undoing index {suggestion.index_name} failed")
+            return self._update(suggestion_id, status="applied", error=str(e))
+
+    async def _rebuild(self, content_hash: str, statement: str) -> str:
+        """
+        Run one DDL statement on a copy of the blob sessions currently use for
+        this database, then move every session to the copy
+        """
+        if self._building is None:
+            self._building = asyncio.Lock()
+        # un seul build à la fois: deux builds du même blob se perdraient mutuellement
+        async with self._building:
+            current = self._current_hash(content_hash)
+            new_hash = await run_blocking(self.file_service.derive_blob, current, [statement, "ANALYZE"])
+            relinked = await run_blocking(self.file_service.relink_blob, current, new_hash)
+            logger.info(f"{len(relinked)} sessions moved from {current[:12]} to {new_hash[:12]}")
+            # mêmes tables et colonnes: le SQL déjà généré reste valable
+            sql_cache.copy(current, new_hash)
+            with self._lock:
+                self._redirects.pop(new_hash, None)
+                self._redirects[current] = new_hash
+                self._save()
+            return new_hash
+
+    def _observe(
+        self,
+        entry: DatabaseEntry,
+        schema: SchemaContext,
+        sql_query: str,
+        plan: QueryPlan
+    ) -> List[IndexSuggestion]:
+        columns_by_table, indexed = self._table_columns(entry, schema)
+        row_counts = sql_validator.table_rows(entry, schema)
+        canonical = STRING_LITERAL_RE.sub("?", canonicalize_sql(sql_query))
+        aliases = table_aliases(canonical, schema.table_names)
+
+        ready = []
+        now = time.time()
+        for table in dict.fromkeys(plan.full_scans):
+            if row_counts.get(table, 0) < settings.index_advisor_min_table_rows:
+                continue
+            columns = self._index_columns(canonical, table, columns_by_table.get(table, []), aliases)
+            # un index existant commence déjà par cette colonne: ne pas en empiler un autre
+            if not columns or columns[0] in indexed.get(table, set()):
+                continue
+
+            suggestion_id = hashlib.sha256(
+                f"{schema.content_hash}:{table}:{','.join(columns)}".encode()
+            ).hexdigest()[:12]
+            with self._lock:
+                suggestions = self._load()
+                suggestion = suggestions.get(suggestion_id)
+                if suggestion is None:
+                    suggestion = suggestions[suggestion_id] = IndexSuggestion(
+                        id=suggestion_id,
+                        content_hash=schema.content_hash,
+                        table=table,
+                        columns=columns,
+                        index_name=f"ix_advisor_{IDENTIFIER_RE.sub('_', table)}_{suggestion_id}",
+                        created_at=now,
+                    )
+                suggestion.scans += 1
+                suggestion.updated_at = now
+                if suggestion.status == "pending" and suggestion.scans >= settings.index_advisor_min_scans:
+                    ready.append(suggestion)
+                self._save()
+        return ready
+
+    @staticmethod
+    def _index_columns(
+        canonical: str,
+        table: str,
+        table_columns: List[str],
+        aliases: Dict[str, str]
+    ) -> List[str]:
+        """Equality columns, then range columns, then ORDER BY columns, then selected columns"""
+        known = {column.lower(): column for column in table_columns}
+
+        def resolve(qualifier: str, name: str) -> Optional[str]:
+            if qualifier and aliases.get(qualifier) != table:
+                return None
+            return known.get(name)
+
+        def collect(pattern: re.Pattern, text: str) -> List[str]:
+            return [c for c in (resolve(q, n) for q, n in pattern.findall(text)) if c]
+
+        predicates = " ".join(WHERE_RE.findall(canonical))
+        key = collect(EQUALITY_RE, predicates) + collect(RANGE_RE, predicates)
+        for order_by in ORDER_BY_RE.findall(canonical):
+            key += collect(re.compile(COLUMN_RE), order_by)
+        key = list(dict.fromkeys(key))[:settings.index_advisor_max_columns]
+        if not key:
+            return []
+
+        # index couvrant quand la requête ne lit que quelques colonnes en plus
+        selected = []
+        for select_list in SELECT_RE.findall(canonical):
+            if "*" in select_list:
+                return key
+            selected += collect(re.compile(COLUMN_RE), select_list)
+        covering = list(dict.fromkeys(key + selected))
+        return covering if len(covering) <= settings.index_advisor_max_columns else key
+
+    def _table_columns(
+        self,
+        entry: DatabaseEntry,
+        schema: SchemaContext
+    ) -> Tuple[Dict[str, List[str]], Dict[str, Set[str]]]:
+        cached = self._tables.get(schema.content_hash)
+        if cached is not None:
+            return cached
+        columns, indexed = {}, {}
+        with entry.engine.connect() as connection:
+            for table in schema.table_names:
+                quoted = quote_identifier(table)
+                columns[table] = [
+                    row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({quoted})")
+                ]
+                indexed[table] = set()
+                for index in connection.exec_driver_sql(f"PRAGMA index_list({quoted})").fetchall():
+                    info = connection.exec_driver_sql(f"PRAGMA index_info({quote_identifier(index[1])})").fetchall()
+                    if info:
+                        indexed[table].add(info[0][2])
+        with self._lock:
+            self._tables[schema.content_hash] = (columns, indexed)
+            while len(self._tables) > settings.schema_cache_max_size:
+                self._tables.pop(next(iter(self._tables)))
+        return columns, indexed
+
+    def _current_hash(self, content_hash: str) -> str:
+        """Follow earlier index builds to the blob sessions actually use"""
+        with self._lock:
+            self._load()
+            seen = {content_hash}
+            while content_hash in self._redirects and self._redirects[content_hash] not in seen:
+                content_hash = self._redirects[content_hash]
+                seen.add(content_hash)
+        return content_hash
+
+    def _transition(self, suggestion_id: str, allowed: Tuple[str, ...], status: str) -> IndexSuggestion:
+        with self._lock:
+            suggestion = self._load().get(suggestion_id)
+            if suggestion is None:
+                raise KeyError(f"Index suggestion {suggestion_id} not found")
+            if suggestion.status not in allowed:
+                raise ValueError(f"Index suggestion {suggestion_id} is {suggestion.status}")
+            suggestion.status = status
+            suggestion.updated_at = time.time()
+            self._save()
+            return suggestion
+
+    def _update(self, suggestion_id: str, **changes: Any) -> Dict[str, Any]:
+        with self._lock:
+            suggestion = self._load()[suggestion_id]
+            for name, value in changes.items():
+                setattr(suggestion, name, value)
+            suggestion.updated_at = time.time()
+            self._save()
+            return asdict(suggestion)
+
+    def _load(self) -> Dict[str, IndexSuggestion]:
+        # appelé sous self._lock
+        if self._suggestions is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self._suggestions = {
+                    key: IndexSuggestion(**value) for key, value in data["suggestions"].items()
+                }
+                self._redirects = data["redirects"]
+            except (OSError, ValueError, TypeError, KeyError):
+                self._suggestions, self._redirects = {}, {}
+            # un build interrompu par un redémarrage est à refaire
+            for suggestion in self._suggestions.values():
+                if suggestion.status == "building":
+                    suggestion.status = "failed" if suggestion.applied_hash is None else "applied"
+        return self._suggestions
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.path, {
+            "suggestions": {key: asdict(value) for key, value in self._suggestions.items()},
+            "redirects": self._redirects,
+        })
+
+
+index_advisor = IndexAdvisor()
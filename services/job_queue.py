@@ -0,0 +1,435 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi.encoders import jsonable_encoder
+
+from config import settings
+from services.file_service import FileService
+from services.query_service import QueryService
+from services.session_service import SessionService
+from utils.helpers import LLMError, run_blocking
+from utils.metrics import metrics
+from utils.security import SQLSandboxError, TooManyQueriesError
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+STATUSES = (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)
+
+jobs_finished = metrics.counter(
+    "sql_qa_jobs_finished_total", "Background question jobs by outcome (retried: attempt requeued)", ("outcome",)
+)
+
+
+class QueueFullError(Exception):
+    """The session already has JOB_MAX_QUEUED_PER_SESSION jobs waiting"""
+
+
+class JobStore:
+    """
+    Jobs in a SQLite file in WAL mode, shared by every worker process. A
+    running job holds a lease renewed by its worker; a job whose lease ran
+    out (worker killed) is queued again, or failed once out of attempts.
+    """
+
+    def __init__(self, path: str = settings.job_db_path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    answer_mode TEXT NOT NULL,
+                    database TEXT,
+                    attach TEXT NOT NULL DEFAULT '[]',
+                    priority INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    run_after REAL NOT NULL,
+                    lease_until REAL,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    expires_at REAL
+                )
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            # files créées avant les sessions à plusieurs bases
+            if "database" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN database TEXT")
+                conn.execute("ALTER TABLE jobs ADD COLUMN attach TEXT NOT NULL DEFAULT '[]'")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_expiry ON jobs (expires_at) WHERE expires_at IS NOT NULL")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(
+        self,
+        session_id: str,
+        question: str,
+        answer_mode: str,
+        priority: int,
+        database: Optional[str] = None,
+        attach: Sequence[str] = ()
+    ) -> Dict[str, Any]:
+        conn = self._connect()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (waiting,) = conn.execute(
+                "SELECT count(*) FROM jobs WHERE session_id = ? AND status IN (?, ?)",
+                (session_id, QUEUED, RUNNING)
+            ).fetchone()
+            if waiting >= settings.job_max_queued_per_session:
+                raise QueueFullError(
+                    f"Session {session_id} already has {waiting} jobs waiting "
+                    f"(max {settings.job_max_queued_per_session})"
+                )
+            conn.execute(
+                "INSERT INTO jobs (job_id, session_id, question, answer_mode, database, attach, priority, status, "
+                "run_after, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, session_id, question, answer_mode, database, json.dumps(list(attach)), priority, QUEUED, now, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(job_id)
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Take the next runnable job: highest priority first, then oldest, skipping
+        sessions that already run JOB_MAX_RUNNING_PER_SESSION jobs.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # baux expirés: le worker a disparu pendant l'exécution
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, expires_at = ?, lease_until = NULL, "
+                "error = ? WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, now, now + settings.job_result_ttl_seconds, json.dumps("Worker lost while running the job"),
+                 RUNNING, now, settings.job_max_attempts)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_until = NULL, run_after = ? WHERE status = ? AND lease_until < ?",
+                (QUEUED, now, RUNNING, now)
+            )
+            row = conn.execute(
+                "SELECT job_id FROM jobs AS j WHERE status = ? AND run_after <= ? AND ("
+                "  SELECT count(*) FROM jobs AS r WHERE r.session_id = j.session_id AND r.status = ?"
+                ") < ? ORDER BY priority DESC, created_at LIMIT 1",
+                (QUEUED, now, RUNNING, settings.job_max_running_per_session)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, lease_until = ? "
+                    "WHERE job_id = ?",
+                    (RUNNING, now, now + settings.job_lease_seconds, row["job_id"])
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row["job_id"]) if row is not None else None
+
+    def renew(self, job_id: str) -> bool:
+        """Extend the lease of a running job; True when its cancellation was requested"""
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND status = ?",
+            (time.time() + settings.job_lease_seconds, job_id, RUNNING)
+        )
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is None or bool(row["cancel_requested"])
+
+    def cancel_requested(self, job_id: str) -> bool:
+        row = self._connect().execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is None or bool(row["cancel_requested"])
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Any = None):
+        """Record the outcome of a running job, kept JOB_RESULT_TTL_SECONDS"""
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, expires_at = ?, lease_until = NULL "
+            "WHERE job_id = ? AND status = ?",
+            (status, _dump(result), _dump(error), now, now + settings.job_result_ttl_seconds, job_id, RUNNING)
+        )
+
+    def retry(self, job_id: str, error: Any, delay: float):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, run_after = ?, lease_until = NULL WHERE job_id = ? AND status = ?",
+            (QUEUED, _dump(error), time.time() + delay, job_id, RUNNING)
+        )
+
+    def release(self, job_id: str):
+        """Give a running job back to the queue (worker shutting down), without using an attempt"""
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, attempts = attempts - 1, lease_until = NULL, run_after = ? "
+            "WHERE job_id = ? AND status = ?",
+            (QUEUED, time.time(), job_id, RUNNING)
+        )
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a queued job now; a running job is flagged and stopped by its worker"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ?, expires_at = ? "
+                "WHERE job_id = ? AND status = ?",
+                (CANCELLED, now, now + settings.job_result_ttl_seconds, job_id, QUEUED)
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = ?", (job_id, RUNNING)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._decode(row) if row is not None else None
+
+    def list_jobs(self, session_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT * FROM jobs WHERE session_id = ? ORDER BY created_at DESC LIMIT ?", (session_id, limit)
+        ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def purge(self) -> int:
+        """Delete finished jobs whose retention ran out"""
+        cursor = self._connect().execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        for status, count in self._connect().execute("SELECT status, count(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+        job = {key: row[key] for key in row.keys() if key not in ("lease_until", "cancel_requested")}
+        job["cancel_requested"] = bool(row["cancel_requested"])
+        job["result"] = json.loads(row["result"]) if row["result"] is not None else None
+        job["error"] = json.loads(row["error"]) if row["error"] is not None else None
+        job["attach"] = json.loads(row["attach"])
+        return job
+
+
+class JobQueue:
+    """
+    Background question jobs: POST a question, poll its job, cancel it. JOB_WORKERS
+    tasks per process claim jobs from the JobStore and run the question pipeline;
+    LLM failures (and a busy session) are retried with exponential backoff up to
+    JOB_MAX_ATTEMPTS, other errors fail the job. Finished jobs are kept
+    JOB_RESULT_TTL_SECONDS, then purged.
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self._workers: List[asyncio.Task] = []
+        self._executions: Dict[str, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+        self.stats_data: Dict[str, Any] = {"started": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "retried": 0}
+
+    def start(self):
+        """Start the worker tasks on the running event loop"""
+        self._wakeup = asyncio.Event()
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < settings.job_workers:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        # les jobs en cours sont rendus à la file par leur worker
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def submit(
+        self,
+        session_id: str,
+        question: str,
+        answer_mode: str = "auto",
+        priority: int = 0,
+        database: Optional[str] = None,
+        attach: Sequence[str] = ()
+    ) -> Dict[str, Any]:
+        job = await run_blocking(self.store.submit, session_id, question, answer_mode, priority, database, attach)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await run_blocking(self.store.get, job_id)
+
+    async def list_jobs(self, session_id: str) -> List[Dict[str, Any]]:
+        return await run_blocking(self.store.list_jobs, session_id)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await run_blocking(self.store.cancel, job_id)
+        # job lancé par ce processus: arrêt immédiat, sinon au prochain renouvellement du bail
+        execution = self._executions.get(job_id)
+        if execution is not None:
+            execution.cancel()
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats_data,
+            "workers": sum(1 for w in self._workers if not w.done()),
+            "running_here": len(self._executions),
+            "jobs": self.store.counts(),
+        }
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await run_blocking(self.store.claim)
+            except Exception:
+                logger.exception("Could not claim a job")
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            await self._run(job)
+
+    async def _idle(self):
+        if time.time() - self._last_purge > settings.job_purge_interval_seconds:
+            self._last_purge = time.time()
+            purged = await run_blocking(self.store.purge)
+            if purged:
+                logger.info(f"Purged {purged} expired jobs")
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=settings.job_poll_interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job["job_id"]
+        self.stats_data["started"] += 1
+        # attente depuis que le job est exécutable (soumission ou fin du délai de retry)
+        metrics.stage_duration.observe(job["started_at"] - job["run_after"], stage="job_queue_wait", outcome="ok")
+        execution = asyncio.create_task(self._execute(job))
+        self._executions[job_id] = execution
+        watcher = asyncio.create_task(self._watch(job_id, execution))
+        try:
+            result = await execution
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # arrêt du worker: le job repart dans la file
+                await run_blocking(self.store.release, job_id)
+                raise
+            await self._record(job_id, CANCELLED)
+        except Exception as e:
+            await self._failed(job, e)
+        else:
+            # le résultat contient des modèles pydantic (query_result)
+            await self._record(job_id, SUCCEEDED, result=jsonable_encoder(result))
+        finally:
+            watcher.cancel()
+            self._executions.pop(job_id, None)
+
+    async def _execute(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        session_id = job["session_id"]
+        if await run_blocking(self.store.cancel_requested, job["job_id"]):
+            raise asyncio.CancelledError()
+        api_keys = SessionService.get_api_keys(session_id)
+        file_service = FileService()
+        db_file = file_service.get_database_file(session_id, job["database"])
+        attached = file_service.attached_databases(session_id, job["attach"], db_file) if job["attach"] else {}
+        with metrics.span("job", session_id=session_id, job_id=job["job_id"]):
+            return await QueryService().answer_question(
+                question=job["question"],
+                session_id=session_id,
+                db_path=db_file.file_path,
+                api_keys=api_keys,
+                answer_mode=job["answer_mode"],
+                attached=attached
+            )
+
+    async def _watch(self, job_id: str, execution: asyncio.Task):
+        """Renew the lease of a running job and stop it when another process cancels it"""
+        renewed = time.monotonic()
+        while not execution.done():
+            await asyncio.sleep(settings.job_poll_interval_seconds)
+            if time.monotonic() - renewed > settings.job_lease_seconds / 3:
+                renewed = time.monotonic()
+                cancelled = await run_blocking(self.store.renew, job_id)
+            else:
+                cancelled = await run_blocking(self.store.cancel_requested, job_id)
+            if cancelled:
+                execution.cancel()
+
+    async def _failed(self, job: Dict[str, Any], error: Exception):
+        detail = error.to_dict() if isinstance(error, SQLSandboxError) else str(error)
+        if _retryable(error) and job["attempts"] < settings.job_max_attempts:
+            delay = min(
+                settings.job_retry_backoff_seconds * 2 ** (job["attempts"] - 1),
+                settings.job_retry_backoff_max_seconds
+            )
+            logger.warning(f"Job {job['job_id']} attempt {job['attempts']} failed, retry in {delay:.1f}s: {detail}")
+            await run_blocking(self.store.retry, job["job_id"], detail, delay)
+            self.stats_data["retried"] += 1
+            jobs_finished.inc(outcome="retried")
+            return
+        logger.error(f"Job {job['job_id']} failed: {detail}")
+        await self._record(job["job_id"], FAILED, error=detail)
+
+    async def _record(self, job_id: str, status: str, result: Any = None, error: Any = None):
+        await run_blocking(self.store.finish, job_id, status, result, error)
+        self.stats_data[status] += 1
+        jobs_finished.inc(outcome=status)
+
+
+def _retryable(error: BaseException) -> bool:
+    """LLM failures anywhere in the exception chain, or the session's SQL slots being busy"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, (LLMError, TooManyQueriesError)):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _dump(value: Any) -> Optional[str]:
+    return json.dumps(value, default=str) if value is not None else None
+
+
+job_queue = JobQueue(JobStore(settings.job_db_path))
@@ -0,0 +1,146 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.chat_models import init_chat_model
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers import LangChainTracer
+from langsmith import Client as LangSmithClient
+
+from config import settings
+from models.schemas import APIKeys, QueryOutput
+from services.fake_llm import FakeChatModel
+from utils.metrics import current_stage, metrics
+
+
+llm_tokens = metrics.counter(
+    "sql_qa_llm_tokens_total", "LLM tokens reported by the provider", ("stage", "kind")
+)
+
+
+@dataclass
+class LLMClients:
+    """Chat model instances bound to one set of credentials"""
+    llm: Any
+    sql_llm: Any
+    # modèle (moins cher) qui résume les résultats en réponse
+    answer_llm: Any
+    callbacks: List[Any] = field(default_factory=list)
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def run_config(self) -> Dict[str, Any]:
+        """Config to pass to invoke/ainvoke so LangSmith traces go to the session's project"""
+        return {"callbacks": self.callbacks} if self.callbacks else {}
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Counts the tokens of every chat model call, attributed to the running metrics span"""
+
+    def on_llm_end(self, response: Any, **kwargs: Any):
+        stage = current_stage() or "unknown"
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    llm_tokens.inc(usage.get("input_tokens", 0), stage=stage, kind="input")
+                    llm_tokens.inc(usage.get("output_tokens", 0), stage=stage, kind="output")
+
+
+class LLMClientCache:
+    """
+    TTL + LRU cache of chat model clients keyed by credentials.
+    Keys are passed explicitly to the clients, never written to os.environ,
+    so concurrent sessions with different keys cannot overwrite each other.
+    """
+
+    def __init__(
+        self,
+        max_size: int = settings.llm_client_cache_size,
+        ttl_seconds: float = settings.llm_client_ttl_seconds
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clients: "OrderedDict[Tuple[str, Optional[str], str, str], LLMClients]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, api_keys: APIKeys) -> LLMClients:
+        """Return the cached clients for these credentials, creating them if needed"""
+        key = (
+            settings.llm_model,
+            settings.llm_answer_model,
+            self._fingerprint(api_keys.gemini_api_key),
+            self._fingerprint(api_keys.langchain_api_key),
+        )
+        now = time.monotonic()
+        with self._lock:
+            clients = self._clients.get(key)
+            if clients is not None and now - clients.created_at < self.ttl_seconds:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return clients
+            self.misses += 1
+
+        clients = self._create(api_keys)
+        with self._lock:
+            self._clients[key] = clients
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return clients
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._clients),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    @staticmethod
+    def _fingerprint(secret: Optional[str]) -> str:
+        # ne jamais garder la clé en clair dans la clé du cache
+        return hashlib.sha256((secret or "").encode()).hexdigest()
+
+    @staticmethod
+    def _create(api_keys: APIKeys) -> LLMClients:
+        if settings.llm_provider == "fake":
+            # modèle local déterministe pour les tests et benchmarks
+            llm = answer_llm = FakeChatModel.from_settings()
+        else:
+            llm = init_chat_model(
+                settings.llm_model,
+                model_provider=settings.llm_provider,
+                google_api_key=api_keys.gemini_api_key
+            )
+            answer_llm = init_chat_model(
+                settings.llm_answer_model or settings.llm_model,
+                model_provider=settings.llm_provider,
+                google_api_key=api_keys.gemini_api_key,
+                max_tokens=settings.llm_answer_max_tokens
+            )
+        callbacks = [TokenUsageHandler()] if settings.metrics_enabled else []
+        if settings.langsmith_tracing and api_keys.langchain_api_key:
+            callbacks.append(
+                LangChainTracer(client=LangSmithClient(api_key=api_keys.langchain_api_key))
+            )
+        return LLMClients(
+            llm=llm,
+            sql_llm=llm.with_structured_output(QueryOutput),
+            answer_llm=answer_llm,
+            callbacks=callbacks
+        )
+
+
+llm_clients = LLMClientCache()
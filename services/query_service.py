@@ -1,18 +1,72 @@
-import os
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
 from fastapi import HTTPException
+from sqlalchemy.exc import SQLAlchemyError
 from langchain_community.utilities import SQLDatabase
-from langchain.chat_models import init_chat_model
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
 from models.schemas import (
-    QueryOutput, 
     SQLQuery, 
     QueryResult, 
     GeneratedAnswer, 
     APIKeys,
     DatabaseFile
 )
+from config import settings
+from models.database import DatabaseEntry, database_registry, database_path
+from services.schema_service import SchemaContext, schema_cache
+from services.schema_linker import schema_linker
+from services.fast_path import FastPathMatch, fast_path
+from services.answer_strategy import SUMMARY, TEMPLATE, answer_strategy
+from services.llm_service import LLMClients, llm_clients
+from services.sql_cache import sql_cache
+from services.result_cache import CachedResult, result_cache, canonicalize_sql, is_read_only
+from services.result_summary import ResultCollector
+from services.result_export import ResultWriter
+from services.sql_validator import QueryPlan, sql_validator
+from services.index_advisor import index_advisor
+from utils.helpers import run_blocking, llm_slot, normalize_question, SingleFlight
+from utils.metrics import metrics
+from utils.security import QueryRejectedError, SQLSandboxError, sql_sandbox
+
+
+SQL_SYSTEM_MESSAGE = """
+Given an input question, create a syntactically correct {dialect} query to
+run to help find the answer. Unless the user specifies in his question a
+specific number of examples they wish to obtain, always limit your query to
+at most {top_k} results. You can order the results by a relevant column to
+return the most interesting examples in the database.
+
+Never query for all the columns from a specific table, only ask for a the
+few relevant columns given the question.
+
+Pay attention to use only the column names that you can see in the schema
+description. Be careful to not query for columns that do not exist. Also,
+pay attention to which column is in which table.
+
+Only use the following tables:
+{table_info}
+"""
+
+QUERY_PROMPT_TEMPLATE = ChatPromptTemplate([
+    ("system", SQL_SYSTEM_MESSAGE),
+    ("user", "{input}")
+])
+
+REPAIR_PROMPT_TEMPLATE = ChatPromptTemplate([
+    ("system", SQL_SYSTEM_MESSAGE),
+    ("user", "{input}"),
+    ("ai", "{query}"),
+    ("user", (
+        "This query was rejected before execution: {problem}\n"
+        "Rewrite it using only the tables and columns of the schema, and keep it "
+        "cheap to run (filter, aggregate or add a LIMIT)."
+    ))
+])
+
+# questions identiques en cours pour la même base: un seul passage dans le pipeline
+question_flights = SingleFlight()
+
+sql_queries_in_flight = metrics.gauge("sql_qa_sql_queries_in_flight", "SQL queries being executed")
 
 
 class QueryService:
@@ -25,127 +79,647 @@ class QueryService:
         question: str, 
         session_id: str, 
         db_path: str, 
-        api_keys: APIKeys
+        api_keys: APIKeys,
+        answer_mode: str = "auto",
+        attached: Optional[Dict[str, str]] = None
     ) -> Dict[str, Any]:
         """
         Complete pipeline: question -> SQL query -> execute -> generate answer
         """
         try:
-            # Set environment variables for API keys
-            os.environ["GOOGLE_API_KEY"] = api_keys.gemini_api_key
-            os.environ["LANGSMITH_API_KEY"] = api_keys.langchain_api_key
-            os.environ["LANGSMITH_TRACING"] = "true"
-            
-            # Initialize database connection
-            db = SQLDatabase.from_uri(f"sqlite:///{db_path}")
-            
-            # Initialize LLM
-            llm = init_chat_model("gemini-2.5-pro", model_provider="google_genai")
-            
-            # Step 1: Convert question to SQL query
-            sql_query = await self._generate_sql_query(question, db, llm)
-            
-            # Step 2: Execute the SQL query
-            query_result = await self._execute_query(sql_query, db)
-            
-            # Step 3: Generate natural language answer
-            final_answer = await self._generate_answer(
-                question, sql_query, query_result, llm
-            )
-            
-            return {
-                "session_id": session_id,
-                "question": question,
-                "sql_query": sql_query,
-                "query_result": query_result,
-                "answer": final_answer
-            }
+            return await self.answer_question(question, session_id, db_path, api_keys, answer_mode, attached)
             
+        except SQLSandboxError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.to_dict())
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
         except Exception as e:
             raise HTTPException(
                 status_code=500, 
                 detail=f"Error processing question: {str(e)}"
             )
 
+    async def answer_question(
+        self, 
+        question: str, 
+        session_id: str, 
+        db_path: str, 
+        api_keys: APIKeys,
+        answer_mode: str = "auto",
+        attached: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Any]:
+        """process_question without the HTTP error mapping (background jobs classify errors themselves)"""
+        entry, schema = await self._open_database(session_id, db_path, attached)
+        
+        # Reuse the chat model clients bound to this session's API keys
+        clients = llm_clients.get(api_keys)
+        
+        async def execute(sql_query: str, plan: QueryPlan) -> ResultCollector:
+            return await self._execute_observed(sql_query, plan, entry, schema, session_id)
+        
+        # concurrent identical requests (e.g. a dashboard refresh) share one run
+        result = await question_flights.do(
+            self._flight_key(session_id, schema, question, answer_mode),
+            lambda: self._run_pipeline(question, session_id, entry, schema, clients, execute, answer_mode)
+        )
+        return {**result, "question": question}
+
+    async def stream_batch(
+        self, 
+        questions: List[str], 
+        session_id: str, 
+        db_path: str, 
+        api_keys: APIKeys,
+        concurrency: int = settings.batch_concurrency,
+        answer_mode: str = "auto",
+        attached: Optional[Dict[str, str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Answer several questions against one session database. The database and
+        schema context are opened once, duplicate questions and duplicate
+        generated SQL run once, and at most `concurrency` pipelines run at a
+        time. Yields one "result" (or "error") event per input question, in
+        completion order, each carrying the question's index, then "done".
+        """
+        try:
+            entry, schema = await self._open_database(session_id, db_path, attached)
+            clients = llm_clients.get(api_keys)
+        except Exception as e:
+            yield {"event": "error", "detail": f"Error processing questions: {str(e)}"}
+            return
+
+        # questions identiques (après normalisation) -> une seule exécution du pipeline
+        positions: Dict[str, List[int]] = {}
+        for index, question in enumerate(questions):
+            positions.setdefault(normalize_question(question), []).append(index)
+
+        pipelines = asyncio.Semaphore(concurrency)
+        # le sandbox refuse plus de N requêtes SQL simultanées par session
+        sql_slots = asyncio.Semaphore(min(concurrency, settings.sql_max_concurrent_per_session))
+        executions: Dict[str, asyncio.Task] = {}
+
+        async def execute(sql_query: str, plan: QueryPlan) -> ResultCollector:
+            key = canonicalize_sql(sql_query)
+            if key not in executions:
+                async def run() -> ResultCollector:
+                    async with sql_slots:
+                        return await self._execute_observed(sql_query, plan, entry, schema, session_id)
+                executions[key] = asyncio.create_task(run())
+            # une question annulée ne doit pas annuler l'exécution partagée
+            return await asyncio.shield(executions[key])
+
+        async def answer(indexes: List[int]) -> Tuple[List[int], Dict[str, Any]]:
+            question = questions[indexes[0]]
+            async with pipelines:
+                try:
+                    result = await question_flights.do(
+                        self._flight_key(session_id, schema, question, answer_mode),
+                        lambda: self._run_pipeline(
+                            question, session_id, entry, schema, clients, execute, answer_mode
+                        )
+                    )
+                    return indexes, {"event": "result", "result": result}
+                except SQLSandboxError as e:
+                    return indexes, {"event": "error", "detail": e.to_dict()}
+                except Exception as e:
+                    return indexes, {"event": "error", "detail": f"Error processing question: {str(e)}"}
+
+        tasks = [asyncio.create_task(answer(indexes)) for indexes in positions.values()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indexes, event = await next_done
+                for index in indexes:
+                    yield {**event, "index": index, "question": questions[index]}
+            yield {
+                "event": "done",
+                "count": len(questions),
+                "unique_questions": len(positions),
+                "unique_queries": len(executions)
+            }
+        finally:
+            for task in tasks + list(executions.values()):
+                task.cancel()
+
+    async def stream_question(
+        self, 
+        question: str, 
+        session_id: str, 
+        db_path: str, 
+        api_keys: APIKeys,
+        answer_mode: str = "auto",
+        attached: Optional[Dict[str, str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Same pipeline as process_question, yielding events as soon as each stage
+        has output: "sql", one "rows" event per fetched batch, "answer" tokens,
+        then "done" with the full result (or "error")
+        """
+        try:
+            entry, schema = await self._open_database(session_id, db_path, attached)
+            clients = llm_clients.get(api_keys)
+
+            async def execute(sql_query: str, plan: QueryPlan) -> ResultCollector:
+                return await self._execute_observed(sql_query, plan, entry, schema, session_id)
+
+            # le résultat d'un gabarit est petit: exécuté d'abord, pour retomber sur le LLM en cas d'erreur
+            fast = await self._run_fast_path(question, entry, schema, execute)
+            if fast is not None:
+                match, plan, result = fast
+                sql_query = match.sql
+                fast_path_info = match.to_dict()
+                yield {
+                    "event": "sql", "sql_query": sql_query, "query_plan": plan.to_dict(), "fast_path": fast_path_info
+                }
+                yield {"event": "rows", "columns": result.columns, "rows": [list(row) for row in result.head]}
+            else:
+                match = fast_path_info = None
+                sql_query, plan = await self._resolve_sql_query(question, entry, schema, clients)
+                yield {"event": "sql", "sql_query": sql_query, "query_plan": plan.to_dict(), "fast_path": None}
+
+                result = ResultCollector()
+                # inclut le temps passé à envoyer les lignes au client
+                with metrics.span("sql_stream", session_id=session_id):
+                    try:
+                        async for columns, batch in self._iter_result_batches(
+                            sql_query, entry, schema.content_hash, session_id
+                        ):
+                            result.add(columns, batch)
+                            yield {"event": "rows", "columns": columns, "rows": [list(row) for row in batch]}
+                    except SQLAlchemyError as e:
+                        result.fail(f"Error: {e}")
+                        yield {"event": "sql_error", "detail": result.error}
+                result.finish()
+                if result.error is None:
+                    await index_advisor.observe(entry, schema, sql_query, plan)
+
+            strategy = answer_strategy.choose(result, answer_mode, template=match is not None)
+            answer_strategy.record(strategy)
+            answer_parts = []
+            if strategy == SUMMARY:
+                prompt = self._answer_prompt(
+                    question, sql_query, result.prompt_summary(max_string_length=entry.db._max_string_length)
+                )
+                with metrics.span("answer_stream", session_id=session_id):
+                    async with llm_slot():
+                        async for chunk in clients.answer_llm.astream(prompt, config=clients.run_config):
+                            if isinstance(chunk.content, str) and chunk.content:
+                                answer_parts.append(chunk.content)
+                                yield {"event": "answer", "token": chunk.content}
+            else:
+                # réponse construite sans appel au LLM (gabarit ou petit résultat), ou pas de réponse
+                if strategy == TEMPLATE:
+                    answer = match.answer(result)
+                else:
+                    answer = answer_strategy.local_answer(result, strategy)
+                if answer is not None:
+                    answer_parts.append(answer)
+                    yield {"event": "answer", "token": answer}
+
+            yield {
+                "event": "done",
+                "result": {
+                    "session_id": session_id,
+                    "question": question,
+                    "sql_query": sql_query,
+                    "query_plan": plan.to_dict(),
+                    "query_result": result.to_query_result().model_dump(),
+                    "answer": "".join(answer_parts) if answer_parts else None,
+                    "answer_strategy": strategy,
+                    "fast_path": fast_path_info
+                }
+            }
+
+        except SQLSandboxError as e:
+            yield {"event": "error", "detail": e.to_dict()}
+        except Exception as e:
+            # les en-têtes sont déjà partis, l'erreur devient un événement
+            yield {"event": "error", "detail": f"Error processing question: {str(e)}"}
+
+    async def prepare_export(
+        self,
+        session_id: str,
+        db_path: str,
+        sql_query: Optional[str] = None,
+        question: Optional[str] = None,
+        attached: Optional[Dict[str, str]] = None
+    ) -> Tuple[str, DatabaseEntry, SchemaContext]:
+        """
+        Resolve the query of an export before any byte is sent: the given SQL,
+        or the one a question resolves to without the LLM, in the pipeline's
+        order (fast path template, then the SQL cached for an already answered
+        question). The client's SQL must be a single read-only statement
+        whatever the pre-flight settings, then goes through the pre-flight
+        check like generated SQL. No LLM is called.
+        """
+        entry, schema = await self._open_database(session_id, db_path, attached)
+        if sql_query is None:
+            # les questions servies par un gabarit ne passent jamais par le cache SQL
+            fast = await self._match_fast_path(question, entry, schema)
+            if fast is not None:
+                sql_query = fast[0].sql
+            else:
+                sql_query = sql_cache.get(question, schema.content_hash)
+            if sql_query is None:
+                raise FileNotFoundError("No query cached for this question, ask it first")
+        with metrics.span("preflight"):
+            error = await run_blocking(sql_validator.check_read_only, sql_query, entry)
+            if error is not None:
+                raise QueryRejectedError(f"Export query rejected: {error}", reason="invalid_sql")
+            plan = await run_blocking(sql_validator.check, sql_query, entry, schema)
+        if plan.error is not None:
+            raise QueryRejectedError(
+                f"Export query rejected: {plan.error}",
+                reason=plan.error_code,
+                query_plan=plan.to_dict()
+            )
+        return sql_query, entry, schema
+
+    async def export_rows(
+        self,
+        sql_query: str,
+        entry: DatabaseEntry,
+        schema: SchemaContext,
+        session_id: str,
+        writer: ResultWriter
+    ) -> AsyncIterator[bytes]:
+        """
+        Encode the query result with `writer` batch by batch, straight from the
+        cursor: memory stays bounded by one batch. Exports get their own, larger
+        sandbox limits; an error once the body has started aborts the response.
+        """
+        limits = {
+            "timeout_seconds": settings.export_timeout_seconds,
+            "max_rows": settings.export_max_rows,
+            "max_bytes": settings.export_max_bytes,
+        }
+        with metrics.span("export", session_id=session_id):
+            started = False
+            async for columns, batch in self._iter_result_batches(
+                sql_query, entry, schema.content_hash, session_id,
+                batch_size=settings.export_batch_size, limits=limits
+            ):
+                if not started:
+                    started = True
+                    yield writer.start(columns)
+                data = await run_blocking(writer.write, batch)
+                if data:
+                    yield data
+            if not started:
+                # instruction sans lignes (pas un SELECT): fichier vide avec en-tête vide
+                yield writer.start([])
+            yield writer.finish()
+
+    @staticmethod
+    def _flight_key(
+        session_id: str, schema: SchemaContext, question: str, answer_mode: str
+    ) -> Tuple[str, str, str, str]:
+        # la session fait partie de la clé: ses clés API paient les appels LLM
+        return session_id, schema.content_hash, normalize_question(question), answer_mode
+
+    async def _open_database(
+        self, 
+        session_id: str, 
+        db_path: str, 
+        attached: Optional[Dict[str, str]] = None
+    ) -> Tuple[DatabaseEntry, SchemaContext]:
+        """
+        Pooled database entry and cached schema context of a session database,
+        with the `attached` (alias -> file) databases ATTACHed to it
+        """
+        # reflection and hashing are blocking, keep them off the event loop
+        with metrics.span("engine", session_id=session_id):
+            entry = await run_blocking(database_registry.get, session_id, db_path, attached)
+        with metrics.span("schema", session_id=session_id):
+            schema = await run_blocking(schema_cache.get, db_path, entry.db)
+            if attached:
+                # chaque base attachée garde son contexte, mis en cache par contenu
+                contexts = {}
+                for alias, path in attached.items():
+                    attached_entry = await run_blocking(database_registry.get, session_id, path)
+                    contexts[alias] = await run_blocking(schema_cache.get, path, attached_entry.db)
+                schema = schema_cache.combine(schema, contexts)
+        return entry, schema
+
+    async def _run_pipeline(
+        self, 
+        question: str, 
+        session_id: str, 
+        entry: DatabaseEntry, 
+        schema: SchemaContext, 
+        clients: LLMClients,
+        execute: Callable[[str, QueryPlan], Awaitable[ResultCollector]],
+        answer_mode: str = "auto"
+    ) -> Dict[str, Any]:
+        """question -> SQL query -> execute -> answer, on an already opened database"""
+        # Simple lookups: template SQL and answer, no LLM call
+        match = None
+        fast = await self._run_fast_path(question, entry, schema, execute)
+        if fast is not None:
+            match, plan, result = fast
+            sql_query = match.sql
+
+        if match is None:
+            # Step 1: Convert question to SQL query (skipped on a cache hit), validated with EXPLAIN
+            sql_query, plan = await self._resolve_sql_query(question, entry, schema, clients)
+            
+            # Step 2: Execute the SQL query
+            result = await execute(sql_query, plan)
+        
+        # Step 3: Answer locally when the result is small, otherwise summarize it with the answer model
+        strategy = answer_strategy.choose(result, answer_mode, template=match is not None)
+        answer_strategy.record(strategy)
+        if strategy == SUMMARY:
+            final_answer = await self._generate_answer(
+                question, 
+                sql_query, 
+                result.prompt_summary(max_string_length=entry.db._max_string_length), 
+                clients
+            )
+        elif strategy == TEMPLATE:
+            final_answer = match.answer(result)
+        else:
+            final_answer = answer_strategy.local_answer(result, strategy)
+        
+        return {
+            "session_id": session_id,
+            "question": question,
+            "sql_query": sql_query,
+            "query_plan": plan.to_dict(),
+            "query_result": result.to_query_result(),
+            "answer": final_answer,
+            "answer_strategy": strategy,
+            "fast_path": match.to_dict() if match is not None else None
+        }
+
+    async def _run_fast_path(
+        self, 
+        question: str, 
+        entry: DatabaseEntry, 
+        schema: SchemaContext,
+        execute: Callable[[str, QueryPlan], Awaitable[ResultCollector]]
+    ) -> Optional[Tuple[FastPathMatch, QueryPlan, ResultCollector]]:
+        """
+        Execute the template SQL of a simple question. None when no template
+        applies or its query failed: the question then goes to the LLM.
+        """
+        fast = await self._match_fast_path(question, entry, schema)
+        if fast is None:
+            return None
+        match, plan = fast
+        result = await execute(match.sql, plan)
+        if result.error is not None:
+            fast_path.fallback()
+            return None
+        return match, plan, result
+
+    async def _match_fast_path(
+        self, 
+        question: str, 
+        entry: DatabaseEntry, 
+        schema: SchemaContext
+    ) -> Optional[Tuple[FastPathMatch, QueryPlan]]:
+        """Template SQL for a simple question, checked like generated SQL; None sends it to the LLM"""
+        with metrics.span("fast_path"):
+            match = fast_path.match(question, schema)
+        if match is None:
+            return None
+        with metrics.span("preflight"):
+            plan = await run_blocking(sql_validator.check, match.sql, entry, schema)
+        if plan.error is not None or plan.needs_repair:
+            fast_path.fallback()
+            return None
+        return match, plan
+
+    async def _resolve_sql_query(
+        self, 
+        question: str, 
+        entry: DatabaseEntry, 
+        schema: SchemaContext, 
+        clients: LLMClients
+    ) -> Tuple[str, QueryPlan]:
+        """
+        Cached SQL for this question, or a freshly generated one. The query is
+        checked with EXPLAIN QUERY PLAN before it touches data, with at most one
+        LLM repair round; queries still invalid or too expensive are rejected.
+        """
+        with metrics.span("sql_cache"):
+            sql_query = sql_cache.get(question, schema.content_hash)
+        if sql_query is not None:
+            with metrics.span("preflight"):
+                plan = await run_blocking(sql_validator.check, sql_query, entry, schema)
+            if plan.error is None:
+                return sql_query, plan
+
+        sql_query = await self._generate_sql_query(question, schema, clients)
+        with metrics.span("preflight"):
+            plan = await run_blocking(sql_validator.check, sql_query, entry, schema)
+
+        if plan.needs_repair and settings.sql_preflight_repair:
+            repaired = await self._repair_sql_query(question, sql_query, plan, schema, clients)
+            with metrics.span("preflight"):
+                repaired_plan = await run_blocking(sql_validator.check, repaired, entry, schema)
+            # une réparation ratée ne remplace pas une requête valide
+            if repaired_plan.error is None or plan.error is not None:
+                sql_query, plan = repaired, repaired_plan
+
+        if plan.error is not None:
+            raise QueryRejectedError(
+                f"Generated SQL rejected: {plan.error}",
+                reason=plan.error_code,
+                query_plan=plan.to_dict()
+            )
+
+        await run_blocking(sql_cache.put, question, schema.content_hash, sql_query)
+        return sql_query, plan
+
     async def _generate_sql_query(
         self, 
         question: str, 
-        db: SQLDatabase, 
-        llm
+        schema: SchemaContext, 
+        clients: LLMClients
     ) -> str:
         """Generate SQL query from natural language question"""
         try:
-            system_message = """
-            Given an input question, create a syntactically correct {dialect} query to
-            run to help find the answer. Unless the user specifies in his question a
-            specific number of examples they wish to obtain, always limit your query to
-            at most {top_k} results. You can order the results by a relevant column to
-            return the most interesting examples in the database.
-
-            Never query for all the columns from a specific table, only ask for a the
-            few relevant columns given the question.
-
-            Pay attention to use only the column names that you can see in the schema
-            description. Be careful to not query for columns that do not exist. Also,
-            pay attention to which column is in which table.
-
-            Only use the following tables:
-            {table_info}
-            """
-            
-            query_prompt_template = ChatPromptTemplate([
-                ("system", system_message), 
-                ("user", "{input}")
-            ])
-            
-            prompt = query_prompt_template.invoke({
-                "dialect": db.dialect,
+            # only the tables relevant to the question, within the prompt token budget
+            with metrics.span("schema_linking"):
+                table_info = await run_blocking(schema_linker.table_info, schema, question)
+            prompt = QUERY_PROMPT_TEMPLATE.invoke({
+                "dialect": schema.dialect,
                 "top_k": 10,
-                "table_info": db.get_table_info(),
+                "table_info": table_info,
                 "input": question
             })
             
-            structured_llm = llm.with_structured_output(QueryOutput)
-            result = structured_llm.invoke(prompt)
+            with metrics.span("sql_generation"):
+                async with llm_slot():
+                    result = await clients.sql_llm.ainvoke(prompt, config=clients.run_config)
             
             return result["query"]
             
         except Exception as e:
             raise Exception(f"Error generating SQL query: {str(e)}")
 
-    async def _execute_query(self, sql_query: str, db: SQLDatabase) -> str:
-        """Execute the generated SQL query"""
+    async def _repair_sql_query(
+        self, 
+        question: str, 
+        sql_query: str, 
+        plan: QueryPlan, 
+        schema: SchemaContext, 
+        clients: LLMClients
+    ) -> str:
+        """Ask the LLM once for a corrected query, given the pre-flight error"""
+        try:
+            with metrics.span("schema_linking"):
+                table_info = await run_blocking(schema_linker.table_info, schema, question)
+            prompt = REPAIR_PROMPT_TEMPLATE.invoke({
+                "dialect": schema.dialect,
+                "top_k": 10,
+                "table_info": table_info,
+                "input": question,
+                "query": sql_query,
+                "problem": plan.problem
+            })
+            
+            with metrics.span("sql_repair"):
+                async with llm_slot():
+                    result = await clients.sql_llm.ainvoke(prompt, config=clients.run_config)
+            
+            return result["query"]
+            
+        except Exception as e:
+            raise Exception(f"Error repairing SQL query: {str(e)}")
+
+    async def _execute_observed(
+        self, 
+        sql_query: str, 
+        plan: QueryPlan, 
+        entry: DatabaseEntry, 
+        schema: SchemaContext, 
+        session_id: str
+    ) -> ResultCollector:
+        """Execute the query and let the index advisor see its plan"""
+        with metrics.span("sql_execution", session_id=session_id):
+            result = await self._execute_query(sql_query, entry, schema.content_hash, session_id)
+        if result.error is None:
+            with metrics.span("index_advisor"):
+                await index_advisor.observe(entry, schema, sql_query, plan)
+        return result
+
+    async def _execute_query(
+        self, 
+        sql_query: str, 
+        entry: DatabaseEntry, 
+        db_version: str,
+        session_id: str
+    ) -> ResultCollector:
+        """Execute the generated SQL query batch by batch, reusing a cached result when possible"""
         try:
-            execute_query_tool = QuerySQLDatabaseTool(db=db)
-            result = execute_query_tool.invoke(sql_query)
-            return result
+            result = ResultCollector()
+            try:
+                async for columns, batch in self._iter_result_batches(
+                    sql_query, entry, db_version, session_id
+                ):
+                    result.add(columns, batch)
+            except SQLAlchemyError as e:
+                # même comportement que QuerySQLDatabaseTool: l'erreur va au LLM
+                result.fail(f"Error: {e}")
+            return result.finish()
             
+        except SQLSandboxError:
+            raise
         except Exception as e:
             raise Exception(f"Error executing SQL query: {str(e)}")
 
+    async def _iter_result_batches(
+        self, 
+        sql_query: str, 
+        entry: DatabaseEntry, 
+        db_version: str,
+        session_id: str,
+        batch_size: int = settings.stream_batch_size,
+        limits: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Tuple[List[str], List[Tuple[Any, ...]]]]:
+        """
+        Yield (columns, rows) batches straight from the cursor, or from the result
+        cache; an empty result yields its columns with no rows. Execution runs
+        inside the SQL sandbox (read-only connection, deadline, row/byte caps,
+        per-session concurrency cap), `limits` overriding its defaults.
+        """
+        result = result_cache.get(db_version, sql_query)
+        if result is not None:
+            rows = list(result.rows())
+            for start in range(0, len(rows), batch_size):
+                yield result.columns, rows[start:start + batch_size]
+            if not rows:
+                yield result.columns, []
+            return
+
+        # on ne garde les lignes pour le cache que tant que le résultat reste petit
+        columns, fetched = [], []
+        with sql_sandbox.session_slot(session_id), sql_queries_in_flight.track():
+            connection = await run_blocking(entry.engine.connect)
+            dbapi_connection = connection.connection.driver_connection
+            budget = sql_sandbox.start(dbapi_connection, **(limits or {}))
+            try:
+                cursor = await run_blocking(connection.exec_driver_sql, sql_query)
+                if cursor.returns_rows:
+                    columns = list(cursor.keys())
+                    empty = True
+                    while True:
+                        batch = await run_blocking(cursor.fetchmany, batch_size)
+                        if not batch:
+                            if empty:
+                                # les colonnes restent connues même sans lignes
+                                yield columns, []
+                            break
+                        empty = False
+                        budget.consume(batch)
+                        if fetched is not None:
+                            fetched.extend(batch)
+                            if len(fetched) > settings.result_max_rows:
+                                fetched = None
+                        yield columns, [tuple(row) for row in batch]
+            except SQLAlchemyError as e:
+                budget.check_timeout(e)
+                raise
+            finally:
+                sql_sandbox.stop(dbapi_connection)
+                await run_blocking(connection.close)
+
+        if not is_read_only(sql_query):
+            result_cache.invalidate(db_version)
+        elif fetched is not None:
+            result_cache.put(db_version, sql_query, CachedResult.from_rows(columns, fetched))
+
     async def _generate_answer(
         self, 
         question: str, 
         sql_query: str, 
         query_result: str, 
-        llm
+        clients: LLMClients
     ) -> str:
         """Generate natural language answer from query results"""
         try:
-            prompt = (
-                "Given the following user question, corresponding SQL query, "
-                "and SQL result, answer the user question.\n\n"
-                f"Question: {question}\n"
-                f"SQL Query: {sql_query}\n"
-                f"SQL Result: {query_result}"
-            )
+            prompt = self._answer_prompt(question, sql_query, query_result)
             
-            response = llm.invoke(prompt)
+            with metrics.span("answer_generation"):
+                async with llm_slot():
+                    response = await clients.answer_llm.ainvoke(prompt, config=clients.run_config)
             return response.content
             
         except Exception as e:
             raise Exception(f"Error generating answer: {str(e)}")
 
+    @staticmethod
+    def _answer_prompt(question: str, sql_query: str, query_result: str) -> str:
+        return (
+            "Given the following user question, corresponding SQL query, "
+            "and SQL result, answer the user question.\n\n"
+            f"Question: {question}\n"
+            f"SQL Query: {sql_query}\n"
+            f"SQL Result: {query_result}"
+        )
+
     # Optional: Keep individual methods for flexibility
     def generate_sql_query_only(
         self, 
@@ -155,41 +729,17 @@ class QueryService:
     ) -> SQLQuery:
         """Generate only SQL query (for testing or separate usage)"""
         try:
-            os.environ["GOOGLE_API_KEY"] = api_keys.gemini_api_key
-            llm = init_chat_model("gemini-2.5-pro", model_provider="google_genai")
-            
-            system_message = """
-            Given an input question, create a syntactically correct {dialect} query to
-            run to help find the answer. Unless the user specifies in his question a
-            specific number of examples they wish to obtain, always limit your query to
-            at most {top_k} results. You can order the results by a relevant column to
-            return the most interesting examples in the database.
-
-            Never query for all the columns from a specific table, only ask for a the
-            few relevant columns given the question.
-
-            Pay attention to use only the column names that you can see in the schema
-            description. Be careful to not query for columns that do not exist. Also,
-            pay attention to which column is in which table.
-
-            Only use the following tables:
-            {table_info}
-            """
-            
-            query_prompt_template = ChatPromptTemplate([
-                ("system", system_message), 
-                ("user", "{input}")
-            ])
-            
-            prompt = query_prompt_template.invoke({
-                "dialect": db.dialect,
+            clients = llm_clients.get(api_keys)
+            schema = schema_cache.get(database_path(db), db)
+            
+            prompt = QUERY_PROMPT_TEMPLATE.invoke({
+                "dialect": schema.dialect,
                 "top_k": 10,
-                "table_info": db.get_table_info(),
+                "table_info": schema_linker.table_info(schema, question),
                 "input": question
             })
             
-            structured_llm = llm.with_structured_output(QueryOutput)
-            result = structured_llm.invoke(prompt)
+            result = clients.sql_llm.invoke(prompt, config=clients.run_config)
             
             return SQLQuery(
                 session_id="", # Will be set by caller
@@ -205,10 +755,26 @@ class QueryService:
     def execute_sql_query(self, sql_query: str, db: SQLDatabase) -> QueryResult:
         """Execute SQL query and return result"""
         try:
-            execute_query_tool = QuerySQLDatabaseTool(db=db)
-            result = execute_query_tool.invoke(sql_query)
-            return QueryResult(result=[result])
+            result = ResultCollector()
+            with db._engine.begin() as connection:
+                dbapi_connection = connection.connection.driver_connection
+                budget = sql_sandbox.start(dbapi_connection)
+                try:
+                    cursor = connection.exec_driver_sql(sql_query)
+                    if cursor.returns_rows:
+                        columns = list(cursor.keys())
+                        for batch in iter(lambda: cursor.fetchmany(settings.stream_batch_size), []):
+                            budget.consume(batch)
+                            result.add(columns, batch)
+                except SQLAlchemyError as e:
+                    budget.check_timeout(e)
+                    raise
+                finally:
+                    sql_sandbox.stop(dbapi_connection)
+            return result.finish().to_query_result()
             
+        except SQLSandboxError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.to_dict())
         except Exception as e:
             raise HTTPException(
                 status_code=500, 
@@ -224,18 +790,11 @@ class QueryService:
     ) -> GeneratedAnswer:
         """Generate natural language answer from query results"""
         try:
-            os.environ["GOOGLE_API_KEY"] = api_keys.gemini_api_key
-            llm = init_chat_model("gemini-2.5-pro", model_provider="google_genai")
-            
-            prompt = (
-                "Given the following user question, corresponding SQL query, "
-                "and SQL result, answer the user question.\n\n"
-                f"Question: {question}\n"
-                f"SQL Query: {query}\n"
-                f"SQL Result: {result}"
-            )
+            clients = llm_clients.get(api_keys)
+            
+            prompt = self._answer_prompt(question, query, result)
             
-            response = llm.invoke(prompt)
+            response = clients.answer_llm.invoke(prompt, config=clients.run_config)
             return GeneratedAnswer(answer=response.content)
             
         except Exception as e:
@@ -0,0 +1,127 @@
+import re
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import settings
+from utils.security import sql_code
+
+
+@dataclass
+class CachedResult:
+    """Result set stored column by column"""
+    columns: List[str]
+    column_data: List[List[Any]]
+    row_count: int
+    nbytes: int
+
+    @classmethod
+    def from_rows(cls, columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> "CachedResult":
+        column_data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+        nbytes = sum(
+            sys.getsizeof(value) for values in column_data for value in values
+        ) + 8 * len(columns) * len(rows)
+        return cls(list(columns), column_data, len(rows), nbytes)
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        return zip(*self.column_data) if self.columns else iter(())
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Collapse whitespace and case outside quoted literals, drop trailing semicolons"""
+    parts, quote, buffer = [], None, []
+    for char in sql.strip().rstrip(";").strip():
+        if quote:
+            buffer.append(char)
+            if char == quote:
+                parts.append("".join(buffer))
+                buffer, quote = [], None
+        elif char in ("'", '"', "`"):
+            parts.append(_collapse("".join(buffer)))
+            buffer, quote = [char], char
+        else:
+            buffer.append(char)
+    tail = "".join(buffer)
+    parts.append(tail if quote else _collapse(tail))
+    return "".join(parts).strip()
+
+
+def _collapse(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower())
+
+
+def is_read_only(sql: str) -> bool:
+    """
+    True for statements that can safely be memoized. A text heuristic for the
+    cache only: execution itself is restricted by utils.security.read_only_statements.
+    """
+    code = sql_code(sql).strip().rstrip(";").strip().lower()
+    return code.startswith(("select", "with", "values")) and ";" not in code
+
+
+class ResultCache:
+    """
+    Memoizes executed SQL results keyed by (database version, canonical SQL).
+    The database version is the content hash of the file, so a write or a
+    re-upload naturally misses. Entries are evicted LRU under a memory budget.
+    """
+
+    def __init__(self, max_bytes: int = settings.result_cache_max_bytes):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], CachedResult]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, db_version: str, sql: str) -> Optional[CachedResult]:
+        key = (db_version, canonicalize_sql(sql))
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, db_version: str, sql: str, result: CachedResult):
+        # un seul résultat ne doit pas vider tout le cache
+        if result.nbytes > self.max_bytes // 4:
+            return
+        key = (db_version, canonicalize_sql(sql))
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = result
+            self._bytes += result.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, db_version: str) -> int:
+        """Drop every result computed against a database version"""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == db_version]
+            for key in keys:
+                self._bytes -= self._entries.pop(key).nbytes
+            return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,176 @@
+import base64
+import csv
+import io
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+# format -> (media type, file extension)
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class ResultWriter:
+    """
+    Encodes result batches incrementally: every call returns the bytes ready
+    to send, so memory stays bounded by one batch whatever the result size.
+    """
+
+    def start(self, columns: Sequence[str]) -> bytes:
+        self.columns = list(columns)
+        return b""
+
+    def write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class CSVWriter(ResultWriter):
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def start(self, columns: Sequence[str]) -> bytes:
+        super().start(columns)
+        self._writer.writerow(self.columns)
+        return self._drain()
+
+    def write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        self._writer.writerows(
+            [_base64(value) if isinstance(value, bytes) else value for value in row] for row in rows
+        )
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+class NDJSONWriter(ResultWriter):
+    def write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        return "".join(
+            json.dumps(dict(zip(self.columns, row)), default=_json_default) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file object whose content is handed out after each batch"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ArrowWriter(ResultWriter):
+    """
+    Arrow IPC stream, or Parquet with one row group per batch. The schema is
+    inferred from the first batch (SQLite columns are untyped); columns with
+    no value in it are exported as strings.
+    """
+
+    def __init__(self, parquet: bool = False):
+        # pyarrow est optionnel: seuls les exports arrow/parquet en ont besoin
+        try:
+            import pyarrow
+        except ImportError:
+            raise ValueError("Arrow and Parquet exports require pyarrow (pip install pyarrow)")
+        self.pa = pyarrow
+        self.parquet = parquet
+        self._sink = _Sink()
+        self._writer = None
+
+    def write(self, rows: Sequence[Sequence[Any]]) -> bytes:
+        if not rows:
+            return b""
+        if self._writer is None:
+            self._open(self._infer_schema(rows))
+        arrays = []
+        for index, field in enumerate(self._schema):
+            values = [row[index] for row in rows]
+            if field.type == self.pa.string():
+                values = [_as_text(value) for value in values]
+            try:
+                arrays.append(self.pa.array(values, type=field.type))
+            except (self.pa.ArrowInvalid, self.pa.ArrowTypeError, OverflowError) as e:
+                raise ValueError(
+                    f"Column '{field.name}' mixes value types, export it as CSV or NDJSON instead"
+                ) from e
+        # ParquetWriter écrit un row group par batch
+        self._writer.write_batch(self.pa.RecordBatch.from_arrays(arrays, schema=self._schema))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        if self._writer is None:
+            # résultat vide: un schéma sans lignes
+            self._open(self.pa.schema([(column, self.pa.string()) for column in self.columns]))
+        self._writer.close()
+        return self._sink.drain()
+
+    def _open(self, schema):
+        self._schema = schema
+        if self.parquet:
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(self._sink, schema)
+        else:
+            import pyarrow.ipc
+            self._writer = pyarrow.ipc.new_stream(self._sink, schema)
+
+    def _infer_schema(self, rows: Sequence[Sequence[Any]]):
+        pa = self.pa
+        types = {bool: pa.bool_(), int: pa.int64(), float: pa.float64(), bytes: pa.binary()}
+        fields = []
+        for index, column in enumerate(self.columns):
+            sample = next((row[index] for row in rows if row[index] is not None), None)
+            column_type = types.get(type(sample), pa.string())
+            # un entier suivi d'un réel dans la même colonne: garder des flottants
+            if column_type == pa.int64() and any(isinstance(row[index], float) for row in rows):
+                column_type = pa.float64()
+            fields.append((column, column_type))
+        return pa.schema(fields)
+
+
+def create_writer(export_format: str) -> ResultWriter:
+    if export_format == "csv":
+        return CSVWriter()
+    if export_format == "ndjson":
+        return NDJSONWriter()
+    if export_format in ("arrow", "parquet"):
+        return ArrowWriter(parquet=export_format == "parquet")
+    raise ValueError(f"Unknown export format: {export_format}")
+
+
+def _base64(value: bytes) -> str:
+    return base64.b64encode(value).decode("ascii")
+
+
+def _as_text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return _base64(value)
+    return str(value)
+
+
+def _json_default(value: Any) -> Optional[str]:
+    if isinstance(value, bytes):
+        return _base64(value)
+    return str(value)
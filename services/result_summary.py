@@ -0,0 +1,134 @@
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_community.utilities.sql_database import truncate_word
+
+from config import settings
+from models.schemas import ColumnInfo, QueryResult
+
+
+_SQL_TYPES = {bool: "integer", int: "integer", float: "real", str: "text", bytes: "blob"}
+
+
+class ResultCollector:
+    """
+    Consumes result batches with bounded memory: keeps the first rows for the
+    response, a short tail and running aggregates for the prompt summary, and
+    only counts the rest.
+    """
+
+    def __init__(
+        self,
+        max_rows: int = settings.result_max_rows,
+        tail_rows: int = settings.result_summary_tail_rows
+    ):
+        self.max_rows = max_rows
+        self.columns: List[str] = []
+        self.head: List[Tuple[Any, ...]] = []
+        self.tail: deque = deque(maxlen=tail_rows)
+        self.row_count = 0
+        self.error: Optional[str] = None
+        self.execution_time_ms = 0.0
+        self._types: List[Optional[str]] = []
+        self._numeric: Dict[int, List[float]] = {}
+        self._started = time.perf_counter()
+
+    @property
+    def truncated(self) -> bool:
+        return self.row_count > len(self.head)
+
+    def add(self, columns: Sequence[str], rows: Sequence[Sequence[Any]]):
+        if not self.columns:
+            self.columns = list(columns)
+            self._types = [None] * len(self.columns)
+        for row in rows:
+            row = tuple(row)
+            self.row_count += 1
+            if len(self.head) < self.max_rows:
+                self.head.append(row)
+            self.tail.append(row)
+            self._observe(row)
+
+    def fail(self, error: str):
+        self.error = error
+
+    def finish(self) -> "ResultCollector":
+        self.execution_time_ms = (time.perf_counter() - self._started) * 1000
+        return self
+
+    def to_query_result(self) -> QueryResult:
+        return QueryResult(
+            columns=[
+                ColumnInfo(name=name, type=col_type or "null")
+                for name, col_type in zip(self.columns, self._types)
+            ],
+            data=[dict(zip(self.columns, row)) for row in self.head],
+            row_count=self.row_count,
+            execution_time_ms=round(self.execution_time_ms, 3),
+            truncated=self.truncated,
+            error=self.error
+        )
+
+    def prompt_summary(
+        self,
+        max_chars: int = settings.result_summary_max_chars,
+        head_rows: int = settings.result_summary_head_rows,
+        max_string_length: int = 300
+    ) -> str:
+        """Size-bounded text of the result for the answer prompt"""
+        if self.error:
+            return self.error
+        if not self.row_count:
+            return ""
+
+        def render(rows) -> str:
+            return str([
+                tuple(truncate_word(value, length=max_string_length) for value in row)
+                for row in rows
+            ])
+
+        # petit résultat: même rendu que SQLDatabase.run
+        if self.row_count <= head_rows + len(self.tail) and not self.truncated:
+            full = render(self.head)
+            if len(full) <= max_chars:
+                return full
+
+        # la queue ne doit pas répéter des lignes déjà montrées en tête
+        tail_count = max(0, min(len(self.tail), self.row_count - head_rows))
+        shown_tail = list(self.tail)[len(self.tail) - tail_count:] if tail_count else []
+        omitted = self.row_count - min(head_rows, self.row_count) - len(shown_tail)
+        lines = [
+            f"Columns: {', '.join(self.columns)}",
+            f"Total rows: {self.row_count}",
+            f"First {min(head_rows, self.row_count)} rows: {render(self.head[:head_rows])}",
+        ]
+        if omitted > 0:
+            lines.append(f"... {omitted} rows omitted ...")
+        if shown_tail:
+            lines.append(f"Last {len(shown_tail)} rows: {render(shown_tail)}")
+        for index, (count, low, high, total) in self._numeric.items():
+            if count:
+                lines.append(
+                    f"{self.columns[index]}: min={low}, max={high}, avg={round(total / count, 4)}"
+                )
+        summary = "\n".join(lines)
+        if len(summary) > max_chars:
+            summary = summary[:max_chars] + "\n... (truncated)"
+        return summary
+
+    def _observe(self, row: Tuple[Any, ...]):
+        for index, value in enumerate(row):
+            if value is None:
+                continue
+            if self._types[index] is None:
+                self._types[index] = _SQL_TYPES.get(type(value), "text")
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                stats = self._numeric.get(index)
+                if stats is None:
+                    self._numeric[index] = [1, value, value, value]
+                else:
+                    stats[0] += 1
+                    stats[1] = min(stats[1], value)
+                    stats[2] = max(stats[2], value)
+                    stats[3] += value
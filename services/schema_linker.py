@@ -0,0 +1,176 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+from config import settings
+from services.schema_service import SchemaContext
+from utils.helpers import normalize_question
+
+
+CAMEL_CASE_RE = re.compile(r"([a-z0-9])([A-Z])")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+# "\tname TEXT," dans un CREATE TABLE
+COLUMN_LINE_RE = re.compile(r'^[ \t]+["`\[]?(\w+)["`\]]?\s+\w', re.MULTILINE)
+REFERENCES_RE = re.compile(r'\bREFERENCES\s+["`\[]?(\w+)', re.IGNORECASE)
+STOPWORDS = {
+    "a", "an", "and", "are", "by", "for", "from", "how", "in", "is", "many", "much", "of",
+    "on", "or", "show", "the", "to", "what", "which", "who", "with", "list", "give", "me",
+    "le", "la", "les", "de", "des", "du", "un", "une", "et", "ou", "en", "par", "pour",
+    "quel", "quels", "quelle", "quelles", "combien", "qui", "est", "sont", "dans",
+}
+# poids des champs: nom de table > noms de colonnes > commentaires et valeurs d'exemple
+TABLE_WEIGHT = 3
+COLUMN_WEIGHT = 2
+BM25_K1 = 1.5
+BM25_B = 0.75
+# tables scoring below this fraction of the best table are left out
+SCORE_CUTOFF = 0.25
+
+
+def tokenize(text: str) -> List[str]:
+    """Split identifiers (snake_case, camelCase), drop stopwords, crude plural stemming"""
+    text = normalize_question(CAMEL_CASE_RE.sub(r"\1 \2", text))
+    tokens = []
+    for token in TOKEN_RE.findall(text):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("ies"):
+            token = token[:-3] + "y"
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caractères par token pour les modèles courants
+    return len(text) // 4 + 1
+
+
+@dataclass
+class SchemaIndex:
+    """BM25 index with one document per table"""
+    term_freqs: Dict[str, Counter]
+    lengths: Dict[str, int]
+    doc_freqs: Counter
+    average_length: float
+    references: Dict[str, Set[str]]
+
+
+class SchemaLinker:
+    """
+    Picks the tables relevant to a question before SQL generation. Each table
+    (name, columns, comments and sample rows from get_table_info) is a BM25
+    document; the best matching tables, plus the tables their foreign keys
+    reference, are kept until SCHEMA_PROMPT_MAX_TOKENS is reached. Schemas
+    that already fit in the budget are sent unchanged.
+    """
+
+    def __init__(self, max_size: int = settings.schema_cache_max_size):
+        self.max_size = max_size
+        self._indexes: "OrderedDict[str, SchemaIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.pruned = 0
+        self.full = 0
+
+    def index(self, schema: SchemaContext) -> SchemaIndex:
+        """Index of a schema, built once per database version (at upload, or on first use)"""
+        with self._lock:
+            index = self._indexes.get(schema.content_hash)
+            if index is not None:
+                self._indexes.move_to_end(schema.content_hash)
+                return index
+
+        term_freqs, references = {}, {}
+        for table, info in schema.tables.items():
+            terms = Counter(tokenize(info))
+            for token in tokenize(table):
+                terms[token] += TABLE_WEIGHT
+            for column in COLUMN_LINE_RE.findall(info):
+                for token in tokenize(column):
+                    terms[token] += COLUMN_WEIGHT
+            term_freqs[table] = terms
+            references[table] = {
+                name for name in REFERENCES_RE.findall(info) if name in schema.tables and name != table
+            }
+        lengths = {table: sum(terms.values()) for table, terms in term_freqs.items()}
+        index = SchemaIndex(
+            term_freqs=term_freqs,
+            lengths=lengths,
+            doc_freqs=Counter(token for terms in term_freqs.values() for token in terms),
+            average_length=(sum(lengths.values()) / len(lengths)) if lengths else 0.0,
+            references=references,
+        )
+
+        with self._lock:
+            self._indexes[schema.content_hash] = index
+            while len(self._indexes) > self.max_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def table_info(self, schema: SchemaContext, question: str) -> str:
+        """Schema description for the SQL prompt, pruned to the token budget"""
+        budget = settings.schema_prompt_max_tokens
+        if not settings.schema_linking_enabled or estimate_tokens(schema.table_info) <= budget:
+            self.full += 1
+            return schema.table_info
+
+        scores = self.rank(schema, question)
+        ranked = sorted(schema.table_names, key=lambda table: -scores.get(table, 0.0))
+        index = self.index(schema)
+
+        selected: List[str] = []
+        used = 0
+
+        def add(table: str) -> bool:
+            nonlocal used
+            cost = estimate_tokens(schema.tables[table])
+            if table in selected or used + cost > budget:
+                return False
+            selected.append(table)
+            used += cost
+            return True
+
+        # aucune table ne correspond: remplir le budget dans l'ordre des noms
+        threshold = max(scores.values(), default=0.0) * SCORE_CUTOFF
+        for table in ranked:
+            if threshold > 0 and scores.get(table, 0.0) < threshold:
+                break
+            if add(table):
+                # les tables référencées par une clé étrangère servent aux jointures
+                for referenced in sorted(index.references[table]):
+                    add(referenced)
+
+        self.pruned += 1
+        if not selected:
+            # même la meilleure table dépasse le budget: la tronquer plutôt que l'omettre
+            return schema.tables[ranked[0]][:budget * 4]
+        return "\n\n".join(schema.tables[table] for table in sorted(selected))
+
+    def rank(self, schema: SchemaContext, question: str) -> Dict[str, float]:
+        """BM25 score of every table for the question"""
+        index = self.index(schema)
+        total = len(index.term_freqs)
+        scores = {}
+        for table, terms in index.term_freqs.items():
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * index.lengths[table] / (index.average_length or 1))
+            for token in set(tokenize(question)):
+                freq = terms.get(token, 0)
+                if not freq:
+                    continue
+                df = index.doc_freqs[token]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                score += idf * freq * (BM25_K1 + 1) / (freq + norm)
+            scores[table] = score
+        return scores
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"indexes": len(self._indexes), "pruned": self.pruned, "full": self.full}
+
+
+schema_linker = SchemaLinker()
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional, Tuple
+
+from langchain_community.utilities import SQLDatabase
+
+from config import settings
+from models.database import quote_identifier
+from utils.helpers import file_sha256, write_json_atomic
+
+
+SCHEMA_SUFFIX = ".schema.json"
+CREATE_TABLE_RE = re.compile(r'CREATE TABLE\s+(?:"(?:[^"]|"")+"|\S+)')
+
+
+@dataclass
+class SchemaContext:
+    """Precomputed schema description used to build the SQL generation prompt"""
+    content_hash: str
+    dialect: str
+    table_names: List[str]
+    tables: Dict[str, str]
+    table_info: str
+    # alias -> content hash of the ATTACHed databases, whose tables are named "alias.table"
+    attached: Dict[str, str] = field(default_factory=dict)
+
+
+class SchemaCache:
+    """
+    Caches db.get_table_info() per database content hash.
+    The context is persisted next to the .db file and kept in memory, a file is
+    only rehashed when its mtime or size changes.
+    """
+
+    def __init__(self, max_size: int = settings.schema_cache_max_size):
+        self.max_size = max_size
+        self._by_hash: "OrderedDict[str, SchemaContext]" = OrderedDict()
+        self._by_path: Dict[str, Tuple[float, int, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_path: str, db: SQLDatabase) -> SchemaContext:
+        """Return the schema context of a database, rebuilding it only if the file changed"""
+        file_path = str(file_path)
+        stat = os.stat(file_path)
+
+        with self._lock:
+            known = self._by_path.get(file_path)
+            if known and known[0] == stat.st_mtime and known[1] == stat.st_size:
+                context = self._by_hash.get(known[2])
+                if context is not None:
+                    self._by_hash.move_to_end(known[2])
+                    self.hits += 1
+                    return context
+            self.misses += 1
+
+        content_hash = file_sha256(file_path)
+        context = self._lookup(content_hash) or self._load(file_path, content_hash)
+        if context is None:
+            context = self._compute(content_hash, db)
+            self._save(file_path, context)
+        self._remember(file_path, stat, context)
+        return context
+
+    def build(self, file_path: str, db: SQLDatabase, content_hash: Optional[str] = None) -> SchemaContext:
+        """Compute and persist the schema context (used at upload time)"""
+        file_path = str(file_path)
+        stat = os.stat(file_path)
+        content_hash = content_hash or file_sha256(file_path)
+        context = self._lookup(content_hash) or self._compute(content_hash, db)
+        self._save(file_path, context)
+        self._remember(file_path, stat, context)
+        return context
+
+    def combine(self, main: SchemaContext, attached: Dict[str, SchemaContext]) -> SchemaContext:
+        """Schema context of a database with others ATTACHed, cached like the others by content hash"""
+        if not attached:
+            return main
+        digest = hashlib.sha256(main.content_hash.encode())
+        for alias, context in sorted(attached.items()):
+            digest.update(f"|{alias}={context.content_hash}".encode())
+        content_hash = digest.hexdigest()
+
+        combined = self._lookup(content_hash)
+        if combined is None:
+            tables = dict(main.tables)
+            for alias, context in attached.items():
+                for name, info in context.tables.items():
+                    qualified = f"{alias}.{name}"
+                    # "CREATE TABLE players" -> "CREATE TABLE sales.players"
+                    tables[qualified] = CREATE_TABLE_RE.sub(
+                        lambda _: f"CREATE TABLE {quote_table(qualified, attached)}", info, count=1
+                    )
+            combined = SchemaContext(
+                content_hash=content_hash,
+                dialect=main.dialect,
+                table_names=sorted(tables),
+                tables=tables,
+                table_info="\n\n".join(sorted(tables.values())),
+                attached={alias: context.content_hash for alias, context in attached.items()},
+            )
+            with self._lock:
+                self._by_hash[content_hash] = combined
+                while len(self._by_hash) > self.max_size:
+                    self._by_hash.popitem(last=False)
+        return combined
+
+    def forget(self, file_path: str) -> Optional[str]:
+        """Drop the path mapping of a file and return the content hash it pointed to"""
+        with self._lock:
+            known = self._by_path.pop(str(file_path), None)
+        return known[2] if known else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._by_hash),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _lookup(self, content_hash: str) -> Optional[SchemaContext]:
+        with self._lock:
+            context = self._by_hash.get(content_hash)
+            if context is not None:
+                self._by_hash.move_to_end(content_hash)
+            return context
+
+    def _remember(self, file_path: str, stat: os.stat_result, context: SchemaContext):
+        with self._lock:
+            self._by_path[file_path] = (stat.st_mtime, stat.st_size, context.content_hash)
+            self._by_hash[context.content_hash] = context
+            self._by_hash.move_to_end(context.content_hash)
+            while len(self._by_hash) > self.max_size:
+                self._by_hash.popitem(last=False)
+
+    @staticmethod
+    def _compute(content_hash: str, db: SQLDatabase) -> SchemaContext:
+        table_names = sorted(db.get_usable_table_names())
+        tables = {name: db.get_table_info([name]) for name in table_names}
+        return SchemaContext(
+            content_hash=content_hash,
+            dialect=db.dialect,
+            table_names=table_names,
+            tables=tables,
+            # même format que db.get_table_info()
+            table_info="\n\n".join(sorted(tables.values())),
+        )
+
+    @staticmethod
+    def _load(file_path: str, content_hash: str) -> Optional[SchemaContext]:
+        try:
+            with open(file_path + SCHEMA_SUFFIX, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("content_hash") != content_hash:
+                return None
+            return SchemaContext(**data)
+        except (OSError, ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _save(file_path: str, context: SchemaContext):
+        write_json_atomic(file_path + SCHEMA_SUFFIX, asdict(context))
+
+
+def quote_table(name: str, attached) -> str:
+    """Quoted table name, "alias"."table" for the tables of an attached database"""
+    alias, _, table = name.partition(".")
+    if table and alias in attached:
+        return f"{quote_identifier(alias)}.{quote_identifier(table)}"
+    return quote_identifier(name)
+
+
+schema_cache = SchemaCache()
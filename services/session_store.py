@@ -0,0 +1,241 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+from models.schemas import APIKeys, DatabaseFile
+
+
+class SessionBackend(ABC):
+    """Persistent storage of session records (plain JSON-serializable dicts)"""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def put(self, session_id: str, record: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def touch(self, session_id: str, last_accessed: float):
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def list_sessions(self) -> List[Tuple[str, float]]:
+        """(session_id, last_accessed) of every stored session"""
+        ...
+
+
+class InMemorySessionBackend(SessionBackend):
+    """Single-process backend, sessions are lost on restart"""
+
+    def __init__(self):
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(session_id)
+            return dict(record) if record else None
+
+    def put(self, session_id: str, record: Dict[str, Any]):
+        with self._lock:
+            self._records[session_id] = dict(record)
+
+    def touch(self, session_id: str, last_accessed: float):
+        with self._lock:
+            if session_id in self._records:
+                self._records[session_id]["last_accessed"] = last_accessed
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._records.pop(session_id, None)
+
+    def list_sessions(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            return [(sid, record["last_accessed"]) for sid, record in self._records.items()]
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    Sessions shared by every worker through a SQLite file in WAL mode,
+    so readers never block the writer and sessions survive restarts.
+    """
+
+    def __init__(self, path: str = settings.session_db_path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    record TEXT NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            """)
+        # la table contient des clés API
+        os.chmod(self.path, 0o600)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT record, last_accessed FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row[0])
+        record["last_accessed"] = row[1]
+        return record
+
+    def put(self, session_id: str, record: Dict[str, Any]):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO sessions (session_id, record, last_accessed) VALUES (?, ?, ?)",
+            (session_id, json.dumps(record), record["last_accessed"])
+        )
+
+    def touch(self, session_id: str, last_accessed: float):
+        self._connect().execute(
+            "UPDATE sessions SET last_accessed = ? WHERE session_id = ?",
+            (last_accessed, session_id)
+        )
+
+    def delete(self, session_id: str):
+        self._connect().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def list_sessions(self) -> List[Tuple[str, float]]:
+        return self._connect().execute(
+            "SELECT session_id, last_accessed FROM sessions"
+        ).fetchall()
+
+
+class SessionStore:
+    """
+    Read-through LRU in front of a SessionBackend. Cached records are
+    re-read after SESSION_CACHE_TTL_SECONDS so other workers' changes show
+    up, last access is written back at most every SESSION_TOUCH_INTERVAL_SECONDS,
+    and sessions idle for longer than SESSION_TTL_SECONDS expire.
+    """
+
+    def __init__(self, backend: SessionBackend):
+        self.backend = backend
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def create(self, session_id: str, api_keys: APIKeys) -> Dict[str, Any]:
+        now = time.time()
+        record = {
+            "api_keys": api_keys.model_dump(),
+            "created_at": datetime.now().isoformat(),
+            "database_file": None,
+            "last_accessed": now
+        }
+        self.backend.put(session_id, record)
+        self._remember(session_id, record)
+        return self._decode(record)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return the session (api_keys, created_at, database_file) or None if unknown or expired"""
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached and now - cached[0] < settings.session_cache_ttl_seconds:
+                self._cache.move_to_end(session_id)
+                self.hits += 1
+                record = cached[1]
+            else:
+                record = None
+                self.misses += 1
+
+        if record is None:
+            record = self.backend.get(session_id)
+            if record is None:
+                self._forget(session_id)
+                return None
+            self._remember(session_id, record)
+
+        if now - record["last_accessed"] > settings.session_ttl_seconds:
+            self.delete(session_id)
+            return None
+        if now - record["last_accessed"] > settings.session_touch_interval_seconds:
+            record["last_accessed"] = now
+            self.backend.touch(session_id, now)
+        return self._decode(record)
+
+    def update_database_file(self, session_id: str, db_file: DatabaseFile):
+        record = self.backend.get(session_id)
+        if record is None:
+            return
+        record["database_file"] = db_file.model_dump(mode="json")
+        record["last_accessed"] = time.time()
+        self.backend.put(session_id, record)
+        self._remember(session_id, record)
+
+    def delete(self, session_id: str):
+        self.backend.delete(session_id)
+        self._forget(session_id)
+
+    def expired_sessions(self) -> List[str]:
+        """Sessions idle for longer than the session TTL"""
+        deadline = time.time() - settings.session_ttl_seconds
+        return [sid for sid, last_accessed in self.backend.list_sessions() if last_accessed < deadline]
+
+    def last_accessed(self) -> Dict[str, float]:
+        return dict(self.backend.list_sessions())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def _remember(self, session_id: str, record: Dict[str, Any]):
+        with self._lock:
+            self._cache[session_id] = (time.time(), record)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > settings.session_cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, session_id: str):
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    @staticmethod
+    def _decode(record: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "api_keys": APIKeys(**record["api_keys"]),
+            "created_at": datetime.fromisoformat(record["created_at"]),
+            "database_file": DatabaseFile(**record["database_file"]) if record["database_file"] else None,
+            "last_accessed": record["last_accessed"]
+        }
+
+
+def create_session_store() -> SessionStore:
+    if settings.session_backend == "memory":
+        return SessionStore(InMemorySessionBackend())
+    if settings.session_backend == "sqlite":
+        return SessionStore(SQLiteSessionBackend(settings.session_db_path))
+    raise ValueError(f"Unknown session backend: {settings.session_backend}")
+
+
+session_store = create_session_store()
@@ -0,0 +1,202 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from config import settings
+from utils.helpers import normalize_question, write_json_atomic
+
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+@dataclass
+class CachedSQL:
+    """Generated SQL for a normalized question against one schema"""
+    schema_hash: str
+    question: str
+    sql: str
+    created_at: float
+
+
+class QuestionSQLCache:
+    """
+    Cache of generated SQL keyed by (schema fingerprint, normalized question).
+    Exact lookup first, then an optional character-trigram similarity lookup
+    over the questions cached for the same schema. Entries expire after a TTL,
+    are evicted LRU, and are persisted to a JSON file across restarts.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.sql_cache_path,
+        max_size: int = settings.sql_cache_max_size,
+        ttl_seconds: float = settings.sql_cache_ttl_seconds,
+        similarity_threshold: float = settings.sql_cache_similarity_threshold
+    ):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple[str, str], CachedSQL]" = OrderedDict()
+        self._trigrams: Dict[Tuple[str, str], Set[str]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def get(self, question: str, schema_hash: str) -> Optional[str]:
+        """Return the cached SQL for this question, or None"""
+        normalized = normalize_question(question)
+        key = (schema_hash, normalized)
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.sql
+            if entry is not None:
+                self._drop(key)
+
+            if self.similarity_threshold > 0:
+                similar = self._find_similar(schema_hash, normalized, now)
+                if similar is not None:
+                    self._entries.move_to_end(similar)
+                    self.similar_hits += 1
+                    return self._entries[similar].sql
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, schema_hash: str, sql: str):
+        """Store generated SQL and persist the cache if the flush interval elapsed"""
+        normalized = normalize_question(question)
+        key = (schema_hash, normalized)
+        with self._lock:
+            self._ensure_loaded()
+            self._entries[key] = CachedSQL(schema_hash, normalized, sql, time.time())
+            self._entries.move_to_end(key)
+            self._trigrams[key] = _trigrams(normalized)
+            while len(self._entries) > self.max_size:
+                oldest, _ = self._entries.popitem(last=False)
+                self._trigrams.pop(oldest, None)
+            self._dirty = True
+            due = time.monotonic() - self._last_flush >= settings.sql_cache_flush_seconds
+        if due:
+            self.flush()
+
+    def invalidate(self, schema_hash: str) -> int:
+        """Forget every question cached for a schema"""
+        with self._lock:
+            self._ensure_loaded()
+            keys = [key for key in self._entries if key[0] == schema_hash]
+            for key in keys:
+                self._drop(key)
+            if keys:
+                self._dirty = True
+            return len(keys)
+
+    def copy(self, schema_hash: str, new_schema_hash: str) -> int:
+        """Reuse the questions of a schema for another version with the same tables (e.g. new indexes)"""
+        with self._lock:
+            self._ensure_loaded()
+            entries = [entry for key, entry in self._entries.items() if key[0] == schema_hash]
+            for entry in entries:
+                key = (new_schema_hash, entry.question)
+                self._entries[key] = CachedSQL(new_schema_hash, entry.question, entry.sql, entry.created_at)
+                self._trigrams[key] = _trigrams(entry.question)
+            while len(self._entries) > self.max_size:
+                oldest, _ = self._entries.popitem(last=False)
+                self._trigrams.pop(oldest, None)
+            if entries:
+                self._dirty = True
+            return len(entries)
+
+    def flush(self):
+        """Write the cache to disk if it changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = [asdict(entry) for entry in self._entries.values()]
+            self._dirty = False
+            self._last_flush = time.monotonic()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.path, data)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+            }
+
+    def _find_similar(self, schema_hash: str, normalized: str, now: float) -> Optional[Tuple[str, str]]:
+        grams = _trigrams(normalized)
+        numbers = _NUMBER.findall(normalized)
+        best_key, best_score = None, 0.0
+        for key, other in self._trigrams.items():
+            if key[0] != schema_hash or self._expired(self._entries[key], now):
+                continue
+            # "top 5" et "top 10" ne doivent jamais partager la même requête
+            if _NUMBER.findall(key[1]) != numbers:
+                continue
+            score = len(grams & other) / len(grams | other) if grams or other else 0.0
+            if score > best_score:
+                best_key, best_score = key, score
+        if best_score >= self.similarity_threshold:
+            return best_key
+        return None
+
+    def _expired(self, entry: CachedSQL, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.created_at > self.ttl_seconds
+
+    def _drop(self, key: Tuple[str, str]):
+        self._entries.pop(key, None)
+        self._trigrams.pop(key, None)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            for item in data:
+                entry = CachedSQL(**item)
+                if self._expired(entry, now):
+                    continue
+                key = (entry.schema_hash, entry.question)
+                self._entries[key] = entry
+                self._trigrams[key] = _trigrams(entry.question)
+            while len(self._entries) > self.max_size:
+                oldest, _ = self._entries.popitem(last=False)
+                self._trigrams.pop(oldest, None)
+        except (OSError, ValueError, TypeError):
+            # un cache corrompu ne doit pas empêcher de répondre
+            self._entries.clear()
+            self._trigrams.clear()
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+sql_cache = QuestionSQLCache()
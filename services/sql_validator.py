@@ -0,0 +1,232 @@
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import settings
+from models.database import DatabaseEntry
+from services.schema_service import SchemaContext, quote_table
+from services.result_cache import canonicalize_sql
+from utils.security import is_single_statement, read_only_statements, sql_code
+
+
+# SQLite >= 3.36 écrit "SCAN players", les versions plus anciennes "SCAN TABLE players"
+PLAN_STEP_RE = re.compile(r"^(SCAN|SEARCH)(?: TABLE)? (\S+)(?: AS \S+)?(.*)$")
+LIMIT_RE = re.compile(r"\blimit\s+\d+")
+AGGREGATE_RE = re.compile(r"\b(count|sum|avg|min|max|total|group_concat)\s*\(")
+# le plan nomme les tables par leur alias: "FROM players p" donne "SCAN p"
+# (une table d'une base attachée, "sales.players", est nommée "players" dans le plan)
+TABLE_REF_RE = re.compile(
+    r"(?:\bfrom|\bjoin|,)\s+(?:[\"`\[]?\w+[\"`\]]?\.)?[\"`\[]?(\w+)[\"`\]]?(?:\s+(?:as\s+)?[\"`\[]?(\w+)[\"`\]]?)?"
+)
+SQL_KEYWORDS = {
+    "where", "join", "inner", "left", "right", "full", "cross", "natural", "on", "using",
+    "group", "order", "limit", "having", "union", "except", "intersect", "window", "as",
+}
+
+READ_ONLY_ERROR = "only a single read-only SELECT statement is allowed"
+
+# rows assumed to be visited by an index lookup
+SEARCH_ROWS_ESTIMATE = 10
+
+
+@dataclass
+class QueryPlan:
+    """EXPLAIN QUERY PLAN of a generated query and what the pre-flight found in it"""
+    sql: str
+    steps: List[str] = field(default_factory=list)
+    full_scans: List[str] = field(default_factory=list)
+    estimated_cost: float = 0.0
+    # invalid_sql / query_too_expensive: the query must not run as is
+    error_code: Optional[str] = None
+    error: Optional[str] = None
+    # unbounded scans: worth a rewrite but allowed to run
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def needs_repair(self) -> bool:
+        return self.error is not None or bool(self.warnings)
+
+    @property
+    def problem(self) -> str:
+        return "; ".join(([self.error] if self.error else []) + self.warnings)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class SQLValidator:
+    """
+    Pre-flight check of generated SQL. The query is compiled with EXPLAIN QUERY
+    PLAN on the read-only engine, which catches unknown tables and columns
+    without touching data, and its plan gives an estimated number of visited
+    rows. Plans are cached per (database version, canonical SQL) and table
+    row estimates per database version.
+    """
+
+    def __init__(self, max_size: int = settings.sql_preflight_cache_size):
+        self.max_size = max_size
+        self._plans: "OrderedDict[Tuple[str, str], QueryPlan]" = OrderedDict()
+        self._row_counts: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_data = {
+            "checks": 0,
+            "cache_hits": 0,
+            "invalid": 0,
+            "too_expensive": 0,
+            "unbounded_scans": 0,
+        }
+
+    def check(self, sql_query: str, entry: DatabaseEntry, schema: SchemaContext) -> QueryPlan:
+        """Validate a query against a database (blocking, run it on the SQL executor)"""
+        if not settings.sql_preflight_enabled:
+            return QueryPlan(sql=sql_query)
+
+        key = (schema.content_hash, canonicalize_sql(sql_query))
+        with self._lock:
+            self.stats_data["checks"] += 1
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.stats_data["cache_hits"] += 1
+                return plan
+
+        plan = self._explain(sql_query, entry, schema)
+        with self._lock:
+            if plan.error_code == "invalid_sql":
+                self.stats_data["invalid"] += 1
+            elif plan.error_code == "query_too_expensive":
+                self.stats_data["too_expensive"] += 1
+            if plan.warnings:
+                self.stats_data["unbounded_scans"] += 1
+            self._plans[key] = plan
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+        return plan
+
+    def check_read_only(self, sql_query: str, entry: DatabaseEntry) -> Optional[str]:
+        """
+        Why a query may not run at all (several statements, or anything but a
+        read), None if it may. Independent of the pre-flight settings.
+        """
+        statement = sql_query.strip().rstrip(";")
+        if not is_single_statement(statement):
+            return READ_ONLY_ERROR
+        try:
+            with entry.engine.connect() as connection:
+                with read_only_statements(connection.connection.driver_connection):
+                    connection.exec_driver_sql(f"EXPLAIN {statement}").close()
+        except SQLAlchemyError as e:
+            message = str(getattr(e, "orig", None) or e)
+            return READ_ONLY_ERROR if "not authorized" in message else message
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats_data, "cached_plans": len(self._plans)}
+
+    def _explain(self, sql_query: str, entry: DatabaseEntry, schema: SchemaContext) -> QueryPlan:
+        plan = QueryPlan(sql=sql_query)
+        statement = sql_query.strip().rstrip(";")
+        if not is_single_statement(statement):
+            plan.error_code = "invalid_sql"
+            plan.error = READ_ONLY_ERROR
+            return plan
+
+        try:
+            with entry.engine.connect() as connection:
+                # la requête est compilée par SQLite: une écriture est refusée quelle que soit sa forme
+                with read_only_statements(connection.connection.driver_connection):
+                    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        except SQLAlchemyError as e:
+            message = str(getattr(e, "orig", None) or e)
+            if "not authorized" in message:
+                message = READ_ONLY_ERROR
+            elif "no such table" in message:
+                message += f" (available tables: {', '.join(schema.table_names)})"
+            plan.error_code = "invalid_sql"
+            plan.error = message
+            return plan
+
+        canonical = canonicalize_sql(sql_code(statement))
+        table_rows = self.table_rows(entry, schema)
+        tables = table_aliases(canonical, table_rows)
+        bounded = bool(LIMIT_RE.search(canonical) or AGGREGATE_RE.search(canonical))
+
+        # les boucles imbriquées d'une même requête se multiplient, les sous-requêtes s'additionnent
+        loops: Dict[int, float] = {}
+        for step_id, parent, _, detail in rows:
+            plan.steps.append(detail)
+            match = PLAN_STEP_RE.match(detail)
+            if match is None:
+                continue
+            operation, name, rest = match.groups()
+            table = tables.get(name.lower())
+            if operation == "SCAN":
+                if table is None:
+                    # sous-requête ou CTE, ses propres étapes sont comptées à part
+                    continue
+                rows_count = table_rows[table]
+                factor = max(rows_count, 1)
+                if "INDEX" not in rest:
+                    plan.full_scans.append(table)
+                    if rows_count >= settings.sql_preflight_large_table_rows and not bounded:
+                        plan.warnings.append(
+                            f"full scan of {table} ({rows_count} rows) without LIMIT or aggregation"
+                        )
+            else:
+                factor = SEARCH_ROWS_ESTIMATE
+            loops[parent] = loops.get(parent, 1.0) * factor
+
+        plan.estimated_cost = float(sum(loops.values()))
+        if plan.estimated_cost > settings.sql_preflight_max_cost:
+            plan.error_code = "query_too_expensive"
+            plan.error = (
+                f"estimated {plan.estimated_cost:.3g} rows visited, "
+                f"above the limit of {settings.sql_preflight_max_cost:.3g}"
+            )
+        return plan
+
+    def table_rows(self, entry: DatabaseEntry, schema: SchemaContext) -> Dict[str, int]:
+        """Estimated row count of every table, computed once per database version"""
+        with self._lock:
+            counts = self._row_counts.get(schema.content_hash)
+            if counts is not None:
+                self._row_counts.move_to_end(schema.content_hash)
+                return counts
+
+        counts = {}
+        with entry.engine.connect() as connection:
+            for table in schema.table_names:
+                quoted = quote_table(table, schema.attached)
+                try:
+                    # max(rowid) lit une seule page de l'arbre, count(*) parcourt toute la table
+                    value = connection.exec_driver_sql(f"SELECT max(rowid) FROM {quoted}").scalar()
+                except SQLAlchemyError:
+                    # tables WITHOUT ROWID
+                    value = connection.exec_driver_sql(f"SELECT count(*) FROM {quoted}").scalar()
+                counts[table] = int(value or 0)
+
+        with self._lock:
+            self._row_counts[schema.content_hash] = counts
+            while len(self._row_counts) > settings.schema_cache_max_size:
+                self._row_counts.popitem(last=False)
+        return counts
+
+
+def table_aliases(canonical_sql: str, table_names) -> Dict[str, str]:
+    """Lowercased table name or alias -> table name, for the tables a query references"""
+    tables = {name.lower(): name for name in table_names}
+    for name in table_names:
+        if "." in name:
+            tables.setdefault(name.split(".", 1)[1].lower(), name)
+    for table, alias in TABLE_REF_RE.findall(canonical_sql):
+        if table in tables and alias and alias not in SQL_KEYWORDS:
+            tables.setdefault(alias, tables[table])
+    return tables
+
+
+sql_validator = SQLValidator()
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+from config import settings
+from utils.helpers import run_blocking
+from utils.metrics import metrics
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+# champs texte du formulaire (api_keys): quelques Ko suffisent
+FIELD_MAX_BYTES = 64 * 1024
+# en-têtes multipart et champs texte autour du fichier
+FORM_OVERHEAD_BYTES = 4 * FIELD_MAX_BYTES
+
+
+@dataclass
+class ReceivedUpload:
+    """An uploaded database written to a temp file, with the other fields of the form"""
+    file_name: str
+    tmp_path: str
+    content_hash: str
+    file_size: int
+    fields: Dict[str, str] = field(default_factory=dict)
+
+    def discard(self):
+        """Remove the temp file unless it was moved into the blob store"""
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class _Part:
+    def __init__(self):
+        self.disposition = b""
+        self.name: Optional[str] = None
+        self.file_name: Optional[str] = None
+        self.data = bytearray()
+
+
+class UploadReceiver:
+    """
+    Parses a multipart/form-data upload straight from the request stream,
+    without Starlette spooling the body first. The file part is written once,
+    to a temp file in `directory`, and hashed as it arrives; a body that is
+    not a SQLite database, or grows past UPLOAD_MAX_BYTES, stops the read at
+    the offending chunk. Text fields stay in memory, FIELD_MAX_BYTES each.
+    """
+
+    def __init__(self, directory: Path, file_field: str = "file"):
+        self.directory = Path(directory)
+        self.file_field = file_field
+        self._part = _Part()
+        self._header_name = b""
+        self._header_value = b""
+        self._fields: Dict[str, str] = {}
+        self._file_part: Optional[_Part] = None
+        self._pending: List[bytes] = []
+
+    async def receive(self, request: Request) -> ReceivedUpload:
+        content_type, options = parse_options_header(request.headers.get("content-type"))
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise ValueError("Expected a multipart/form-data upload")
+        declared = request.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > settings.upload_max_bytes + FORM_OVERHEAD_BYTES:
+            # refusé avant de lire le corps
+            raise ValueError(self._too_large("The upload"))
+
+        parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".upload")
+        digest = hashlib.sha256()
+        header = b""
+        file_size = 0
+        buffered = bytearray()
+        try:
+            with metrics.span("upload_write"), os.fdopen(fd, "wb") as buffer:
+                async for chunk in request.stream():
+                    try:
+                        parser.write(chunk)
+                    except FormParserError as e:
+                        raise ValueError(f"Invalid multipart upload: {e}") from e
+                    for data in self._pending:
+                        # rejeter un mauvais fichier dès les premiers octets
+                        if len(header) < len(SQLITE_HEADER):
+                            header += data[:len(SQLITE_HEADER) - len(header)]
+                            if not SQLITE_HEADER.startswith(header):
+                                raise ValueError(f"'{self._file_part.file_name}' is not a valid SQLite database")
+                        file_size += len(data)
+                        if file_size > settings.upload_max_bytes:
+                            raise ValueError(self._too_large(f"'{self._file_part.file_name}'"))
+                        digest.update(data)
+                        buffered += data
+                    self._pending.clear()
+                    if len(buffered) >= settings.upload_chunk_size:
+                        await run_blocking(buffer.write, bytes(buffered))
+                        buffered.clear()
+                parser.finalize()
+                if buffered:
+                    await run_blocking(buffer.write, bytes(buffered))
+
+            if self._file_part is None:
+                raise ValueError(f"No '{self.file_field}' file in the upload")
+            if header != SQLITE_HEADER:
+                raise ValueError(f"'{self._file_part.file_name}' is not a valid SQLite database")
+            return ReceivedUpload(
+                file_name=self._file_part.file_name,
+                tmp_path=tmp_path,
+                content_hash=digest.hexdigest(),
+                file_size=file_size,
+                fields=self._fields
+            )
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _too_large(what: str) -> str:
+        return f"{what} exceeds the maximum upload size of {settings.upload_max_bytes} bytes"
+
+    def _on_part_begin(self):
+        self._part = _Part()
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._part is self._file_part:
+            self._pending.append(data[start:end])
+            return
+        self._part.data += data[start:end]
+        if len(self._part.data) > FIELD_MAX_BYTES:
+            raise ValueError(f"Form field '{self._part.name}' exceeds {FIELD_MAX_BYTES} bytes")
+
+    def _on_part_end(self):
+        if self._part is not self._file_part and self._part.name is not None:
+            self._fields[self._part.name] = self._part.data.decode("utf-8", errors="replace")
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._part.disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._part.disposition)
+        self._part.name = options.get(b"name", b"").decode("utf-8", errors="replace") or None
+        if b"filename" not in options:
+            return
+        if self._part.name != self.file_field or self._file_part is not None:
+            raise ValueError(f"Only one file is accepted, in the '{self.file_field}' field")
+        # ne garder que le nom, jamais un chemin fourni par le client
+        file_name = options[b"filename"].decode("utf-8", errors="replace")
+        self._part.file_name = Path(file_name.replace("\\", "/")).name or "database.db"
+        self._file_part = self._part
+
+
+async def receive_upload(request: Request, directory: Path) -> ReceivedUpload:
+    """Stream a multipart upload holding one database file (field "file") to `directory`"""
+    return await UploadReceiver(directory).receive(request)
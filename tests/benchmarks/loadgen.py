@@ -0,0 +1,178 @@
+"""
+Load generator for upload and ask-question.
+
+Runs in-process against the ASGI app with the fake LLM by default, or
+against a running server with --base-url:
+
+    python -m tests.benchmarks.loadgen --rows 1000 100000 --concurrency 1 8 32 --requests 200
+    python -m tests.benchmarks.loadgen --base-url http://localhost:8000 --llm-latency 0.2
+
+Reports p50/p99 latency and throughput for each database size and
+concurrency level, plus the app's peak RSS when it runs in-process (with
+--base-url only the server knows its memory use). Questions are spread over the uploaded sessions: the SQL
+sandbox caps concurrent queries per session (SQL_MAX_CONCURRENT_PER_SESSION),
+so hammering a single session mostly measures 429s.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from tests.datagen import make_database
+
+API_KEYS = {"gemini_api_key": "bench-key", "langchain_api_key": ""}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+async def run_requests(count: int, concurrency: int, send) -> Dict[str, Any]:
+    """Run `send(i)` count times with at most `concurrency` in flight"""
+    latencies, statuses = [], {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await send(i)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": count,
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "statuses": statuses,
+        "p50_ms": round(statistics.median(latencies), 2) if latencies else 0.0,
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def benchmark(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        import main
+        transport, base_url = httpx.ASGITransport(app=main.app), "http://loadgen"
+
+    results = []
+
+    def record(operation: str, rows: int, size: int, stats: Dict[str, Any]):
+        result = {"operation": operation, "rows": rows, "bytes": size, **stats}
+        if not args.base_url:
+            # l'application tourne dans ce processus: son RSS est le nôtre
+            result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        results.append(result)
+
+    workdir = Path(tempfile.mkdtemp(prefix="sql-qa-loadgen-"))
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        for rows in args.rows:
+            path = make_database(workdir / f"players_{rows}.db", rows=rows, extra_tables=args.extra_tables)
+            content = path.read_bytes()
+            session_ids: List[Optional[str]] = []
+
+            async def send_upload(i: int) -> httpx.Response:
+                response = await client.post(
+                    "/api/v1/upload/upload-database",
+                    data={"api_keys": json.dumps(API_KEYS)},
+                    files={"file": (path.name, content)}
+                )
+                if response.status_code == 200:
+                    session_ids.append(response.json()["session_id"])
+                return response
+
+            for concurrency in args.concurrency:
+                stats = await run_requests(args.uploads, concurrency, send_upload)
+                record("upload", rows, len(content), stats)
+                if not session_ids:
+                    continue
+
+                async def send_question(i: int) -> httpx.Response:
+                    # --distinct: chaque question passe par tout le pipeline (pas de cache SQL)
+                    question = f"{args.question} #{i}" if args.distinct else args.question
+                    # répartir sur les sessions créées, comme des utilisateurs distincts
+                    # (le sandbox limite les requêtes simultanées par session)
+                    session_id = session_ids[i % len(session_ids)]
+                    return await client.post(
+                        f"/api/v1/query/ask-question/{session_id}",
+                        json={"question": question, "api_keys": API_KEYS}
+                    )
+
+                stats = await run_requests(args.requests, concurrency, send_question)
+                record("ask-question", rows, len(content), stats)
+    return results
+
+
+def print_table(results: List[Dict[str, Any]]):
+    columns = ["operation", "rows", "concurrency", "requests", "errors", "p50_ms", "p99_ms",
+               "throughput_rps", "peak_rss_mb"]
+    columns = [c for c in columns if results and c in results[0]]
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--extra-tables", type=int, default=0, help="filler tables to widen the schema")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="ask-question requests per level")
+    parser.add_argument("--uploads", type=int, default=20, help="uploads per level")
+    parser.add_argument("--question", default="How many players are there?")
+    parser.add_argument("--distinct", action="store_true", help="make every question unique")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="fake LLM latency per call (in-process)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if not args.base_url:
+        # en local: modèle factice, stockage jetable (comme tests/conftest.py), pas de janitor ni de traces
+        storage = Path(tempfile.mkdtemp(prefix="sql-qa-loadgen-storage-"))
+        os.environ.update({
+            "LLM_PROVIDER": "fake",
+            "FAKE_LLM_LATENCY_SECONDS": str(args.llm_latency),
+            "LANGSMITH_TRACING": "false",
+            "CLEANUP_ENABLED": "false",
+            "STORAGE_DIR": str(storage / "databases"),
+            "BLOB_DIR": str(storage / "blobs"),
+            "SESSION_DB_PATH": str(storage / "sessions.db"),
+            "JOB_DB_PATH": str(storage / "jobs.db"),
+            "SQL_CACHE_PATH": str(storage / "cache" / "sql_cache.json"),
+            "INDEX_ADVISOR_PATH": str(storage / "index_advisor.json"),
+        })
+
+    results = asyncio.run(benchmark(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
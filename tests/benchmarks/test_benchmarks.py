@@ -0,0 +1,45 @@
+import pytest
+
+from tests.conftest import API_KEYS, upload
+from tests.datagen import make_database
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [1_000, 50_000]
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda rows: f"{rows}rows")
+def sized_database(request, tmp_path_factory):
+    return make_database(tmp_path_factory.mktemp("bench") / f"players_{request.param}.db", rows=request.param)
+
+
+def test_upload(benchmark, client, sized_database):
+    benchmark(upload, client, sized_database)
+
+
+def test_ask_question(benchmark, client, sized_database):
+    session_id = upload(client, sized_database)["session_id"]
+    questions = iter(range(10 ** 9))
+
+    def ask():
+        # une question différente à chaque tour: pas de cache SQL ni de single-flight
+        response = client.post(
+            f"/api/v1/query/ask-question/{session_id}",
+            json={"question": f"How many players are in group {next(questions)}?", "api_keys": API_KEYS}
+        )
+        assert response.status_code == 200, response.text
+
+    benchmark(ask)
+
+
+def test_ask_question_cached(benchmark, client, sized_database):
+    session_id = upload(client, sized_database)["session_id"]
+    payload = {"question": "Who are the five oldest players?", "api_keys": API_KEYS}
+
+    def ask():
+        response = client.post(f"/api/v1/query/ask-question/{session_id}", json=payload)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    result = benchmark(ask)
+    assert result["result"]["query_result"]["row_count"] == 5
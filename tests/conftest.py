@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+# la configuration est lue à l'import de config.py: tout fixer avant d'importer l'application
+_STORAGE = Path(tempfile.mkdtemp(prefix="sql-qa-tests-"))
+_RESPONSES = _STORAGE / "fake_llm_responses.json"
+_RESPONSES.write_text(json.dumps({
+    "How many players are there?": "SELECT count(*) AS total FROM players",
+    "Who are the five oldest players?": "SELECT name, age FROM players ORDER BY age DESC, id LIMIT 5",
+    "Which column does not exist?": "SELECT shoe_size FROM players LIMIT 5",
+    "Who is called a;b?": "SELECT name FROM players WHERE name = 'a;b'",
+    "Name three players, with a comment.": "-- any three\nSELECT name FROM players ORDER BY id LIMIT 3",
+    "Remove every player.": "WITH x AS (SELECT 1) DELETE FROM players",
+    "List every player.": "SELECT id, name, nationality FROM players",
+    "Which players are 30 years old?": "SELECT name FROM players WHERE age = 30",
+    "What is the total age of players?": "SELECT sum(age) AS value FROM players WHERE id <= 100",
+    "Count forever.": "WITH RECURSIVE r(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM r) SELECT count(*) AS total FROM r",
+}))
+os.environ.update({
+    "LLM_PROVIDER": "fake",
+    "FAKE_LLM_RESPONSES_PATH": str(_RESPONSES),
+    "LANGSMITH_TRACING": "false",
+    "CLEANUP_ENABLED": "false",
+    "ADMIN_TOKEN": "test-admin-token",
+    "STORAGE_DIR": str(_STORAGE / "databases"),
+    "BLOB_DIR": str(_STORAGE / "blobs"),
+    "SESSION_DB_PATH": str(_STORAGE / "sessions.db"),
+    "JOB_DB_PATH": str(_STORAGE / "jobs.db"),
+    "JOB_POLL_INTERVAL_SECONDS": "0.05",
+    "SQL_CACHE_PATH": str(_STORAGE / "cache" / "sql_cache.json"),
+    "INDEX_ADVISOR_PATH": str(_STORAGE / "index_advisor.json"),
+})
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.datagen import make_database
+
+API_KEYS = {"gemini_api_key": "test-key", "langchain_api_key": ""}
+ADMIN_HEADERS = {"X-Admin-Token": "test-admin-token"}
+
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def database_path(tmp_path_factory):
+    return make_database(tmp_path_factory.mktemp("db") / "players.db", rows=2000)
+
+
+def upload(client, path, name: str = "players.db") -> dict:
+    with open(path, "rb") as f:
+        response = client.post(
+            "/api/v1/upload/upload-database",
+            data={"api_keys": json.dumps(API_KEYS)},
+            files={"file": (name, f)}
+        )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def llm_path(monkeypatch):
+    """Send every question to the fake LLM, skipping the fast path templates"""
+    from config import settings
+    monkeypatch.setattr(settings, "fast_path_enabled", False)
+
+
+@pytest.fixture
+def session_id(client, database_path):
+    return upload(client, database_path)["session_id"]
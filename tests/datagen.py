@@ -0,0 +1,55 @@
+import random
+import sqlite3
+from pathlib import Path
+
+NATIONALITIES = ["Morocco", "France", "Spain", "Brazil", "Argentina", "Portugal", "Senegal", "Egypt"]
+CLUBS = ["Wydad", "Raja", "PSG", "Barca", "Real", "Ajax", "Porto", "Ahly"]
+
+
+def make_database(path, rows: int = 1000, extra_tables: int = 0, seed: int = 0) -> Path:
+    """Deterministic SQLite file: a players table of `rows` rows plus small filler tables"""
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE clubs (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            city TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE players (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            nationality TEXT,
+            age INTEGER,
+            overall_rating REAL,
+            club_id INTEGER REFERENCES clubs(id)
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO clubs (id, name, city) VALUES (?, ?, ?)",
+        [(i + 1, club, f"City {i}") for i, club in enumerate(CLUBS)]
+    )
+    conn.executemany(
+        "INSERT INTO players (name, nationality, age, overall_rating, club_id) VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                f"Player {i}",
+                rng.choice(NATIONALITIES),
+                rng.randint(17, 38),
+                round(rng.uniform(45, 95), 1),
+                rng.randint(1, len(CLUBS)),
+            )
+            for i in range(rows)
+        )
+    )
+    for t in range(extra_tables):
+        conn.execute(f"CREATE TABLE metric_{t} (id INTEGER PRIMARY KEY, label TEXT, value REAL)")
+        conn.execute(f"INSERT INTO metric_{t} (label, value) VALUES ('m{t}', {t})")
+    conn.commit()
+    conn.close()
+    return path
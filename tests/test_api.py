@@ -0,0 +1,828 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from pathlib import Path
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy.exc import OperationalError
+from starlette.requests import Request
+
+from config import settings
+from models.schemas import APIKeys
+from models.database import DatabaseRegistry, database_registry
+from services.cleanup_service import CleanupService
+from services.fake_llm import FakeChatModel
+from services.fast_path import fast_path
+from services.file_service import MANIFEST_NAME, FileService, manifest_index
+from services.query_service import QueryService, question_flights
+from services.schema_linker import SchemaLinker, estimate_tokens
+from services.result_cache import CachedResult, ResultCache, result_cache
+from services.schema_service import SCHEMA_SUFFIX, SchemaCache
+from services.sql_cache import sql_cache
+from services.session_store import SessionStore, SQLiteSessionBackend, session_store
+from services.upload_stream import receive_upload
+from tests.conftest import ADMIN_HEADERS, API_KEYS, upload
+from tests.datagen import make_database
+from utils.helpers import LLMError, SingleFlight, write_json_atomic
+from utils.security import SQLSandbox, TooManyQueriesError, sql_sandbox
+
+
+def ask(client, session_id, question):
+    return client.post(
+        f"/api/v1/query/ask-question/{session_id}",
+        json={"question": question, "api_keys": API_KEYS}
+    )
+
+
+def test_health(client):
+    assert client.get("/health").json()["status"] == "healthy"
+
+
+def test_upload_stores_one_blob_per_content(client, database_path):
+    first = upload(client, database_path)
+    second = upload(client, database_path, name="copy.db")
+    assert first["session_id"] != second["session_id"]
+    assert first["file_info"]["content_hash"] == second["file_info"]["content_hash"]
+    assert first["file_info"]["file_path"] == second["file_info"]["file_path"]
+
+
+def test_upload_rejects_non_sqlite_file(client, tmp_path):
+    path = tmp_path / "notes.db"
+    path.write_text("definitely not a database")
+    response = client.post(
+        "/api/v1/upload/upload-database",
+        data={"api_keys": json.dumps(API_KEYS)},
+        files={"file": ("notes.db", open(path, "rb"))}
+    )
+    assert response.status_code == 400
+
+
+def test_upload_stops_reading_at_the_offending_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "upload_max_bytes", 64 * 1024)
+
+    def read(file_bytes: bytes):
+        parts = [b'--b\r\nContent-Disposition: form-data; name="file"; filename="x.db"\r\n\r\n' + file_bytes]
+        parts += [b"\0" * 16384] * 20 + [b"\r\n--b--\r\n"]
+        received = []
+
+        async def receive():
+            received.append(parts[len(received)])
+            return {"type": "http.request", "body": received[-1], "more_body": len(received) < len(parts)}
+
+        scope = {"type": "http", "method": "POST", "headers": [(b"content-type", b"multipart/form-data; boundary=b")]}
+        with pytest.raises(ValueError) as error:
+            asyncio.run(receive_upload(Request(scope, receive), tmp_path))
+        return str(error.value), len(received)
+
+    # en-tête SQLite faux: rien n'est lu après le premier bloc
+    message, chunks = read(b"definitely not a database")
+    assert "not a valid SQLite database" in message and chunks == 1
+    # 16 + 4 * 16384 octets dépassent la limite au cinquième bloc
+    message, chunks = read(b"SQLite format 3\x00")
+    assert "maximum upload size" in message and chunks == 5
+    assert list(tmp_path.iterdir()) == []
+
+def test_ask_question(client, session_id, llm_path):
+    response = ask(client, session_id, "How many players are there?")
+    assert response.status_code == 200, response.text
+    result = response.json()["result"]
+    assert result["sql_query"] == "SELECT count(*) AS total FROM players"
+    assert result["query_result"]["data"] == [{"total": 2000}]
+    assert result["query_plan"]["error"] is None
+    # un seul nombre: réponse formatée localement, pas de second appel au LLM
+    assert result["answer_strategy"] == "scalar"
+    assert result["answer"] == "The result is 2,000 (total)."
+
+
+def test_answer_modes(client, session_id, llm_path):
+    result = ask(client, session_id, "Who are the five oldest players?").json()["result"]
+    assert result["answer_strategy"] == "summary"
+    assert result["answer"] == "This is a canned answer."
+
+    response = client.post(
+        f"/api/v1/query/ask-question/{session_id}",
+        json={"question": "Who are the five oldest players?", "api_keys": API_KEYS, "answer_mode": "rows"}
+    )
+    result = response.json()["result"]
+    assert result["answer_strategy"] == "rows" and result["answer"] is None
+    assert result["query_result"]["row_count"] == 5
+
+    response = client.post(
+        f"/api/v1/query/ask-question/{session_id}",
+        json={"question": "How many players are there?", "api_keys": API_KEYS, "answer_mode": "llm"}
+    )
+    assert response.json()["result"]["answer"] == "This is a canned answer."
+
+
+def test_ask_question_unknown_session(client):
+    assert ask(client, "user_missing", "How many players are there?").status_code == 400
+
+
+def test_invalid_sql_is_rejected_before_execution(client, session_id):
+    response = ask(client, session_id, "Which column does not exist?")
+    assert response.status_code == 422
+    detail = response.json()["detail"]
+    assert detail["reason"] == "invalid_sql"
+    assert "shoe_size" in detail["message"]
+
+
+def test_preflight_checks_the_compiled_statement(client, session_id):
+    # ";" dans un littéral et commentaire en tête: une seule instruction, en lecture
+    response = ask(client, session_id, "Who is called a;b?")
+    assert response.status_code == 200, response.text
+    assert response.json()["result"]["query_result"]["row_count"] == 0
+    response = ask(client, session_id, "Name three players, with a comment.")
+    assert response.status_code == 200, response.text
+    assert response.json()["result"]["query_result"]["row_count"] == 3
+
+    response = ask(client, session_id, "Remove every player.")
+    assert response.status_code == 422
+    assert response.json()["detail"]["reason"] == "invalid_sql"
+    assert ask(client, session_id, "How many players are there?").json()["result"]["query_result"]["data"] == [
+        {"total": 2000}
+    ]
+
+def test_sandbox_limits(client, session_id, monkeypatch):
+    monkeypatch.setattr(sql_sandbox, "timeout_seconds", 0.2)
+    response = ask(client, session_id, "Count forever.")
+    assert response.status_code == 408
+    assert response.json()["detail"] == {
+        "error": "query_timeout", "message": "Query exceeded the 0.2s time limit", "timeout_seconds": 0.2
+    }
+
+    # un résultat refusé n'entre pas dans le cache: chaque limite est testée sur la même requête
+    monkeypatch.setattr(sql_sandbox, "max_rows", 100)
+    response = ask(client, session_id, "List every player.")
+    assert response.status_code == 413
+    assert response.json()["detail"]["max_rows"] == 100
+    monkeypatch.setattr(sql_sandbox, "max_rows", 100_000)
+    monkeypatch.setattr(sql_sandbox, "max_bytes", 4096)
+    response = ask(client, session_id, "List every player.")
+    assert response.status_code == 413
+    assert response.json()["detail"]["max_bytes"] == 4096
+    assert sql_sandbox.stats() == {"sessions": 0, "running_queries": 0}
+
+
+def test_sandbox_session_slots():
+    sandbox = SQLSandbox(max_concurrent_per_session=2)
+    with sandbox.session_slot("a"), sandbox.session_slot("a"), sandbox.session_slot("b"):
+        assert sandbox.stats() == {"sessions": 2, "running_queries": 3}
+        with pytest.raises(TooManyQueriesError):
+            with sandbox.session_slot("a"):
+                pass
+    # une session sans requête en cours ne garde aucune entrée
+    assert sandbox.stats() == {"sessions": 0, "running_queries": 0}
+
+
+def test_single_flight_shares_one_run():
+    flights = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return len(runs)
+
+    async def main():
+        results = await asyncio.gather(*(flights.do("key", work) for _ in range(5)))
+        # la clé est libérée: l'appel suivant relance le travail
+        assert flights.stats() == {"in_flight": 0, "started": 1, "shared": 4}
+        return results, await flights.do("key", work)
+
+    results, again = asyncio.run(main())
+    assert results == [1] * 5
+    assert again == 2
+    assert flights.stats()["started"] == 2
+
+
+def test_single_flight_raises_to_every_waiter():
+    flights = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise LLMError("quota exceeded")
+
+    async def main():
+        return await asyncio.gather(*(flights.do("key", failing) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(error, LLMError) for error in errors)
+    assert errors[0] is errors[1] is errors[2]
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_single_flight_cancelled_waiters():
+    flights = SingleFlight()
+    events = []
+
+    async def work():
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+        events.append("done")
+        return "result"
+
+    async def main():
+        leaving = asyncio.create_task(flights.do("shared", work))
+        staying = asyncio.create_task(flights.do("shared", work))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        assert await staying == "result"
+        assert leaving.cancelled()
+
+        # le dernier appelant annulé annule l'exécution partagée
+        alone = asyncio.create_task(flights.do("alone", work))
+        await asyncio.sleep(0)
+        alone.cancel()
+        await asyncio.sleep(0.01)
+        assert alone.cancelled()
+
+    asyncio.run(main())
+    assert events == ["done", "cancelled"]
+    assert flights.stats()["in_flight"] == 0
+
+def test_stream_question(client, session_id, llm_path):
+    with client.stream(
+        "POST",
+        f"/api/v1/query/ask-question/{session_id}/stream",
+        json={"question": "Who are the five oldest players?", "api_keys": API_KEYS}
+    ) as response:
+        events = [json.loads(line) for line in response.iter_lines() if line]
+    kinds = [event["event"] for event in events]
+    assert kinds[0] == "sql" and kinds[-1] == "done"
+    assert "rows" in kinds and "answer" in kinds
+    assert "".join(e["token"] for e in events if e["event"] == "answer") == "This is a canned answer."
+    assert events[-1]["result"]["query_result"]["row_count"] == 5
+
+
+def test_sql_cache_hit_skips_generation(client, session_id, llm_path, monkeypatch):
+    sql_for = FakeChatModel.sql_for
+    calls = []
+
+    def counting_sql_for(self, prompt):
+        calls.append(1)
+        return sql_for(self, prompt)
+
+    monkeypatch.setattr(FakeChatModel, "sql_for", counting_sql_for)
+    monkeypatch.setattr(sql_cache, "similarity_threshold", 0.5)
+    similar_hits = sql_cache.stats()["similar_hits"]
+    first = ask(client, session_id, "Who are the players older than 35?").json()["result"]
+    # même question après normalisation, puis question voisine avec les mêmes nombres
+    for question in ("who are the players OLDER than 35", "Which are the players older than 35?"):
+        assert ask(client, session_id, question).json()["result"]["sql_query"] == first["sql_query"]
+    assert len(calls) == 1
+    assert sql_cache.stats()["similar_hits"] == similar_hits + 1
+    # un nombre différent interdit la réutilisation par similarité
+    ask(client, session_id, "Who are the players older than 36?")
+    assert len(calls) == 2
+
+def test_result_cache_follows_the_content_hash(client, tmp_path, llm_path):
+    session_id = upload(client, make_database(tmp_path / "players.db", rows=300, seed=3))["session_id"]
+
+    def list_players():
+        hits = result_cache.stats()["hits"]
+        result = ask(client, session_id, "List every player.").json()["result"]
+        return result["query_result"]["row_count"], result_cache.stats()["hits"] - hits
+
+    assert list_players() == (300, 0)
+    assert list_players() == (300, 1)
+    # même nom, autre contenu: le nouveau hash ne retrouve pas l'ancien résultat
+    (tmp_path / "replaced").mkdir()
+    with open(make_database(tmp_path / "replaced" / "players.db", rows=200, seed=4), "rb") as f:
+        response = client.post(f"/api/v1/upload/upload-database/{session_id}", files={"file": ("players.db", f)})
+    assert response.status_code == 200, response.text
+    assert list_players() == (200, 0)
+
+
+def test_result_cache_skips_oversized_results():
+    cache = ResultCache(max_bytes=4096)
+    small = CachedResult.from_rows(["n"], [(1,)])
+    cache.put("v1", "SELECT count(*) AS n FROM players", small)
+    assert cache.get("v1", "select   count(*) as n from players;") is small
+    assert cache.get("v2", "SELECT count(*) AS n FROM players") is None
+    # plus d'un quart du budget: jamais stocké
+    large = CachedResult.from_rows(["name"], [(f"Player {i}",) for i in range(100)])
+    assert large.nbytes > 1024
+    cache.put("v1", "SELECT name FROM players", large)
+    assert cache.get("v1", "SELECT name FROM players") is None
+    assert cache.stats()["size"] == 1 and cache.stats()["bytes"] == small.nbytes
+
+def test_export_csv(client, session_id):
+    response = client.post(
+        f"/api/v1/query/export/{session_id}",
+        json={"sql_query": "SELECT id, name, age FROM players ORDER BY id"}
+    )
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "id,name,age" and len(lines) == 2001
+
+    # la question doit déjà avoir été posée: son SQL vient du cache
+    response = client.post(f"/api/v1/query/export/{session_id}", json={"question": "Never asked before?"})
+    assert response.status_code == 404
+    ask(client, session_id, "How many players are there?")
+    response = client.post(
+        f"/api/v1/query/export/{session_id}?format=ndjson", json={"question": "How many players are there?"}
+    )
+    assert [json.loads(line) for line in response.text.splitlines()] == [{"total": 2000}]
+
+
+def test_export_question_answered_by_the_fast_path(client, session_id):
+    question = "What is the average age of players?"
+    result = ask(client, session_id, question).json()["result"]
+    assert result["fast_path"]["template"] == "aggregate"
+    response = client.post(f"/api/v1/query/export/{session_id}?format=ndjson", json={"question": question})
+    assert response.status_code == 200, response.text
+    assert [json.loads(line) for line in response.text.splitlines()] == result["query_result"]["data"]
+
+
+def test_export_refuses_writes_without_preflight(client, session_id, monkeypatch):
+    monkeypatch.setattr(settings, "sql_preflight_enabled", False)
+    for sql in (
+        "DELETE FROM players",
+        "WITH x AS (SELECT 1) DELETE FROM players",
+        "SELECT 1; DELETE FROM players",
+        "PRAGMA query_only = OFF",
+    ):
+        response = client.post(f"/api/v1/query/export/{session_id}", json={"sql_query": sql})
+        assert response.status_code == 422, sql
+        assert response.json()["detail"]["reason"] == "invalid_sql"
+    response = client.post(
+        f"/api/v1/query/export/{session_id}?format=ndjson", json={"sql_query": "SELECT count(*) AS n FROM players"}
+    )
+    assert response.text.strip() == '{"n": 2000}'
+
+
+def test_session_with_several_databases(client, session_id, tmp_path):
+    sales = tmp_path / "sales.db"
+    conn = sqlite3.connect(sales)
+    conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, player_id INTEGER, amount REAL)")
+    conn.executemany("INSERT INTO orders (player_id, amount) VALUES (?, ?)", [(i % 10 + 1, 5.0) for i in range(30)])
+    conn.commit()
+    conn.close()
+    with open(sales, "rb") as f:
+        response = client.post(f"/api/v1/upload/upload-database/{session_id}", files={"file": ("sales.db", f)})
+    assert response.status_code == 200, response.text
+    databases = client.get(f"/api/v1/upload/databases/{session_id}").json()["databases"]
+    assert [(d["file_name"], d["alias"]) for d in databases] == [("players.db", "players"), ("sales.db", "sales")]
+
+    def export(body):
+        response = client.post(f"/api/v1/query/export/{session_id}?format=ndjson", json=body)
+        assert response.status_code == 200, response.text
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    assert export({"sql_query": "SELECT count(*) AS n FROM orders", "database": "sales.db"}) == [{"n": 30}]
+    # base attachée: ses tables sont nommées alias.table
+    rows = export({
+        "sql_query": "SELECT count(DISTINCT p.id) AS n FROM players p JOIN sales.orders o ON o.player_id = p.id",
+        "attach": ["sales.db"]
+    })
+    assert rows == [{"n": 10}]
+    # les petites bases sont servies depuis une copie en mémoire
+    assert database_registry.stats()["hot_copies"] >= 2
+
+
+def test_database_names_are_not_paths(client, session_id, database_path):
+    service = FileService()
+    # dossier créé avant le blob store: pas de manifeste, les fichiers sont dans le dossier
+    legacy = service.storage_dir / "session_legacy-paths"
+    legacy.mkdir(exist_ok=True)
+    shutil.copy(database_path, legacy / "players.db")
+    assert service.get_database_file("legacy-paths", "players.db").file_path == str(legacy / "players.db")
+    for name in (str(database_path), "../session_legacy-paths/players.db", "..", "sub/players.db"):
+        with pytest.raises(ValueError):
+            service.get_database_file("legacy-paths", name)
+
+    response = client.post(
+        f"/api/v1/query/export/{session_id}", json={"sql_query": "SELECT 1", "attach": [str(database_path)]}
+    )
+    assert response.status_code == 400
+
+def test_registry_reopens_changed_files(tmp_path):
+    registry = DatabaseRegistry()
+    path = make_database(tmp_path / "changing.db", rows=10)
+
+    def count(entry):
+        with entry.engine.connect() as conn:
+            return conn.exec_driver_sql("SELECT count(*) FROM players").scalar()
+
+    first = registry.get("s1", path)
+    assert registry.get("s2", path) is first and count(first) == 10
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO players (name) VALUES (?)", [(f"New {i}",) for i in range(500)])
+    conn.commit()
+    conn.close()
+    # taille modifiée: nouvelle entrée avec les nouvelles lignes
+    resized = registry.get("s1", path)
+    assert resized is not first and count(resized) == 510
+    # même taille, mtime modifié: l'entrée est aussi reconstruite
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert registry.get("s1", path) is not resized
+    assert registry.stats()["hits"] == 1 and registry.stats()["misses"] == 3 and registry.stats()["size"] == 1
+    registry.clear()
+
+def test_schema_context_is_read_from_the_sidecar(tmp_path):
+    path = make_database(tmp_path / "sidecar.db", rows=10)
+    built = SchemaCache().build(path, SQLDatabase.from_uri(f"sqlite:///{path}"))
+    assert os.path.exists(f"{path}{SCHEMA_SUFFIX}")
+    # un nouveau processus relit le fichier .schema.json sans reconstruire le contexte
+    script = (
+        "import json, sys\n"
+        "from services.schema_service import SchemaCache\n"
+        "def rebuild(*args): raise AssertionError('schema rebuilt')\n"
+        "SchemaCache._compute = staticmethod(rebuild)\n"
+        "print(json.dumps(SchemaCache().get(sys.argv[1], None).table_names))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script, str(path)],
+        cwd=Path(__file__).parent.parent, capture_output=True, text=True, check=True
+    ).stdout
+    assert json.loads(output.splitlines()[-1]) == built.table_names
+
+    # contenu modifié: le fichier .schema.json ne correspond plus, le contexte est recalculé
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE transfers (id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    assert "transfers" in SchemaCache().get(path, SQLDatabase.from_uri(f"sqlite:///{path}")).table_names
+
+def test_hot_copy_refuses_writes(database_path):
+    entry = database_registry.get("user_writer", str(database_path))
+    assert entry.in_memory
+    with entry.engine.connect() as connection:
+        # query_only se désactive, le mode lecture seule de la connexion non
+        connection.exec_driver_sql("PRAGMA query_only = OFF")
+        with pytest.raises(OperationalError, match="readonly"):
+            connection.exec_driver_sql("DELETE FROM players")
+        assert connection.exec_driver_sql("SELECT count(*) FROM players").scalar() == 2000
+    database_registry.invalidate("user_writer")
+
+
+def test_batch_collapses_duplicates(client, session_id):
+    questions = ["How many players are there?", "how many players are there", "Who are the five oldest players?"]
+    response = client.post(
+        f"/api/v1/query/ask-questions/{session_id}",
+        json={"questions": questions, "api_keys": API_KEYS}
+    )
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["unique_questions"] == 2
+    assert [item["index"] for item in body["results"]] == [0, 1, 2]
+    assert all(item["event"] == "result" for item in body["results"])
+
+
+def test_concurrent_identical_questions_share_one_llm_call(client, session_id, llm_path, monkeypatch):
+    # des clés neuves: le client LLM est recréé avec la latence du test
+    monkeypatch.setattr(settings, "fake_llm_latency_seconds", 0.2)
+    api_keys = {**API_KEYS, "gemini_api_key": "single-flight-key"}
+    sql_for = FakeChatModel.sql_for
+    calls = []
+
+    def counting_sql_for(self, prompt):
+        calls.append(1)
+        return sql_for(self, prompt)
+
+    monkeypatch.setattr(FakeChatModel, "sql_for", counting_sql_for)
+    shared = question_flights.stats()["shared"]
+    question = "How tall is the tallest goalkeeper in the single flight test?"
+
+    def ask_once(_):
+        return client.post(
+            f"/api/v1/query/ask-question/{session_id}", json={"question": question, "api_keys": api_keys}
+        )
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(ask_once, range(4)))
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.json()["result"]["sql_query"] for response in responses}) == 1
+    assert len(calls) == 1
+    assert question_flights.stats()["shared"] - shared == 3
+
+
+def test_sessions_survive_a_new_store_and_expire(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "session_ttl_seconds", 60)
+    path = str(tmp_path / "sessions.db")
+    SessionStore(SQLiteSessionBackend(path)).create("persisted", APIKeys(**API_KEYS))
+    # un autre worker, ou l'application redémarrée, ouvre le même fichier
+    restarted = SessionStore(SQLiteSessionBackend(path))
+    assert restarted.get("persisted")["api_keys"].gemini_api_key == "test-key"
+
+    restarted.backend.touch("persisted", time.time() - 120)
+    store = SessionStore(SQLiteSessionBackend(path))
+    assert store.expired_sessions() == ["persisted"]
+    assert store.get("persisted") is None
+    assert store.backend.get("persisted") is None
+
+def test_admin_cleanup_stats(client):
+    stats = client.get("/api/v1/admin/cleanup/stats", headers=ADMIN_HEADERS).json()
+    assert "runs" in stats and "disk_quota_bytes" in stats
+
+
+def test_admin_endpoints_fail_closed(client, monkeypatch):
+    assert client.get("/api/v1/admin/cleanup/stats").status_code == 403
+    assert client.get("/api/v1/admin/cleanup/stats", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    # sans ADMIN_TOKEN configuré, l'administration est désactivée
+    monkeypatch.setattr(settings, "admin_token", None)
+    assert client.get("/api/v1/admin/cleanup/stats").status_code == 404
+    assert client.post("/api/v1/admin/cleanup/run").status_code == 404
+
+
+def test_cleanup_evicts_idle_sessions_and_keeps_shared_blobs(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "storage_dir", str(tmp_path / "databases"))
+    monkeypatch.setattr(settings, "blob_dir", str(tmp_path / "blobs"))
+    monkeypatch.setattr(settings, "cleanup_grace_seconds", 0)
+    shared = upload(client, make_database(tmp_path / "shared.db", rows=120))
+    sharing = upload(client, tmp_path / "shared.db")
+    alone = upload(client, make_database(tmp_path / "alone.db", rows=80))
+
+    def folder(uploaded):
+        return tmp_path / "databases" / f"session_{uploaded['session_id']}"
+
+    def blob(uploaded):
+        return tmp_path / "blobs" / f"{uploaded['file_info']['content_hash']}.db"
+
+    idle = time.time() - settings.cleanup_idle_ttl_seconds - 60
+    for uploaded in (shared, alone):
+        for path in (folder(uploaded), *folder(uploaded).rglob("*")):
+            os.utime(path, (idle, idle))
+        session_store.backend.touch(uploaded["session_id"], idle)
+
+    stats = asyncio.run(CleanupService().run_once())
+    assert stats["evicted_idle"] == 2 and stats["blobs_deleted"] == 1 and stats["blobs"] == 1
+    assert not folder(shared).exists() and not folder(alone).exists() and folder(sharing).exists()
+    # le blob partagé reste tant qu'une session le référence
+    assert blob(sharing).exists() and not blob(alone).exists()
+    assert ask(client, shared["session_id"], "How many players are there?").status_code == 400
+    response = ask(client, sharing["session_id"], "How many players are there?")
+    assert response.json()["result"]["query_result"]["data"] == [{"total": 120}]
+
+    # la dernière session partie, le blob l'est aussi
+    asyncio.run(CleanupService().evict(sharing["session_id"], folder(sharing)))
+    stats = asyncio.run(CleanupService().run_once())
+    assert stats["blobs_deleted"] == 1 and stats["blobs"] == 0
+    assert list((tmp_path / "blobs").glob("*.db")) == []
+
+def test_metrics(client, session_id):
+    ask(client, session_id, "Who are the five oldest players?")
+    response = client.get("/metrics", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    for stage in ("engine", "schema", "sql_execution", "answer_generation", "upload_write"):
+        assert f'sql_qa_stage_duration_seconds_count{{stage="{stage}",outcome="ok"}}' in body
+    assert 'sql_qa_llm_tokens_total{stage="answer_generation",kind="input"}' in body
+    assert 'sql_qa_cache_hit_ratio{cache="sql"}' in body
+    assert 'route="/api/v1/query/ask-question/{session_id}"' in body
+
+
+def test_index_advisor_apply_and_undo(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "index_advisor_min_table_rows", 100)
+    monkeypatch.setattr(settings, "index_advisor_min_scans", 2)
+    monkeypatch.setattr(settings, "index_advisor_auto_apply", False)
+    path = make_database(tmp_path / "advised.db", rows=300)
+    # deux sessions partagent le même blob: toutes deux suivent l'index
+    uploaded = upload(client, path)
+    first, second = uploaded["session_id"], upload(client, path)["session_id"]
+    original = uploaded["file_info"]["content_hash"]
+
+    def content_hash(session_id):
+        return client.get(f"/api/v1/upload/databases/{session_id}").json()["databases"][0]["content_hash"]
+
+    def plan(session_id):
+        result = ask(client, session_id, "Which players are 30 years old?").json()["result"]
+        return result["query_result"]["row_count"], " ".join(result["query_plan"]["steps"])
+
+    rows, steps = plan(first)
+    assert steps.startswith("SCAN players")
+    plan(second)
+    [suggestion] = client.get(
+        "/api/v1/admin/indexes", params={"content_hash": original}, headers=ADMIN_HEADERS
+    ).json()
+    assert suggestion["status"] == "pending" and suggestion["scans"] == 2
+    assert suggestion["table"] == "players" and suggestion["columns"] == ["age", "name"]
+
+    applied = client.post(f"/api/v1/admin/indexes/{suggestion['id']}/apply", headers=ADMIN_HEADERS).json()
+    assert applied["status"] == "applied" and applied["applied_hash"] != original
+    assert content_hash(first) == content_hash(second) == applied["applied_hash"]
+    assert plan(second) == (rows, f"SEARCH players USING COVERING INDEX {suggestion['index_name']} (age=?)")
+
+    undone = client.post(f"/api/v1/admin/indexes/{suggestion['id']}/undo", headers=ADMIN_HEADERS).json()
+    assert undone["status"] == "undone" and undone["applied_hash"] not in (original, applied["applied_hash"])
+    assert content_hash(first) == content_hash(second) == undone["applied_hash"]
+    assert plan(first) == (rows, steps)
+    assert client.post(
+        f"/api/v1/admin/indexes/{suggestion['id']}/undo", headers=ADMIN_HEADERS
+    ).status_code == 409
+
+
+def test_relink_waits_for_the_manifest_write_lock(client, tmp_path):
+    service = FileService()
+    old_hash = upload(client, make_database(tmp_path / "old.db", rows=10, seed=1))["file_info"]["content_hash"]
+    uploaded = upload(client, make_database(tmp_path / "new.db", rows=10, seed=2))
+    new_hash = uploaded["file_info"]["content_hash"]
+    session_folder = service.storage_dir / f"session_{uploaded['session_id']}"
+    with open(session_folder / MANIFEST_NAME, encoding="utf-8") as f:
+        entry = json.load(f)["players.db"]
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with manifest_index.write_lock(session_folder):
+            relinking = pool.submit(service.relink_blob, new_hash, old_hash)
+            time.sleep(0.1)
+            assert not relinking.done()
+            # un upload concurrent écrit le manifeste pendant que relink attend le verrou
+            write_json_atomic(session_folder / MANIFEST_NAME, {"players.db": entry, "other.db": entry})
+        assert uploaded["session_id"] in relinking.result()
+
+    manifest = service.read_manifest(session_folder)
+    assert set(manifest) == {"players.db", "other.db"}
+    assert {info["content_hash"] for info in manifest.values()} == {old_hash}
+
+
+@pytest.fixture
+def wide_schema(tmp_path):
+    path = make_database(tmp_path / "wide.db", rows=50, extra_tables=40)
+    return SchemaCache().build(path, SQLDatabase.from_uri(f"sqlite:///{path}"))
+
+
+def test_schema_linking_keeps_matching_tables_and_their_references(wide_schema, monkeypatch):
+    monkeypatch.setattr(settings, "schema_prompt_max_tokens", 300)
+    linker = SchemaLinker()
+    question = "What is the average overall rating of players?"
+    # clubs ne correspond pas à la question, mais players y fait référence
+    assert linker.rank(wide_schema, question)["clubs"] == 0.0
+    info = linker.table_info(wide_schema, question)
+    assert info == "\n\n".join([wide_schema.tables["clubs"], wide_schema.tables["players"]])
+    assert estimate_tokens(info) <= 300
+    assert linker.stats()["pruned"] == 1
+
+
+def test_schema_linking_token_budget(wide_schema, monkeypatch):
+    monkeypatch.setattr(settings, "schema_prompt_max_tokens", 300)
+    linker = SchemaLinker()
+    for question in ("Show the label and value of every metric", "Nothing here matches zzz"):
+        info = linker.table_info(wide_schema, question)
+        kept = [table for table in wide_schema.table_names if wide_schema.tables[table] in info]
+        # toutes les tables correspondent (ou aucune): le budget décide
+        assert 1 < len(kept) < len(wide_schema.table_names), question
+        assert estimate_tokens(info) <= 300
+    # sans correspondance, les tables sont prises dans l'ordre des noms
+    assert kept == wide_schema.table_names[:len(kept)]
+
+
+def test_schema_linking_sends_the_full_schema(wide_schema, monkeypatch):
+    linker = SchemaLinker()
+    question = "What is the average overall rating of players?"
+    # le schéma tient dans le budget par défaut
+    assert linker.table_info(wide_schema, question) == wide_schema.table_info
+    monkeypatch.setattr(settings, "schema_prompt_max_tokens", 300)
+    monkeypatch.setattr(settings, "schema_linking_enabled", False)
+    assert linker.table_info(wide_schema, question) == wide_schema.table_info
+    assert linker.stats() == {"indexes": 0, "pruned": 0, "full": 2}
+
+def test_fast_path_answers_without_llm(client, session_id):
+    response = ask(client, session_id, "What is the average age of players?")
+    assert response.status_code == 200, response.text
+    result = response.json()["result"]
+    assert result["fast_path"]["template"] == "aggregate"
+    assert result["sql_query"] == 'SELECT AVG("age") AS value FROM "players"'
+    assert result["answer"].startswith("The average age of players is ")
+
+    # questions with conditions the templates do not cover go to the LLM
+    result = ask(client, session_id, "How many players are older than 30?").json()["result"]
+    assert result["fast_path"] is None
+    assert result["answer_strategy"] == "scalar"
+
+
+def test_fast_path_failure_falls_back_to_the_llm(client, session_id, monkeypatch):
+    match = fast_path.match
+
+    def failing_match(question, schema):
+        found = match(question, schema)
+        # passe EXPLAIN QUERY PLAN, échoue à l'exécution (dépassement d'entier)
+        return found and replace(found, sql='SELECT abs(-9223372036854775807 - 1) AS value FROM "players"')
+
+    monkeypatch.setattr(fast_path, "match", failing_match)
+    question = "How many players are there?"
+    asked = ask(client, session_id, question).json()["result"]
+    with client.stream(
+        "POST", f"/api/v1/query/ask-question/{session_id}/stream", json={"question": question, "api_keys": API_KEYS}
+    ) as response:
+        streamed = [json.loads(line) for line in response.iter_lines() if line][-1]["result"]
+    for result in (asked, streamed):
+        assert result["fast_path"] is None
+        assert result["sql_query"] == "SELECT count(*) AS total FROM players"
+        assert result["answer"] == "The result is 2,000 (total)."
+
+
+def test_fast_path_templates_end_to_end(client, session_id, database_path):
+    def rows(sql):
+        connection = sqlite3.connect(database_path)
+        connection.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in connection.execute(sql)]
+        finally:
+            connection.close()
+
+    before = fast_path.stats()
+    count = ask(client, session_id, "How many clubs are there?").json()["result"]
+    assert count["fast_path"]["template"] == "count"
+    assert count["sql_query"] == 'SELECT count(*) AS total FROM "clubs"'
+    assert count["answer"] == f"There are {rows(count['sql_query'])[0]['total']} clubs."
+
+    with client.stream(
+        "POST", f"/api/v1/query/ask-question/{session_id}/stream",
+        json={"question": "Top 3 players by overall rating", "api_keys": API_KEYS}
+    ) as response:
+        top = [json.loads(line) for line in response.iter_lines() if line][-1]["result"]
+    assert top["fast_path"]["template"] == "top"
+    assert top["sql_query"].endswith('ORDER BY "overall_rating" DESC LIMIT 3')
+    assert top["query_result"]["data"] == rows(top["sql_query"])
+    assert top["answer"].startswith("Players by ")
+
+    response = client.post(
+        f"/api/v1/query/ask-questions/{session_id}",
+        json={"questions": ["What is the average age of players by nationality?"], "api_keys": API_KEYS}
+    )
+    assert response.status_code == 200, response.text
+    grouped = response.json()["results"][0]["result"]
+    assert grouped["fast_path"]["template"] == "grouped_aggregate"
+    assert grouped["sql_query"] == (
+        'SELECT "nationality", AVG("age") AS value FROM "players" GROUP BY "nationality" ORDER BY value DESC LIMIT 10'
+    )
+    assert grouped["query_result"]["data"] == rows(grouped["sql_query"])
+    assert grouped["answer"].startswith("Average age by nationality: ")
+
+    after = fast_path.stats()
+    assert after["matched"] - before["matched"] == 3
+    assert after["fallbacks"] == before["fallbacks"]
+
+
+def test_fast_path_rejected_by_the_preflight_falls_back_to_the_llm(client, session_id, monkeypatch):
+    # le gabarit parcourt toute la table; la requête du modèle passe par la clé primaire
+    monkeypatch.setattr(settings, "sql_preflight_max_cost", 100)
+    fallbacks = fast_path.stats()["fallbacks"]
+    result = ask(client, session_id, "What is the total age of players?").json()["result"]
+    assert result["fast_path"] is None
+    assert result["sql_query"] == "SELECT sum(age) AS value FROM players WHERE id <= 100"
+    assert fast_path.stats()["fallbacks"] == fallbacks + 1
+
+def wait_for_job(client, job_id, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/api/v1/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def test_job_submit_and_poll(client, session_id):
+    response = client.post(
+        f"/api/v1/jobs/{session_id}", json={"question": "How many players are there?", "api_keys": API_KEYS}
+    )
+    assert response.status_code == 202, response.text
+    job = wait_for_job(client, response.json()["job_id"])
+    assert job["status"] == "succeeded" and job["attempts"] == 1
+    assert job["result"]["query_result"]["data"] == [{"total": 2000}]
+    assert client.get("/api/v1/jobs/unknown").status_code == 404
+
+
+def test_job_retries_llm_errors_then_cancel(client, session_id, monkeypatch):
+    monkeypatch.setattr("config.settings.job_retry_backoff_seconds", 0.01)
+    answer_question = QueryService.answer_question
+    calls = []
+
+    async def flaky(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise LLMError("quota exceeded")
+        return await answer_question(self, *args, **kwargs)
+
+    monkeypatch.setattr(QueryService, "answer_question", flaky)
+    job_id = client.post(
+        f"/api/v1/jobs/{session_id}", json={"question": "How many players are there?", "api_keys": API_KEYS}
+    ).json()["job_id"]
+    job = wait_for_job(client, job_id)
+    assert job["status"] == "succeeded" and job["attempts"] == 2
+
+    async def slow(self, *args, **kwargs):
+        await asyncio.sleep(30)
+
+    monkeypatch.setattr(QueryService, "answer_question", slow)
+    job_id = client.post(
+        f"/api/v1/jobs/{session_id}", json={"question": "Who are the five oldest players?", "api_keys": API_KEYS}
+    ).json()["job_id"]
+    while client.get(f"/api/v1/jobs/{job_id}").json()["status"] == "queued":
+        time.sleep(0.05)
+    assert client.delete(f"/api/v1/jobs/{job_id}").status_code == 200
+    assert wait_for_job(client, job_id)["status"] == "cancelled"
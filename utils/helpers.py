@@ -0,0 +1,126 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import tempfile
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from config import settings
+from utils.metrics import metrics
+
+
+_sql_executor = ThreadPoolExecutor(
+    max_workers=settings.sql_executor_max_workers,
+    thread_name_prefix="sql"
+)
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+_llm_calls_in_flight = metrics.gauge("sql_qa_llm_calls_in_flight", "LLM calls holding a concurrency slot")
+
+
+def file_sha256(file_path, chunk_size: int = 1024 * 1024) -> str:
+    """Compute the sha256 of a file without loading it entirely in memory"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_json_atomic(file_path, data: Any):
+    """Write JSON to a temp file in the same folder then rename it into place"""
+    file_path = Path(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, strip accents and punctuation and collapse whitespace"""
+    text = unicodedata.normalize("NFKD", question)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[^\w\s.]|(?<!\d)\.|\.(?!\d)", " ", text)
+    return " ".join(text.split())
+
+
+async def run_blocking(func: Callable, *args, **kwargs):
+    """Run a blocking call (SQLite, file hashing...) on the bounded SQL thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_sql_executor, functools.partial(func, *args, **kwargs))
+
+
+class LLMError(Exception):
+    """A chat model call failed (network, quota, unparsable output): worth retrying later"""
+
+
+@asynccontextmanager
+async def llm_slot():
+    """Limit the number of in-flight LLM calls of this worker; their failures are raised as LLMError"""
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(settings.llm_max_concurrency)
+    async with _llm_semaphore:
+        with _llm_calls_in_flight.track():
+            try:
+                yield
+            except LLMError:
+                raise
+            except Exception as e:
+                raise LLMError(str(e)) from e
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls sharing a key: the first caller starts the
+    coroutine in a task, later callers await the same task. The result or
+    exception reaches every waiter; a waiter that is cancelled only leaves,
+    and the shared run is cancelled once no waiter is left.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "_Flight"] = {}
+        self.started = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._calls.get(key)
+        if flight is None:
+            flight = self._calls[key] = _Flight(asyncio.ensure_future(func()))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.started += 1
+        else:
+            self.shared += 1
+
+        flight.waiters += 1
+        try:
+            # shield: l'annulation d'un appelant ne doit pas annuler la tâche partagée
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "started": self.started, "shared": self.shared}
+
+    def _forget(self, key: Hashable, flight: "_Flight"):
+        if self._calls.get(key) is flight:
+            del self._calls[key]
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
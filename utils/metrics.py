@@ -0,0 +1,338 @@
+import bisect
+import contextvars
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import settings
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# secondes: de la lecture en cache (ms) à un appel LLM lent
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (name, type, help, [(labels, value)]) produced at scrape time by a collector
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+_current_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("stage", default=None)
+
+
+def current_stage() -> Optional[str]:
+    """Name of the innermost span running in this context (used to attribute LLM tokens)"""
+    return _current_stage.get()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any):
+        self.inc(-amount, **labels)
+
+    def track(self, **labels: Any) -> "_Tracked":
+        """Context manager counting the blocks currently inside it (in-flight gauges)"""
+        return _Tracked(self, labels)
+
+
+class _Tracked:
+    def __init__(self, gauge: Gauge, labels: Dict[str, Any]):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        self.gauge.inc(**self.labels)
+
+    def __exit__(self, *exc_info):
+        self.gauge.dec(**self.labels)
+
+    async def __aenter__(self):
+        self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labelnames, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [compteurs par bucket (non cumulés, +Inf en dernier), somme, nombre]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total, count in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class _Span:
+    """Times one stage; records it in the stage histogram and, if enabled, logs it as JSON"""
+
+    def __init__(self, registry: "MetricsRegistry", stage: str, fields: Dict[str, Any]):
+        self.registry = registry
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self) -> "_Span":
+        self._token = _current_stage.set(self.stage)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        try:
+            _current_stage.reset(self._token)
+        except ValueError:
+            # générateur fermé depuis un autre contexte (client déconnecté)
+            pass
+        outcome = "ok" if exc_type is None else "error"
+        self.registry.stage_duration.observe(elapsed, stage=self.stage, outcome=outcome)
+        if self.registry.log is not None:
+            self.registry.log.info(
+                "stage", stage=self.stage, outcome=outcome, duration_ms=round(elapsed * 1000, 3), **self.fields
+            )
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+    """
+    In-process metrics rendered in the Prometheus text format. Counters,
+    gauges and histograms are updated on the hot path; collectors add values
+    read from the services' own stats() at scrape time. When METRICS_ENABLED
+    is false every update returns immediately and span() is a shared no-op.
+    """
+
+    def __init__(self, enabled: bool = settings.metrics_enabled, log_json: bool = settings.metrics_log_json):
+        self.enabled = enabled
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+        self.log = self._structured_logger() if log_json else None
+        self.stage_duration = self.histogram(
+            "sql_qa_stage_duration_seconds", "Duration of each pipeline stage", ("stage", "outcome")
+        )
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def collector(self, func: Callable[[], Iterable[Family]]) -> Callable[[], Iterable[Family]]:
+        """Register a function returning metric families computed at scrape time"""
+        with self._lock:
+            self._collectors.append(func)
+        return func
+
+    def span(self, stage: str, **fields: Any):
+        """
+        with metrics.span("sql_generation", session_id=...): time a stage.
+        Fields only go to the JSON log, never to metric labels.
+        """
+        if not self.enabled and self.log is None:
+            return _NULL_SPAN
+        return _Span(self, stage, fields)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(_format_sample(name, labels, value) for name, labels, value in samples)
+        for collect in collectors:
+            for name, metric_type, help, samples in collect():
+                lines.append(f"# HELP {name} {_escape_help(help)}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(_format_sample(name, labels, value) for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def _register(self, cls, name: str, help: str, labelnames: Sequence[str], **kwargs) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self, name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with another type or labels")
+            return metric
+
+    @staticmethod
+    def _structured_logger():
+        # structlog n'est importé que si les logs JSON sont demandés
+        import structlog
+        structlog.configure(
+            processors=[
+                structlog.processors.add_log_level,
+                structlog.processors.TimeStamper(fmt="iso"),
+                structlog.processors.JSONRenderer(),
+            ],
+            cache_logger_on_first_use=True,
+        )
+        return structlog.get_logger("sql_qa")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by route template (not raw path,
+    so session ids do not explode the label set) and counting in-flight
+    requests. Streaming responses are timed until their last chunk.
+    """
+
+    def __init__(self, app, registry: "MetricsRegistry"):
+        self.app = app
+        self.registry = registry
+        self.in_flight = registry.gauge("sql_qa_http_requests_in_flight", "HTTP requests being served")
+        self.duration = registry.histogram(
+            "sql_qa_http_request_duration_seconds", "HTTP request duration", ("method", "route", "status")
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec()
+            self.duration.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=_route_template(scope),
+                status=status,
+            )
+
+
+def _route_template(scope) -> str:
+    """/api/v1/query/ask-question/{session_id} for /api/v1/query/ask-question/abc123"""
+    if scope.get("route") is None:
+        return "unmatched"
+    # route.path peut être relatif au routeur inclus: repartir du chemin réel
+    params = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(
+        f"{{{params[segment]}}}" if segment in params else segment for segment in scope["path"].split("/")
+    )
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if not labels:
+        return f"{name} {_format_value(value)}"
+    rendered = ",".join(
+        '{}="{}"'.format(key, str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, label in labels.items()
+    )
+    return f"{name}{{{rendered}}} {_format_value(value)}"
+
+
+metrics = MetricsRegistry()
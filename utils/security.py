@@ -0,0 +1,242 @@
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import settings
+
+
+class SQLSandboxError(Exception):
+    """Generated SQL was stopped by the execution sandbox"""
+    status_code = 400
+    code = "sql_sandbox_error"
+
+    def __init__(self, message: str, **limits: Any):
+        super().__init__(message)
+        self.message = message
+        self.limits = limits
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"error": self.code, "message": self.message, **self.limits}
+
+
+class QueryTimeoutError(SQLSandboxError):
+    status_code = 408
+    code = "query_timeout"
+
+
+class ResultTooLargeError(SQLSandboxError):
+    status_code = 413
+    code = "result_too_large"
+
+
+class TooManyQueriesError(SQLSandboxError):
+    status_code = 429
+    code = "too_many_concurrent_queries"
+
+
+class QueryRejectedError(SQLSandboxError):
+    status_code = 422
+    code = "query_rejected"
+
+
+# commentaires et littéraux, dont le contenu peut contenir ";" ou des mots-clés
+SQL_TOKEN_RE = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?(?:\*/|$)""", re.S
+)
+
+# what a read-only query compiles to (sqlite3_set_authorizer action codes)
+READ_ONLY_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, "SQLITE_RECURSIVE", 33),
+}
+SCHEMA_TABLES = {"sqlite_master", "sqlite_temp_master", "sqlite_schema", "sqlite_temp_schema"}
+
+
+def sql_code(sql: str) -> str:
+    """The SQL text with comments dropped and quoted literals and identifiers emptied"""
+    def blank(match: re.Match) -> str:
+        token = match.group(0)
+        if token.startswith(("--", "/*")):
+            return " "
+        return token[0] + (token[-1] if len(token) > 1 else "")
+
+    return SQL_TOKEN_RE.sub(blank, sql)
+
+
+def is_single_statement(sql: str) -> bool:
+    """False when the text holds more than one statement (a trailing ";" is allowed)"""
+    code = sql_code(sql).strip()
+    while code.endswith(";"):
+        code = code[:-1].rstrip()
+    return bool(code) and ";" not in code
+
+
+def _read_only_authorizer(action: int, arg1, arg2, database, trigger) -> int:
+    if action in READ_ONLY_ACTIONS:
+        return sqlite3.SQLITE_OK
+    # SQLite relit sqlite_master par une mise à jour interne quand une table virtuelle est chargée
+    if action == sqlite3.SQLITE_UPDATE and arg1 in SCHEMA_TABLES:
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+@contextmanager
+def read_only_statements(dbapi_connection):
+    """
+    Statements compiled on the connection meanwhile may only read: writes,
+    DDL, PRAGMA, ATTACH and transactions fail with "not authorized". The check
+    is made by SQLite on the compiled statement, not on the SQL text.
+    """
+    dbapi_connection.set_authorizer(_read_only_authorizer)
+    try:
+        yield
+    finally:
+        dbapi_connection.set_authorizer(None)
+
+
+def harden_engine(engine: Engine) -> Engine:
+    """Every pooled connection refuses writes, whatever the file permissions"""
+
+    @event.listens_for(engine, "connect")
+    def _set_query_only(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA query_only = ON")
+
+    return engine
+
+
+class SQLSandbox:
+    """
+    Resource limits around the execution of generated SQL: read-only
+    statements, a wall-clock deadline enforced through SQLite's progress
+    handler, caps on returned rows and bytes, and a cap on concurrent
+    queries per session.
+    """
+
+    def __init__(
+        self,
+        timeout_seconds: float = settings.sql_timeout_seconds,
+        max_rows: int = settings.sql_max_rows,
+        max_bytes: int = settings.sql_max_result_bytes,
+        max_concurrent_per_session: int = settings.sql_max_concurrent_per_session
+    ):
+        self.timeout_seconds = timeout_seconds
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_concurrent_per_session = max_concurrent_per_session
+        # requêtes en cours par session: une session sans requête n'a pas d'entrée
+        self._running: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session_slot(self, session_id: str):
+        """Reserve one of the session's query slots, or fail immediately"""
+        with self._lock:
+            running = self._running.get(session_id, 0)
+            if running >= self.max_concurrent_per_session:
+                raise TooManyQueriesError(
+                    f"Session {session_id} already has {self.max_concurrent_per_session} queries running",
+                    max_concurrent=self.max_concurrent_per_session
+                )
+            self._running[session_id] = running + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._running[session_id] > 1:
+                    self._running[session_id] -= 1
+                else:
+                    del self._running[session_id]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"sessions": len(self._running), "running_queries": sum(self._running.values())}
+
+    def start(
+        self,
+        dbapi_connection,
+        timeout_seconds: Optional[float] = None,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None
+    ) -> "QueryBudget":
+        """
+        Install the deadline and the read-only authorizer on a raw sqlite3
+        connection and return the row/byte budget. Limits default to the
+        sandbox's; exports pass larger ones.
+        """
+        budget = QueryBudget(
+            timeout_seconds if timeout_seconds is not None else self.timeout_seconds,
+            max_rows if max_rows is not None else self.max_rows,
+            max_bytes if max_bytes is not None else self.max_bytes
+        )
+        dbapi_connection.set_progress_handler(budget.interrupted, settings.sql_progress_interval)
+        # indépendant du pre-flight, qui peut être désactivé
+        dbapi_connection.set_authorizer(_read_only_authorizer)
+        return budget
+
+    @staticmethod
+    def stop(dbapi_connection):
+        dbapi_connection.set_progress_handler(None, 0)
+        dbapi_connection.set_authorizer(None)
+
+
+class QueryBudget:
+    """Deadline and row/byte counters of one running query"""
+
+    def __init__(self, timeout_seconds: float, max_rows: int, max_bytes: int):
+        self.timeout_seconds = timeout_seconds
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.deadline = time.monotonic() + timeout_seconds
+        self.timed_out = False
+        self.rows = 0
+        self.bytes = 0
+
+    def interrupted(self) -> int:
+        # appelé par SQLite toutes les N instructions: une valeur non nulle interrompt la requête
+        if time.monotonic() > self.deadline:
+            self.timed_out = True
+            return 1
+        return 0
+
+    def check_timeout(self, error: Exception):
+        """Turn SQLite's 'interrupted' error into a structured timeout"""
+        if self.timed_out:
+            raise QueryTimeoutError(
+                f"Query exceeded the {self.timeout_seconds}s time limit",
+                timeout_seconds=self.timeout_seconds
+            ) from error
+
+    def consume(self, rows: Sequence[Sequence[Any]]):
+        self.rows += len(rows)
+        self.bytes += sum(_row_size(row) for row in rows)
+        if self.rows > self.max_rows:
+            raise ResultTooLargeError(
+                f"Query returned more than {self.max_rows} rows",
+                max_rows=self.max_rows
+            )
+        if self.bytes > self.max_bytes:
+            raise ResultTooLargeError(
+                f"Query returned more than {self.max_bytes} bytes",
+                max_bytes=self.max_bytes
+            )
+
+
+def _row_size(row: Sequence[Any]) -> int:
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+
+sql_sandbox = SQLSandbox()